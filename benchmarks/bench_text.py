@@ -0,0 +1,56 @@
+"""
+html_to_text against the BeautifulSoup conversion it replaced
+
+    python -m benchmarks.bench_text
+"""
+import timeit
+
+from bs4 import BeautifulSoup
+
+from leno.text import TextExtractor, html_to_text
+
+STATUS = (
+    '<p>Reading <a href="https://example.com/a/very/long/path" rel="nofollow">'
+    '<span class="invisible">https://</span><span class="ellipsis">example.com/a/'
+    'very</span><span class="invisible">/long/path</span></a> with '
+    '<span class="h-card"><a href="https://ioc.exchange/@leno" class="u-url '
+    'mention">@<span>leno</span></a></span> &amp; friends</p><p>'
+    '<a href="https://ioc.exchange/tags/python" class="mention hashtag">#'
+    "<span>python</span></a> is great<br>more soon</p>"
+)
+
+
+def beautifulsoup(content: str) -> str:
+    return BeautifulSoup(content, "html.parser").text
+
+
+def extractor(content: str) -> str:
+    parser = TextExtractor()
+    parser.feed(content)
+    parser.close()
+    return parser.text()
+
+
+def memoized(contents: list[str]) -> list[str]:
+    # Cold cache every run
+    html_to_text.cache_clear()
+    return [html_to_text(c) for c in contents]
+
+
+def main(statuses: int = 2000) -> None:
+    # Distinct statuses, plus the same set again as favourites
+    contents = [f"{STATUS}<p>{i}</p>" for i in range(statuses)]
+    hose = contents + contents
+
+    candidates = {
+        "beautifulsoup": lambda: [beautifulsoup(c) for c in hose],
+        "extractor": lambda: [extractor(c) for c in hose],
+        "html_to_text (memoized)": lambda: memoized(hose),
+    }
+    for name, candidate in candidates.items():
+        seconds = min(timeit.repeat(candidate, number=1, repeat=3))
+        print(f"{name:>24}: {seconds * 1000:8.1f} ms ({len(hose) / seconds:,.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
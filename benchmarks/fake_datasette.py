@@ -0,0 +1,85 @@
+"""
+Stand-in for datasette serving synthetic mastodon/github tables
+
+Rows are generated from their index on request, newest first, so tables of a
+million rows cost no memory. Understands the arguments Leno sends: _shape,
+_sort/_sort_desc (on the timestamp column), _size and _next.
+"""
+import datetime
+import json
+
+import httpx
+
+EPOCH = datetime.datetime(2023, 8, 1, tzinfo=datetime.UTC)
+MAX_SIZE = 1000
+
+
+def mastodon_row(i: int) -> dict:
+    created = EPOCH - datetime.timedelta(minutes=i)
+    return {
+        "id": str(110000000000000000 + i),
+        "username": f"user{i % 100}",
+        "content": (
+            f'<p>Status {i} about <a href="https://example.com/{i}">things</a> '
+            f'<a href="https://ioc.exchange/tags/leno">#<span>leno</span></a></p>'
+        ),
+        "created_at": created.isoformat().replace("+00:00", ".000Z"),
+        "url": f"https://ioc.exchange/@user{i % 100}",
+    }
+
+
+def github_release_row(i: int) -> dict:
+    published = EPOCH - datetime.timedelta(minutes=i, seconds=30)
+    return {
+        "id": i,
+        "repo": {"value": i % 10, "label": f"cadeef/repo{i % 10}"},
+        "tag_name": f"v0.{i}.0",
+        "body": f"Release {i}\n\n- fixed things",
+        "published_at": published.isoformat().replace("+00:00", "Z"),
+        "html_url": f"https://github.com/cadeef/repo{i % 10}/releases/v0.{i}.0",
+    }
+
+
+TABLES = {
+    "/mastodon/bookmarks.json": mastodon_row,
+    "/mastodon/favorites.json": mastodon_row,
+    "/github/releases.json": github_release_row,
+}
+
+
+class FakeDatasette:
+    """
+    httpx transport handler, use with httpx.MockTransport(FakeDatasette(rows))
+    """
+
+    def __init__(self, rows: int) -> None:
+        self.rows = rows
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        make_row = TABLES.get(request.url.path)
+        if make_row is None:
+            return httpx.Response(404, json={"ok": False})
+
+        params = request.url.params
+        size = min(int(params.get("_size", 100)), MAX_SIZE)
+        start = int(params.get("_next", 0))
+        end = min(start + size, self.rows)
+        indexes = range(start, end)
+        # Rows are generated newest first
+        if "_sort" in params:
+            indexes = range(self.rows - 1 - start, self.rows - 1 - end, -1)
+        rows = [make_row(i) for i in indexes]
+
+        if params.get("_shape") == "array":
+            body = rows
+        else:
+            body = {"rows": rows, "next": str(end) if end < self.rows else None}
+
+        content = json.dumps(body).encode()
+        self.bytes_sent += len(content)
+        return httpx.Response(
+            200, content=content, headers={"content-type": "application/json"}
+        )
@@ -0,0 +1,232 @@
+"""
+Benchmarks for firehose, fetching, Query URL building and source updates
+
+    python -m benchmarks.run --rows 1000 --rows 100000 --limit 20 --limit 1000 \
+        --output bench.json --compare previous.json
+
+Results are written as JSON so runs from different commits can be compared.
+"""
+import datetime
+import functools
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Annotated, Callable, Optional
+from unittest import mock
+
+import httpx
+import typer
+from typer.testing import CliRunner
+
+from leno.cli import app as leno_app
+from leno.lib import Leno, Query
+from leno.source import Source
+
+from .fake_datasette import FakeDatasette
+
+URL = "http://127.0.0.1:8001"
+TOKEN = "a-very-nice-token-for-benchmarking"
+
+app = typer.Typer()
+
+
+def measure(name: str, run: Callable[[], int], repeat: int = 3, **params) -> dict:
+    """
+    Best of repeat wall clock, plus peak memory of one extra traced run
+
+    :param run: benchmark body, returns the number of items it produced
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = run()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(timings)
+    result = {
+        "name": name,
+        "params": params,
+        "seconds": seconds,
+        "peak_memory": peak,
+        "items": items,
+        "items_per_sec": items / seconds if seconds else None,
+    }
+    print(
+        f"{name:>16} {json.dumps(params):<32} {seconds * 1000:10.2f} ms "
+        f"{peak / 1024 / 1024:8.2f} MiB {result['items_per_sec'] or 0:14,.0f} items/s"
+    )
+    return result
+
+
+def fake_leno(rows: int) -> Leno:
+    return Leno(URL, TOKEN, transport=httpx.MockTransport(FakeDatasette(rows)))
+
+
+def bench_query(iterations: int = 10_000) -> dict:
+    def run() -> int:
+        for _ in range(iterations):
+            query = Query.from_url(f"{URL}/github/releases.json?_labels=on")
+            query.sort("published_at", reverse=True)
+            query.limit(20)
+            query.url()
+        return iterations
+
+    return measure("query_url", run)
+
+
+def bench_fetch_json(rows: int) -> dict:
+    leno = fake_leno(rows)
+    return measure(
+        "fetch_json",
+        lambda: len(leno.fetch_json("/mastodon/bookmarks.json?_size=1000")),
+        rows=rows,
+    )
+
+
+def bench_firehose(rows: int, limit: int) -> dict:
+    leno = fake_leno(rows)
+    return measure(
+        "firehose",
+        lambda: sum(1 for _ in leno.firehose(limit=limit)),
+        rows=rows,
+        limit=limit,
+    )
+
+
+def bench_firehose_command(rows: int, limit: int) -> dict:
+    cli = CliRunner()
+    transport = httpx.MockTransport(FakeDatasette(rows))
+
+    def run() -> int:
+        with mock.patch("leno.lib.Leno", functools.partial(Leno, transport=transport)):
+            result = cli.invoke(
+                leno_app,
+                ["firehose", "--limit", str(limit), "--no-cache", "--token", TOKEN],
+            )
+        assert result.exit_code == 0, result.output
+        return limit
+
+    return measure("firehose_cli", run, rows=rows, limit=limit)
+
+
+class SyntheticSource(Source):
+    """Writes rows into every data point, no network involved"""
+
+    name = "synthetic"
+    data_points = ["bookmarks", "favourites", "followers", "followings", "statuses"]
+
+    def __init__(self, data_dir: Path, venv: Path, rows: int) -> None:
+        super().__init__(data_dir, venv)
+        self.rows = rows
+
+    def update(self) -> bool:
+        script = (
+            "import sqlite_utils, sys; "
+            "sqlite_utils.Database(sys.argv[2])[sys.argv[1]].upsert_all("
+            "({'id': i, 'text': 'x' * 200} for i in range(int(sys.argv[3]))),"
+            "pk='id')"
+        )
+        self.update_data_points(
+            self.data_points,
+            lambda data_point, database: [
+                sys.executable,
+                "-c",
+                script,
+                data_point,
+                database,
+                str(self.rows),
+            ],
+        )
+        return True
+
+
+def bench_source_update(rows: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        src = SyntheticSource(Path(tmp), Path(tmp) / "venv", rows)
+
+        def run() -> int:
+            src.update()
+            return rows * len(src.data_points)
+
+        return measure("source_update", run, repeat=1, rows=rows)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], previous: dict) -> None:
+    """
+    Print the change of every benchmark also present in previous
+    """
+    before = {
+        (r["name"], json.dumps(r["params"], sort_keys=True)): r
+        for r in previous["results"]
+    }
+    print(f"\nCompared to {previous.get('commit')}:")
+    for r in results:
+        old = before.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if old:
+            print(
+                f"{r['name']:>16} {json.dumps(r['params']):<32} "
+                f"time {r['seconds'] / old['seconds']:6.2f}x "
+                f"memory {r['peak_memory'] / max(old['peak_memory'], 1):6.2f}x"
+            )
+
+
+@app.command()
+def main(
+    rows: Annotated[
+        Optional[list[int]], typer.Option(help="Rows per fake datasette table")
+    ] = None,
+    limit: Annotated[
+        Optional[list[int]], typer.Option(help="Firehose --limit values")
+    ] = None,
+    update_rows: Annotated[
+        int, typer.Option(help="Rows per data point of the synthetic update")
+    ] = 10_000,
+    output: Annotated[Optional[Path], typer.Option(help="Write JSON here")] = None,
+    compare_to: Annotated[
+        Optional[Path], typer.Option("--compare", help="Previous JSON results")
+    ] = None,
+) -> None:
+    results = [bench_query()]
+    for table_rows in rows or [1_000, 100_000, 1_000_000]:
+        results.append(bench_fetch_json(table_rows))
+        for n in limit or [20, 1_000, 10_000]:
+            results.append(bench_firehose(table_rows, n))
+        results.append(bench_firehose_command(table_rows, 20))
+    results.append(bench_source_update(update_rows))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "timestamp": datetime.datetime.now(datetime.UTC).isoformat(),
+        "results": results,
+    }
+    if output:
+        output.write_text(json.dumps(report, indent=2))
+    if compare_to:
+        compare(results, json.loads(compare_to.read_text()))
+
+
+if __name__ == "__main__":
+    app()
@@ -1,15 +1,41 @@
+import datetime
 import importlib.metadata
+import json
+import os
+import sqlite3
+import sys
+import time
 from enum import Enum
 from pathlib import Path
-from typing import Annotated, Optional
+from typing import Annotated, BinaryIO, Callable, Iterable, Optional
 
 import typer
-from devtools import debug  # noqa: F401
 from rich import print
-from rich.progress import Progress, SpinnerColumn, TextColumn
+from rich.markup import escape
 
-from .lib import Leno, LenoException
-from .source import Source, get_source, get_sources
+from .cache import ResponseCache
+from .item import Item
+from .optimize import FRAGMENTATION
+from .optimize import optimize as optimize_database
+from .publish import publish as publish_databases
+from .refresh import refresh
+from .runner import parse_progress
+from .search import MATCH_END, MATCH_START
+from .search import search as search_documents
+from .source import (
+    Source,
+    SourceException,
+    get_source,
+    get_sources,
+    install_packages,
+    update_sources,
+)
+from .stats import Run, record_run, rows_added, summarize, table_marks
+
+# from devtools import debug  # noqa: F401
+
+# httpx (.lib), sqlite_utils and rich.progress are imported by the commands that
+# need them, keeping startup fast for --version, --list-sources and friends
 
 APP_NAME = "leno"
 INSTANCE_URL = "http://127.0.0.1:8001"
@@ -45,8 +71,43 @@ def main(
 def update(
     ctx: typer.Context,
     source: Annotated[
-        Optional[str], typer.Option("--source", "-s", help="Data source")
+        Optional[list[str]],
+        typer.Option("--source", "-s", help="Data source, may be repeated"),
+    ] = None,
+    all_sources: Annotated[
+        bool, typer.Option("--all", "-a", help="Update every enabled source")
+    ] = False,
+    jobs: Annotated[
+        int, typer.Option("--jobs", "-j", help="Sources updated at the same time")
+    ] = 4,
+    concurrency: Annotated[
+        int,
+        typer.Option(help="Data points of a source collected at the same time"),
+    ] = 4,
+    timeout: Annotated[
+        Optional[float],
+        typer.Option("--timeout", help="Seconds each source may spend updating"),
     ] = None,
+    full: Annotated[
+        bool,
+        typer.Option(
+            "--full",
+            help="Ignore watermarks and resync, mastodon always refetches everything",
+        ),
+    ] = False,
+    optimize: Annotated[
+        bool,
+        typer.Option(
+            "--optimize", help="Index, analyze and vacuum the updated databases"
+        ),
+    ] = False,
+    publish: Annotated[
+        bool,
+        typer.Option(
+            "--publish",
+            help="Publish changed databases and their inspect file for datasette -i",
+        ),
+    ] = False,
     list_sources: Annotated[
         bool, typer.Option("--list-sources", "-l", help="List available sources")
     ] = False,
@@ -63,12 +124,12 @@ def update(
     # FIXME: ☝️ Default shouldn't be firefox, something more general like remote
 
     if list_sources:
-        for s in get_sources():
-            print(s)
+        for name, entry in get_sources().items():
+            print(f"{name}: {entry.description}")
         raise typer.Exit()
 
-    if not source:
-        print(":x: --source is required to update")
+    if not source and not all_sources:
+        print(":x: --source or --all is required to update")
         raise typer.Exit(code=1)
 
     # Bail if passed --data-dir doesn't exist
@@ -87,30 +148,291 @@ def update(
     else:
         data_path = data_dir
 
+    names = list(get_sources()) if all_sources else list(dict.fromkeys(source or []))
+    sources: list[Source] = []
+    for name in names:
+        try:
+            src = get_source(name, data_path, ctx.obj["venv"])
+        except SourceException as error:
+            print(f":x: {error}")
+            raise typer.Exit(code=1)
+
+        if not src.enabled:
+            # Only complain about sources that were explicitly asked for
+            if not all_sources:
+                print(f":x: Source ({name}) is currently disabled.")
+            continue
+        src.full = full
+        src.concurrency = concurrency
+        src.log_dir = ctx.obj["app_dir"] / "logs"
+        sources.append(src)
+
+    if not sources:
+        raise typer.Exit()
+
+    from rich.progress import (
+        Progress,
+        SpinnerColumn,
+        TaskProgressColumn,
+        TextColumn,
+        TimeElapsedColumn,
+    )
+
     with Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
+        TaskProgressColumn(),
+        TimeElapsedColumn(),
         transient=True,
     ) as progress:
+        # One pip run for every source that's missing packages
+        missing = [src for src in sources if not src.is_installed()]
+        if missing:
+            install = progress.add_task(description="Installing...", total=None)
+            try:
+                install_packages(
+                    ctx.obj["venv"], [pkg for src in missing for pkg in src.packages]
+                )
+            except Exception as error:
+                print(f":x: Failed to install sources: {error}")
+                raise typer.Exit(code=1)
+            finally:
+                progress.remove_task(install)
+
+        tasks = {
+            src.name: progress.add_task(description=f"{src.name}: queued", total=None)
+            for src in sources
+        }
+
+        def output(src: Source) -> Callable[[str], None]:
+            task = tasks[src.name]
+
+            def show(line: str) -> None:
+                line = line.strip()
+                if not line:
+                    return
+                description = f"{src.name}: {escape(line[:60])}"
+                fraction = parse_progress(line)
+                if fraction is None:
+                    progress.update(task, description=description)
+                else:
+                    progress.update(
+                        task, description=description, total=1, completed=fraction
+                    )
+
+            return show
+
+        for src in sources:
+            src.on_output = output(src)
+
+        # Largest rowid per table before each source updated, and when it started
+        marks: dict[str, dict[str, int]] = {}
+        starts: dict[str, float] = {}
+        # Sources that updated but whose timeline, search or optimize step failed
+        refresh_errors: dict[str, BaseException] = {}
+
+        def started(src: Source) -> None:
+            marks[src.name] = table_marks(src.database)
+            starts[src.name] = time.time()
+            progress.update(tasks[src.name], description=f"{src.name}: updating...")
+
+        def done(src: Source, error: BaseException | None) -> None:
+            progress.remove_task(tasks[src.name])
+            steps = {step: result.duration for step, result in src.commands.items()}
+            if error is None:
+                try:
+                    steps.update(refresh(src, optimize=optimize))
+                except Exception as exc:
+                    # Recorded as the source's failure, the others keep going
+                    error = refresh_errors[src.name] = exc
+            if error is None:
+                progress.console.print(
+                    f":white_check_mark: Source ({src.name}) updated."
+                )
+
+            record_run(
+                ctx.obj["app_dir"],
+                Run(
+                    source=src.name,
+                    started_at=starts.get(src.name, time.time()),
+                    ended_at=time.time(),
+                    ok=error is None,
+                    steps=steps,
+                    rows_added=rows_added(
+                        marks.get(src.name, {}), table_marks(src.database)
+                    ),
+                    db_size=src.database.stat().st_size
+                    if src.database.is_file()
+                    else 0,
+                    error=None if error is None else f"{type(error).__name__}: {error}",
+                ),
+            )
+
+        results = update_sources(
+            sources, jobs=jobs, timeout=timeout, on_start=started, on_done=done
+        )
+
+    failures = {name: exc for name, exc in results.items() if exc is not None}
+    failures.update(refresh_errors)
+    for name, exc in failures.items():
+        print(f":x: Source ({name}) failed: {type(exc).__name__}: {exc}")
+
+    if publish:
+        for name in publish_databases(data_path):
+            print(f":white_check_mark: Published {name}")
+
+    if failures:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def daemon(
+    ctx: typer.Context,
+    source: Annotated[
+        Optional[list[str]],
+        typer.Option("--source", "-s", help="Data source, defaults to all enabled"),
+    ] = None,
+    jobs: Annotated[
+        int, typer.Option("--jobs", "-j", help="Sources updated at the same time")
+    ] = 2,
+    timeout: Annotated[
+        Optional[float],
+        typer.Option("--timeout", help="Seconds each source may spend updating"),
+    ] = None,
+    optimize: Annotated[
+        bool,
+        typer.Option(
+            "--optimize", help="Index, analyze and vacuum the updated databases"
+        ),
+    ] = False,
+    status: Annotated[
+        bool, typer.Option("--status", help="Show what the daemon is up to and exit")
+    ] = False,
+    data_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--data-dir", "-d", help="Data directory where databases are stored"
+        ),
+    ] = None,
+) -> None:
+    """
+    Keep updating sources, each on its own interval
+    """
+    if status:
+        _print_daemon_status(ctx.obj["app_dir"])
+        raise typer.Exit()
+
+    import asyncio
+
+    import httpx
+
+    from .daemon import Daemon
+
+    data_path = data_dir or ctx.obj["data_dir"]
+    data_path.mkdir(parents=True, exist_ok=True)
+    try:
+        sources = [
+            get_source(name, data_path, ctx.obj["venv"])
+            for name in source or get_sources()
+        ]
+    except SourceException as error:
+        print(f":x: {error}")
+        raise typer.Exit(code=1)
+    sources = [src for src in sources if src.enabled]
+
+    missing = [src for src in sources if not src.is_installed()]
+    if missing:
+        install_packages(
+            ctx.obj["venv"], [pkg for src in missing for pkg in src.packages]
+        )
+
+    # One warm connection pool for every in-process collector
+    with httpx.Client(timeout=30.0) as client:
+        for src in sources:
+            src.client = client
+            src.log_dir = ctx.obj["app_dir"] / "logs"
+
+        print(f"Updating {', '.join(src.name for src in sources)}, ^C to stop")
         try:
-            src: Source = get_source(source, data_path, ctx.obj["venv"])
+            asyncio.run(
+                Daemon(
+                    sources,
+                    ctx.obj["app_dir"],
+                    jobs=jobs,
+                    timeout=timeout,
+                    optimize=optimize,
+                ).run()
+            )
+        except KeyboardInterrupt:
+            print("Stopped")
 
-            if not src.enabled:
-                print(f":x: Source ({source}) is currently disabled.")
-                raise typer.Exit()
 
-            if not src.is_installed():
-                install = progress.add_task(description="Installing...", total=None)
-                src.install()
-                progress.remove_task(install)
+def _print_daemon_status(app_dir: Path) -> None:
+    from .daemon import read_status
 
-            progress.add_task(description="Updating...", total=None)
-            src.update()
-        except LenoException as error:
-            print(f":x: {error}")
+    state = read_status(app_dir)
+    if state is None:
+        print(":x: The daemon never ran")
+        raise typer.Exit(code=1)
+
+    updated = datetime.datetime.fromtimestamp(state["updated_at"])
+    print(
+        f"Daemon {'stopped' if state['stopped'] else 'running'} "
+        f"(pid {state['pid']}), last change {updated:%Y-%m-%d %H:%M:%S}"
+    )
+    now = time.time()
+    for name, schedule in state["sources"].items():
+        if schedule["running"]:
+            line = "updating"
+        else:
+            line = f"next in {max(schedule['next_run'] - now, 0) / 60:.0f}m"
+        if schedule["last_duration"] is not None:
+            line += f", last took {schedule['last_duration']:.1f}s"
+        if schedule["failures"]:
+            line += (
+                f", [red]{schedule['failures']} failures[/red]: "
+                f"{escape(schedule['last_error'] or '')}"
+            )
+        print(f"{name}: {line}")
+
+
+@app.command()
+def install(
+    ctx: typer.Context,
+    source: Annotated[
+        Optional[list[str]],
+        typer.Option("--source", "-s", help="Data source, defaults to all enabled"),
+    ] = None,
+) -> None:
+    """
+    Install the collectors of data sources
+    """
+    try:
+        sources = [
+            get_source(name, ctx.obj["data_dir"], ctx.obj["venv"])
+            for name in source or get_sources()
+        ]
+    except SourceException as error:
+        print(f":x: {error}")
+        raise typer.Exit(code=1)
+
+    from rich.progress import Progress, SpinnerColumn, TextColumn
+
+    packages = [pkg for src in sources if src.enabled for pkg in src.packages]
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        transient=True,
+    ) as progress:
+        progress.add_task(description="Installing...", total=None)
+        try:
+            installed = install_packages(ctx.obj["venv"], packages)
+        except Exception as error:
+            print(f":x: Failed to install sources: {error}")
             raise typer.Exit(code=1)
 
-    print(f":white_check_mark: Source ({source}) updated.")
+    for pkg in sorted(installed):
+        print(f":white_check_mark: Installed {pkg}")
 
 
 class OutputEnum(str, Enum):
@@ -118,28 +440,95 @@ class OutputEnum(str, Enum):
     json = "json"
 
 
+def write_ndjson(items: Iterable[Item], stream: BinaryIO, batch: int = 512) -> int:
+    """
+    Write items as newline delimited JSON while they are produced, returns the
+    number of items written
+
+    :param items: items to write, consumed lazily
+    :param stream: binary stream, e.g. sys.stdout.buffer
+    :param batch: lines encoded per write
+    """
+    encode = json.JSONEncoder(
+        ensure_ascii=False, check_circular=False, separators=(",", ":")
+    ).encode
+    lines: list[str] = []
+    written = 0
+    for item in items:
+        lines.append(encode(item.to_dict()))
+        if len(lines) >= batch:
+            stream.write(("\n".join(lines) + "\n").encode())
+            written += len(lines)
+            lines.clear()
+    if lines:
+        stream.write(("\n".join(lines) + "\n").encode())
+        written += len(lines)
+    stream.flush()
+    return written
+
+
 @app.command()
 def firehose(
     ctx: typer.Context,
     output: OutputEnum = OutputEnum.plain,
-    limit: int = 20,
+    limit: Annotated[
+        int, typer.Option(min=0, help="Maximum number of items to show")
+    ] = 20,
     datasette_url: str = typer.Option(default=INSTANCE_URL, envvar="LENO_URL"),
-    token: str = typer.Option(envvar="LENO_TOKEN"),
+    token: str = typer.Option("", envvar="LENO_TOKEN"),
+    local: Annotated[
+        bool,
+        typer.Option(
+            "--local", help="Read the databases in the data directory directly"
+        ),
+    ] = False,
+    data_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--data-dir", "-d", help="Data directory where databases are stored"
+        ),
+    ] = None,
+    timeline: Annotated[
+        bool,
+        typer.Option(
+            "--timeline", help="Read datasette's materialized timeline database"
+        ),
+    ] = False,
+    no_cache: Annotated[
+        bool, typer.Option("--no-cache", help="Bypass the local response cache")
+    ] = False,
+    cache_ttl: Annotated[
+        int,
+        typer.Option(help="Seconds a cached response is used before revalidating"),
+    ] = 300,
 ) -> None:
     """
     Everything, I mean everything
     """
-    if not token:
-        print(":x: Leno API token required. Set LENO_TOKEN or --token")
-        raise typer.Exit(code=1)
+    from .lib import Leno, LocalLeno
+
+    if local:
+        items = LocalLeno(data_dir or ctx.obj["data_dir"]).firehose(limit=limit)
+    else:
+        if not token:
+            print(":x: Leno API token required. Set LENO_TOKEN or --token")
+            raise typer.Exit(code=1)
+
+        cache = None
+        if not no_cache:
+            cache = ResponseCache(ctx.obj["app_dir"] / "cache.db", ttl=cache_ttl)
+        leno = Leno(datasette_url, token, cache=cache)
+        items = leno.firehose(limit=limit, timeline=timeline)
 
-    leno = Leno(datasette_url, token)
-    items = leno.firehose()
+    if output == OutputEnum.json:
+        try:
+            write_ndjson(items, sys.stdout.buffer)
+        except BrokenPipeError:
+            # Reader went away (e.g. | head), don't complain when exiting
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
 
-    cnt = 0
     for item in items:
-        if cnt == limit:
-            break
         description = item.description
         if len(item.description) > 100:
             description = item.description[:100].strip() + "..."
@@ -150,9 +539,189 @@ def firehose(
             description = description.strip("[/satire]")
 
         print(
-            f"\[{item.label}] [bold]{item.title}[/bold]: {description} ({item.timestamp})"  # noqa: E501
+            f"\[{item.label}] [bold]{item.title}[/bold]: {description} ({item.when:%Y-%m-%d %H:%M})"  # noqa: E501
         )
-        cnt += 1
+
+
+@app.command()
+def search(
+    ctx: typer.Context,
+    query: Annotated[str, typer.Argument(help="Full-text (FTS5) query")],
+    source: Annotated[
+        Optional[list[str]],
+        typer.Option("--source", "-s", help="Only this source, may be repeated"),
+    ] = None,
+    since: Annotated[
+        Optional[datetime.datetime],
+        typer.Option(help="Only documents from this date (UTC) on"),
+    ] = None,
+    until: Annotated[
+        Optional[datetime.datetime],
+        typer.Option(help="Only documents before this date (UTC)"),
+    ] = None,
+    limit: int = 20,
+    data_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--data-dir", "-d", help="Data directory where databases are stored"
+        ),
+    ] = None,
+) -> None:
+    """
+    Search everything collected
+    """
+
+    def epoch(value: datetime.datetime | None) -> int | None:
+        if value is None:
+            return None
+        return int(value.replace(tzinfo=value.tzinfo or datetime.UTC).timestamp())
+
+    results = search_documents(
+        data_dir or ctx.obj["data_dir"],
+        query,
+        sources=source or [],
+        since=epoch(since),
+        until=epoch(until),
+        limit=limit,
+    )
+    try:
+        for item in results:
+            snippet = escape(item.description.replace("\n", " "))
+            snippet = snippet.replace(MATCH_START, "[bold]").replace(
+                MATCH_END, "[/bold]"
+            )
+            print(
+                f"\\[{item.label}] [bold]{escape(item.title)}[/bold]: {snippet} "
+                f"({item.when:%Y-%m-%d}) {item.link or ''}"
+            )
+    except sqlite3.OperationalError as error:
+        print(f":x: Invalid search: {error}")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def stats(
+    ctx: typer.Context,
+    source: Annotated[
+        Optional[list[str]],
+        typer.Option("--source", "-s", help="Only show this source, repeatable"),
+    ] = None,
+    last: Annotated[
+        int, typer.Option("--last", "-n", help="Recent runs per source to consider")
+    ] = 100,
+) -> None:
+    """
+    How long updates take and how fast the databases grow
+    """
+    from rich.table import Table
+
+    summaries = summarize(ctx.obj["app_dir"], source or (), last=last)
+    if not summaries:
+        print(":x: No updates recorded yet")
+        raise typer.Exit(code=1)
+
+    table = Table("Source", "Runs", "Failed", "p50", "p95", "Rows/s", "Size", "Growth")
+    for s in summaries:
+        growth = "-"
+        if s.bytes_per_day is not None and s.rows_per_day is not None:
+            growth = f"{_size(s.bytes_per_day)}/day, {s.rows_per_day:,.0f} rows/day"
+        table.add_row(
+            s.source,
+            str(s.runs),
+            str(s.failures),
+            f"{s.p50:.1f}s",
+            f"{s.p95:.1f}s",
+            f"{s.rows_per_sec:,.0f}",
+            _size(s.db_size),
+            growth,
+        )
+    print(table)
+
+
+@app.command()
+def optimize(
+    ctx: typer.Context,
+    source: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--source", "-s", help="Only this database (e.g. github), repeatable"
+        ),
+    ] = None,
+    threshold: Annotated[
+        float,
+        typer.Option(help="Vacuum when free pages are more than this share"),
+    ] = FRAGMENTATION,
+    data_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--data-dir", "-d", help="Data directory where databases are stored"
+        ),
+    ] = None,
+) -> None:
+    """
+    Index hot columns, refresh query statistics and vacuum fragmented databases
+    """
+    data_path = data_dir or ctx.obj["data_dir"]
+    databases = sorted(data_path.glob("*.db"))
+    if source:
+        databases = [db for db in databases if db.stem in source]
+    if not databases:
+        print(f":x: No databases to optimize in {data_path}")
+        raise typer.Exit(code=1)
+
+    sources = get_sources()
+    for database in databases:
+        indexes = {}
+        if database.stem in sources:
+            indexes = sources[database.stem].load().indexes
+
+        result = optimize_database(database, indexes, threshold=threshold)
+        notes = [f"{len(result.indexes)} indexes created"]
+        if result.vacuumed:
+            notes.append(f"vacuumed ({result.fragmentation:.0%} free)")
+        print(
+            f":white_check_mark: {database.stem}: {', '.join(notes)}, "
+            f"{_size(result.size_before)} -> {_size(result.size_after)}"
+        )
+
+
+@app.command()
+def publish(
+    ctx: typer.Context,
+    source: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--source", "-s", help="Only this database (e.g. github), repeatable"
+        ),
+    ] = None,
+    data_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--data-dir", "-d", help="Data directory where databases are stored"
+        ),
+    ] = None,
+) -> None:
+    """
+    Publish changed databases, with an inspect file, for datasette -i
+    """
+    data_path = data_dir or ctx.obj["data_dir"]
+    if not data_path.is_dir():
+        print(f":x: {data_path} is not a directory.")
+        raise typer.Exit(code=1)
+
+    published = publish_databases(data_path, source or None)
+    for name in published:
+        print(f":white_check_mark: Published {name}")
+    if not published:
+        print("Nothing changed since the last publish")
+
+
+def _size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
 
 
 if __name__ == "__main__":
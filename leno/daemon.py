@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Sequence
+
+from .refresh import refresh
+from .source import Source
+from .stats import Run, record_run, rows_added, table_marks
+
+# Status of the daemon and every source, rewritten on every change
+STATUS_FILE = "daemon.json"
+# Spread of the scheduled time, as a share of the delay
+JITTER = 0.1
+# First retry after a failure, doubled on every consecutive failure
+BACKOFF = 60.0
+MAX_BACKOFF = 6 * 3600.0
+
+
+@dataclass
+class Schedule:
+    """When a source runs next and how its last runs went"""
+
+    source: str
+    # Seconds between successful runs
+    interval: float
+    # Seconds since the epoch
+    next_run: float = 0.0
+    last_run: float | None = None
+    last_duration: float | None = None
+    last_error: str | None = None
+    # Consecutive failures
+    failures: int = 0
+    running: bool = False
+
+    def delay(self) -> float:
+        """
+        Seconds until the next run, backing off exponentially after failures
+        """
+        if not self.failures:
+            delay = self.interval
+        else:
+            delay = min(BACKOFF * 2 ** (self.failures - 1), MAX_BACKOFF)
+        return delay * (1 + random.uniform(-JITTER, JITTER))
+
+    def finished(self, run: Run) -> None:
+        self.last_run = run.started_at
+        self.last_duration = run.duration
+        self.last_error = run.error
+        self.failures = 0 if run.ok else self.failures + 1
+        self.next_run = run.ended_at + self.delay()
+
+
+@dataclass
+class Daemon:
+    """Updates sources on their own schedules until cancelled"""
+
+    sources: Sequence[Source]
+    app_dir: Path
+    # Sources updated at the same time
+    jobs: int = 2
+    # Seconds each source may spend updating
+    timeout: float | None = None
+    # Index, analyze and vacuum a source's database after updating it
+    optimize: bool = False
+    schedules: dict[str, Schedule] = field(init=False)
+
+    def __post_init__(self) -> None:
+        now = time.time()
+        self.schedules = {
+            src.name: Schedule(
+                src.name,
+                src.interval,
+                # Don't start everything at once
+                next_run=now + random.uniform(0, JITTER * 60),
+            )
+            for src in self.sources
+        }
+        self.started_at = now
+        self.slots = asyncio.Semaphore(max(self.jobs, 1))
+        # timeline.db and search.db take one writer at a time, sources refresh
+        # them in turn
+        self.refreshing = threading.Lock()
+
+    async def run(self) -> None:
+        """
+        Schedule every source, forever
+        """
+        self.write_status()
+        try:
+            async with asyncio.TaskGroup() as group:
+                for src in self.sources:
+                    group.create_task(self.schedule(src))
+        finally:
+            self.write_status(stopped=True)
+
+    async def schedule(self, src: Source) -> None:
+        schedule = self.schedules[src.name]
+        while True:
+            await asyncio.sleep(max(schedule.next_run - time.time(), 0))
+            await self.run_once(src)
+
+    async def run_once(self, src: Source) -> Run | None:
+        """
+        Update a source now, None if it's already updating (single-flight)
+        """
+        schedule = self.schedules[src.name]
+        if schedule.running:
+            return None
+
+        schedule.running = True
+        try:
+            async with self.slots:
+                self.write_status()
+                run = await asyncio.to_thread(self.update, src)
+        finally:
+            schedule.running = False
+
+        schedule.finished(run)
+        self.write_status()
+        return run
+
+    def update(self, src: Source) -> Run:
+        """
+        Update a source, then its timeline and search rows, recording the run
+        """
+        marks = table_marks(src.database)
+        src.commands = {}
+        started_at = time.time()
+        if self.timeout is not None:
+            src.deadline = time.monotonic() + self.timeout
+
+        error: BaseException | None = None
+        derived: dict[str, float] = {}
+        try:
+            src.update()
+            with self.refreshing:
+                derived = refresh(src, optimize=self.optimize)
+        except Exception as exc:
+            # Recorded and retried with backoff, the daemon keeps going
+            error = exc
+
+        steps = {step: result.duration for step, result in src.commands.items()}
+        steps.update(derived)
+
+        run = Run(
+            source=src.name,
+            started_at=started_at,
+            ended_at=time.time(),
+            ok=error is None,
+            steps=steps,
+            rows_added=rows_added(marks, table_marks(src.database)),
+            db_size=src.database.stat().st_size if src.database.is_file() else 0,
+            error=None if error is None else f"{type(error).__name__}: {error}",
+        )
+        record_run(self.app_dir, run)
+        return run
+
+    def write_status(self, stopped: bool = False) -> None:
+        """
+        Replace the status file atomically
+        """
+        status = {
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "stopped": stopped,
+            "sources": {
+                name: asdict(schedule) for name, schedule in self.schedules.items()
+            },
+        }
+        path = self.app_dir / STATUS_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        copy_path = path.with_suffix(".tmp")
+        copy_path.write_text(json.dumps(status, indent=2))
+        copy_path.replace(path)
+
+
+def read_status(app_dir: Path) -> dict | None:
+    """
+    Last status written by the daemon, None if it never ran
+    """
+    path = app_dir / STATUS_FILE
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text())
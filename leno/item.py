@@ -0,0 +1,103 @@
+import datetime
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator
+
+from .text import html_to_text
+
+
+@dataclass(slots=True)
+class Item:
+    """Generic Item"""
+
+    title: str
+    description: str
+    label: str
+    # Seconds since the epoch, the firehose sort key
+    timestamp: int
+    link: str | None = None
+
+    def __str__(self):
+        return f"[{self.label}] {self.title}: {self.description}\nat {self.when}"
+
+    @property
+    def when(self) -> datetime.datetime:
+        """
+        Timestamp as an aware (UTC) datetime, for display
+        """
+        return datetime.datetime.fromtimestamp(self.timestamp, datetime.UTC)
+
+    def to_markdown(self):
+        return f"[{self.title}]({self.link}): {self.description}"
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        JSON serializable item, the timestamp is also given in ISO 8601
+        """
+        return {
+            "label": self.label,
+            "title": self.title,
+            "description": self.description,
+            "timestamp": self.timestamp,
+            "time": self.when.isoformat(),
+            "link": self.link,
+        }
+
+    @classmethod
+    def from_github_releases(cls, rows: Iterable[dict]) -> Iterator["Item"]:
+        """
+        Items from github releases rows (_labels=on), drafts are skipped
+        """
+        for r in rows:
+            # Drafts aren't published yet
+            if not r["published_at"]:
+                continue
+            yield cls(
+                title=f"{r['repo']['label']} {r['tag_name']}",
+                description=r["body"],
+                label="release",
+                timestamp=parse_timestamp(r["published_at"]),
+                link=r["html_url"],
+            )
+
+    @classmethod
+    def from_timeline(cls, rows: Iterable[dict]) -> Iterator["Item"]:
+        """
+        Items from materialized timeline rows
+        """
+        for r in rows:
+            yield cls(
+                title=r["title"],
+                description=r["description"],
+                label=r["label"],
+                timestamp=r["ts"],
+                link=r["link"],
+            )
+
+    @classmethod
+    def from_mastodon(cls, rows: Iterable[dict], label: str) -> Iterator["Item"]:
+        """
+        Items from mastodon status rows (bookmarks, favorites, ...)
+        """
+        for r in rows:
+            yield cls(
+                title=f":elephant: {r['username']}",
+                description=html_to_text(r["content"]),
+                label=label,
+                timestamp=parse_timestamp(r["created_at"]),
+                link=f"{r['url']}/{r['id']}",
+            )
+
+
+def parse_timestamp(value: str | int | float) -> int:
+    """
+    Seconds since the epoch from an ISO 8601 timestamp, naive ones are UTC
+
+    :param value: ISO 8601 string, or an epoch that is passed through
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.UTC)
+    return int(parsed.timestamp())
@@ -1,62 +1,252 @@
-import datetime
+import asyncio
+import heapq
 import itertools
-from dataclasses import dataclass
-from typing import Generator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
 from urllib.parse import ParseResult, parse_qs, urlencode, urljoin, urlparse, urlunparse
 
 import httpx
-from bs4 import BeautifulSoup
-
-# from devtools import debug  # noqa: F401
 
+from . import timeline
+from .cache import CacheEntry, ResponseCache
+from .item import Item, parse_timestamp  # noqa: F401
+from .text import html_to_text
+from .timeline import PROJECTIONS, TIMELINE
 
-@dataclass
-class Item:
-    """Generic Item"""
-
-    title: str
-    description: str
-    label: str
-    timestamp: datetime.datetime
-    link: str | None = None
-
-    def __str__(self):
-        return (
-            f"[{self.category}] {self.title}: {self.description}\nat {self.timestamp}"
-        )
+# from devtools import debug  # noqa: F401
 
-    def to_markdown(self):
-        return f"[{self.title}]({self.link}): {self.description}"
+# datasette's default max_returned_rows, larger _size values are rejected
+PAGE_SIZE = 1000
 
 
 @dataclass
 class Leno:
     url: str
     token: str
+    # Shared by the sync and async clients, e.g. httpx.MockTransport
+    transport: Any = field(default=None, repr=False)
+    cache: ResponseCache | None = field(default=None, repr=False)
+
+    def firehose(
+        self, limit: int | None = None, timeline: bool = False
+    ) -> Iterator[Item]:
+        """
+        Newest items from every source, merged lazily
+
+        Sorting and limiting is pushed down to datasette, so each source returns at
+        most limit pre-sorted rows that are then heap merged. The first page of
+        every source is fetched concurrently, later pages only when consumed.
 
-    def firehose(self):
-        hose = itertools.chain(
-            self.mastodon_bookmarks(), self.github_releases(), self.mastodon_favorites()
+        :param limit: maximum number of items to return
+        :param timeline: read the materialized timeline (a single indexed query)
+            instead of every source
+        """
+        if timeline:
+            query = Query.from_url(f"/{TIMELINE}/timeline.json")
+            query.sort("ts", reverse=True)
+            if limit is not None:
+                query.limit(min(limit, PAGE_SIZE))
+            return Item.from_timeline(self.paginate(query.url(), max_rows=limit))
+
+        # (query, timestamp column)
+        sources = [
+            ("/mastodon/bookmarks.json", "created_at"),
+            (
+                "/github/releases.json?_labels=on&published_at__notblank=1",
+                "published_at",
+            ),
+            ("/mastodon/favorites.json", "created_at"),
+        ]
+        urls = []
+        for url, column in sources:
+            query = Query.from_url(url)
+            query.sort(column, reverse=True)
+            if limit is not None:
+                query.limit(min(limit, PAGE_SIZE))
+            urls.append(query.url())
+
+        pages = self.fetch_json_many(urls, shape="objects")
+        bookmarks, releases, favorites = (
+            self.paginate(url, max_rows=limit, page=page)
+            for url, page in zip(urls, pages)
+        )
+        hose = heapq.merge(
+            Item.from_mastodon(bookmarks, "bookmark"),
+            Item.from_github_releases(releases),
+            Item.from_mastodon(favorites, "favorite"),
+            key=lambda i: i.timestamp,
+            reverse=True,
         )
-        return sorted(hose, key=lambda i: i.timestamp, reverse=True)
+        return itertools.islice(hose, limit)
 
-    def fetch_json(self, url: str) -> list[dict]:
-        url = self._build_fetch_url(url)
+    def fetch_json(self, url: str, shape: str = "array") -> Any:
+        url = self._build_fetch_url(url, shape)
 
-        headers = {"authorization": f"Bearer {self.token}"}
-        r = httpx.get(url, headers=headers)
+        with httpx.Client(headers=self._headers(), transport=self.transport) as client:
+            r = self._get(client, url)
 
         return r.json()
 
-    def _build_fetch_url(self, url: str) -> str:
+    def fetch_json_many(self, urls: list[str], shape: str = "array") -> list[Any]:
+        """
+        Fetch several datasette queries concurrently, results are returned in the
+        same order as urls
+
+        :param urls: datasette query URLs
+        :param shape: datasette json shape of each response
+        """
+        return asyncio.run(self.fetch_json_async(urls, shape))
+
+    async def fetch_json_async(
+        self, urls: list[str], shape: str = "array"
+    ) -> list[Any]:
+        """
+        Fetch several datasette queries concurrently over a single pooled client
+
+        :param urls: datasette query URLs
+        :param shape: datasette json shape of each response
+        """
+        async with httpx.AsyncClient(
+            headers=self._headers(), transport=self.transport
+        ) as client:
+            responses = await asyncio.gather(
+                *(self._aget(client, self._build_fetch_url(url, shape)) for url in urls)
+            )
+
+        return [r.json() for r in responses]
+
+    def paginate(
+        self,
+        url: str,
+        max_rows: int | None = None,
+        max_bytes: int | None = None,
+        page: dict | None = None,
+    ) -> Iterator[dict]:
+        """
+        Lazily yield the rows of every page of a datasette query
+
+        Follows datasette's _next keyset cursor, the next page is fetched in the
+        background while the rows of the current one are consumed.
+
+        :param url: a datasette query URL
+        :param max_rows: stop after yielding this many rows
+        :param max_bytes: stop requesting pages after this many bytes were received
+        :param page: an already fetched (_shape=objects) first page to continue from
+        """
+        query = Query.from_url(self._build_fetch_url(url, shape="objects"))
+        rows = 0
+        received = 0
+
+        with httpx.Client(
+            headers=self._headers(), transport=self.transport
+        ) as client, ThreadPoolExecutor(max_workers=1) as prefetch:
+
+            def fetch(page_url: str) -> tuple[dict, int]:
+                r = self._get(client, page_url)
+                r.raise_for_status()
+                return r.json(), len(r.content)
+
+            pending: Future | None = None
+            if page is None:
+                pending = prefetch.submit(fetch, query.url())
+
+            while page is not None or pending is not None:
+                if page is None and pending is not None:
+                    page, size = pending.result()
+                    received += size
+                assert page is not None
+
+                batch = page.get("rows", [])
+                cursor = page.get("next")
+                page, pending = None, None
+
+                if (
+                    cursor
+                    and (max_rows is None or rows + len(batch) < max_rows)
+                    and (max_bytes is None or received < max_bytes)
+                ):
+                    query.args["_next"] = str(cursor)
+                    pending = prefetch.submit(fetch, query.url())
+
+                for row in batch:
+                    if max_rows is not None and rows >= max_rows:
+                        return
+                    rows += 1
+                    yield row
+
+    def _get(self, client: httpx.Client, url: str) -> httpx.Response:
+        """
+        GET through the response cache, if enabled
+
+        :param client: client to use on a cache miss or revalidation
+        :param url: a qualified datasette query URL
+        """
+        if self.cache is None:
+            return client.get(url)
+
+        key = Query.from_url(url).normalized_url()
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return self._cached_response(url, entry)
+
+        headers = entry.conditional_headers() if entry else {}
+        return self._cache_response(key, client.get(url, headers=headers), entry)
+
+    async def _aget(self, client: httpx.AsyncClient, url: str) -> httpx.Response:
+        """
+        Async counterpart of _get
+        """
+        if self.cache is None:
+            return await client.get(url)
+
+        key = Query.from_url(url).normalized_url()
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return self._cached_response(url, entry)
+
+        headers = entry.conditional_headers() if entry else {}
+        r = await client.get(url, headers=headers)
+        return self._cache_response(key, r, entry)
+
+    def _cache_response(
+        self, key: str, r: httpx.Response, entry: CacheEntry | None
+    ) -> httpx.Response:
+        assert self.cache is not None
+
+        if r.status_code == httpx.codes.NOT_MODIFIED and entry is not None:
+            self.cache.refresh(key)
+            return self._cached_response(str(r.url), entry)
+
+        if r.status_code == httpx.codes.OK:
+            self.cache.set(
+                key,
+                r.content,
+                etag=r.headers.get("etag"),
+                last_modified=r.headers.get("last-modified"),
+            )
+        return r
+
+    @staticmethod
+    def _cached_response(url: str, entry: CacheEntry) -> httpx.Response:
+        return httpx.Response(
+            httpx.codes.OK, content=entry.body, request=httpx.Request("GET", url)
+        )
+
+    def _headers(self) -> dict[str, str]:
+        return {"authorization": f"Bearer {self.token}"}
+
+    def _build_fetch_url(self, url: str, shape: str = "array") -> str:
         """
         Provides a qualified URL for consistent data handling
 
         :param url: a datasette query URL
+        :param shape: datasette json shape, array unless paginating
         """
         query = Query.from_url(url)
-        # Set json output mode to array
-        query.json_mode("array")
+        # Set json output mode, array by default
+        query.json_mode(shape)
         q_url = query.url()
 
         # Prepend datasette server to url if passed only a path
@@ -67,48 +257,93 @@ class Leno:
 
         return q_url
 
-    def github_releases(self) -> Generator[Item, None, None]:
-        result = self.fetch_json("/github/releases.json?_labels=on")
+    def github_releases(self) -> Iterator[Item]:
+        yield from Item.from_github_releases(
+            self.fetch_json("/github/releases.json?_labels=on")
+        )
 
-        if result:
-            for r in result:
-                yield Item(
-                    title=f"{r['repo']['label']} {r['tag_name']}",
-                    description=r["body"],
-                    label="release",
-                    timestamp=r["published_at"],
-                    link=r["html_url"],
-                )
+    def mastodon_bookmarks(self) -> Iterator[Item]:
+        yield from Item.from_mastodon(
+            self.fetch_json("/mastodon/bookmarks.json"), "bookmark"
+        )
 
-    def mastodon_bookmarks(self) -> Generator[Item, None, None]:
-        result = self.fetch_json("/mastodon/bookmarks.json")
+    def mastodon_favorites(self) -> Iterator[Item]:
+        yield from Item.from_mastodon(
+            self.fetch_json("/mastodon/favorites.json"), "favorite"
+        )
 
-        if result:
-            for r in result:
-                yield Item(
-                    title=f":elephant: {r['username']}",
-                    # FIXME: Simply stripping the tags out isn't the *most* readable,
-                    # probaly should parse for links, etc
-                    description=BeautifulSoup(r["content"], "html.parser").text,
-                    label="bookmark",
-                    timestamp=r["created_at"],
-                    link=f"{r['url']}/{r['id']}",
-                )
 
-    def mastodon_favorites(self) -> Generator[Item, None, None]:
-        result = self.fetch_json("/mastodon/favorites.json")
+@dataclass
+class LocalLeno:
+    """Firehose straight from the source databases, bypassing datasette"""
+
+    data_dir: Path
+
+    def firehose(self, limit: int | None = None) -> Iterator[Item]:
+        """
+        Newest items from every local database, in a single query
+
+        Served from the materialized timeline for the sources update maintains it
+        for, the others are projected from their databases.
+
+        :param limit: maximum number of items to return
+        """
+        # A negative LIMIT is no limit
+        params: dict[str, Any] = {"limit": -1 if limit is None else limit}
+        conn = timeline.connect(
+            self.data_dir, {TIMELINE} | {p.source for p in PROJECTIONS}
+        )
 
-        if result:
-            for r in result:
+        # Projections with rows in the timeline, the timeline may predate others
+        materialized = set()
+        if TIMELINE in [row[1] for row in conn.execute("PRAGMA database_list")]:
+            materialized = {
+                (p.source, p.label)
+                for p in PROJECTIONS
+                if conn.execute(
+                    f"SELECT 1 FROM {TIMELINE}.timeline "
+                    "WHERE source = ? AND label = ? LIMIT 1",
+                    (p.source, p.label),
+                ).fetchone()
+            }
+
+        queries = [
+            f"SELECT * FROM (SELECT '{p.label}', title, description, html, ts, "
+            f"link FROM ({p.query} ORDER BY {p.order_by} DESC LIMIT :limit))"
+            for p in PROJECTIONS
+            if (p.source, p.label) not in materialized and timeline.available(conn, p)
+        ]
+        if materialized:
+            names = {}
+            for i, (source, label) in enumerate(sorted(materialized)):
+                names[f"source_{i}"], names[f"label_{i}"] = source, label
+            params.update(names)
+            pairs = ", ".join(
+                f"(:source_{i}, :label_{i})" for i in range(len(materialized))
+            )
+            queries.append(
+                "SELECT * FROM (SELECT label, title, description, 0, ts, link "
+                f"FROM {TIMELINE}.timeline WHERE (source, label) IN "
+                f"(VALUES {pairs}) ORDER BY ts DESC LIMIT :limit)"
+            )
+        if not queries:
+            conn.close()
+            return
+        sql = " UNION ALL ".join(queries) + " ORDER BY 5 DESC LIMIT :limit"
+
+        try:
+            for label, title, description, html, ts, link in conn.execute(sql, params):
                 yield Item(
-                    title=f":elephant: {r['username']}",
-                    # FIXME: Simply stripping the tags out isn't the *most* readable,
-                    # probaly should parse for links, etc
-                    description=BeautifulSoup(r["content"], "html.parser").text,
-                    label="favorite",
-                    timestamp=r["created_at"],
-                    link=f"{r['url']}/{r['id']}",
+                    title=title,
+                    description=html_to_text(description or "")
+                    if html
+                    else description,
+                    label=label,
+                    timestamp=ts,
+                    link=link,
                 )
+        finally:
+            conn.close()
 
 
 class LenoException(Exception):
@@ -146,6 +381,15 @@ class Query:
     def query_string(self) -> str:
         return urlencode(self.args)
 
+    def normalized_url(self) -> str:
+        """
+        URL with sorted query arguments, equivalent queries share a cache key
+        """
+        query = Query(
+            self.protocol, self.host, self.path, dict(sorted(self.args.items()))
+        )
+        return query.url()
+
     def json_mode(self, mode) -> None:
         self.args["_shape"] = mode
 
@@ -0,0 +1,104 @@
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Mapping, Sequence
+
+# VACUUM once free pages make up more than this share of a database
+FRAGMENTATION = 0.1
+# Rows ANALYZE samples per index, bounds its cost on large databases
+ANALYSIS_LIMIT = 1000
+
+
+@dataclass
+class Optimized:
+    """What optimize did to a database"""
+
+    database: Path
+    # Names of the indexes created
+    indexes: list[str] = field(default_factory=list)
+    # Share of free pages before vacuuming
+    fragmentation: float = 0.0
+    vacuumed: bool = False
+    # Bytes
+    size_before: int = 0
+    size_after: int = 0
+
+
+def fragmentation(conn: sqlite3.Connection) -> float:
+    """
+    Share of the database's pages that are free
+    """
+    (pages,) = conn.execute("PRAGMA page_count").fetchone()
+    (free,) = conn.execute("PRAGMA freelist_count").fetchone()
+    return free / pages if pages else 0.0
+
+
+def has_index(conn: sqlite3.Connection, table: str, columns: Sequence[str]) -> bool:
+    """
+    Whether an index (or primary key) of the table starts with columns
+    """
+    for index in conn.execute(f"PRAGMA index_list([{table}])").fetchall():
+        indexed = [row[2] for row in conn.execute(f"PRAGMA index_info([{index[1]}])")]
+        if indexed[: len(columns)] == list(columns):
+            return True
+    return False
+
+
+def create_indexes(
+    conn: sqlite3.Connection, indexes: Mapping[str, Sequence[Sequence[str]]]
+) -> list[str]:
+    """
+    Create the missing indexes, tables or columns that don't exist are skipped,
+    returns the names of the indexes created
+
+    :param indexes: table -> column lists to index
+    """
+    created = []
+    for table, column_lists in indexes.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info([{table}])")}
+        for columns in column_lists:
+            if not set(columns) <= existing or has_index(conn, table, columns):
+                continue
+            name = f"leno_{table}_{'_'.join(columns)}"
+            conn.execute(
+                f"CREATE INDEX [{name}] ON [{table}] "
+                f"({', '.join(f'[{c}]' for c in columns)})"
+            )
+            created.append(name)
+    return created
+
+
+def optimize(
+    database: Path,
+    indexes: Mapping[str, Sequence[Sequence[str]]] | None = None,
+    threshold: float = FRAGMENTATION,
+) -> Optimized:
+    """
+    Index the hot columns of a database, refresh the query planner statistics
+    and vacuum it if fragmented
+
+    :param database: database to optimize
+    :param indexes: table -> column lists queries sort or filter on
+    :param threshold: vacuum when free pages are more than this share
+    """
+    result = Optimized(database=database, size_before=database.stat().st_size)
+
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            result.indexes = create_indexes(conn, indexes or {})
+
+        conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+
+        result.fragmentation = fragmentation(conn)
+        if result.fragmentation > threshold:
+            conn.execute("VACUUM")
+            result.vacuumed = True
+    finally:
+        conn.close()
+
+    result.size_after = database.stat().st_size
+    return result
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Collection
+
+# Published copies of the data dir's databases, never written in place, so
+# datasette can serve them immutable with cached counts:
+#   datasette -i public/*.db --inspect-file public/inspect-data.json
+PUBLIC = "public"
+# Same format as `datasette inspect`
+INSPECT_FILE = "inspect-data.json"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def inspect_hash(path: Path) -> str:
+    """
+    sha256 of the file, as datasette computes it
+    """
+    m = hashlib.sha256()
+    with path.open("rb") as fp:
+        while data := fp.read(HASH_BLOCK_SIZE):
+            m.update(data)
+    return m.hexdigest()
+
+
+def inspect_database(path: Path) -> dict:
+    """
+    datasette inspect entry of a database: hash, size and row count per table
+
+    :param path: published database
+    """
+    conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        tables = [
+            name
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        ]
+        counts = {
+            table: {
+                "count": conn.execute(f"SELECT count(*) FROM [{table}]").fetchone()[0]
+            }
+            for table in tables
+        }
+    finally:
+        conn.close()
+
+    return {
+        "hash": inspect_hash(path),
+        "size": path.stat().st_size,
+        "file": str(path),
+        "tables": counts,
+    }
+
+
+def publish_database(database: Path, public_dir: Path) -> Path:
+    """
+    Copy a database into public_dir through the online backup API, replacing
+    the published copy atomically
+
+    :param database: database in the data dir
+    :param public_dir: directory of the published copies
+    """
+    target = public_dir / database.name
+    copy_path = target.with_suffix(".tmp")
+    live = sqlite3.connect(f"{database.resolve().as_uri()}?mode=ro", uri=True)
+    copy = sqlite3.connect(copy_path)
+    try:
+        live.backup(copy)
+        # A single file, no WAL next to it
+        copy.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        copy.close()
+        live.close()
+    copy_path.replace(target)
+    return target
+
+
+def publish(data_dir: Path, names: Collection[str] | None = None) -> list[str]:
+    """
+    Publish the databases changed since they were last published and update the
+    inspect file, returns the names of the databases published
+
+    :param data_dir: directory the sources write their databases to
+    :param names: only consider these databases, e.g. github for github.db
+    """
+    public_dir = data_dir / PUBLIC
+    public_dir.mkdir(parents=True, exist_ok=True)
+    inspect_file = public_dir / INSPECT_FILE
+    inspected: dict = {}
+    if inspect_file.is_file():
+        inspected = json.loads(inspect_file.read_text())
+
+    published = []
+    for database in sorted(data_dir.glob("*.db")):
+        name = database.stem
+        if names is not None and name not in names:
+            continue
+
+        target = public_dir / database.name
+        if (
+            name in inspected
+            and target.is_file()
+            and target.stat().st_mtime_ns >= _modified(database)
+        ):
+            continue
+
+        inspected[name] = inspect_database(publish_database(database, public_dir))
+        published.append(name)
+
+    # Forget databases that are no longer published
+    current = {
+        name: entry
+        for name, entry in sorted(inspected.items())
+        if (public_dir / f"{name}.db").is_file()
+    }
+    if published or current != inspected:
+        copy_path = inspect_file.with_suffix(".tmp")
+        copy_path.write_text(json.dumps(current, indent=2))
+        copy_path.replace(inspect_file)
+
+    return published
+
+
+def _modified(database: Path) -> int:
+    """
+    Last modification of a database, including its write-ahead log
+    """
+    wal = database.with_name(f"{database.name}-wal")
+    return max(
+        database.stat().st_mtime_ns, wal.stat().st_mtime_ns if wal.is_file() else 0
+    )
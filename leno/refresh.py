@@ -0,0 +1,27 @@
+import time
+
+from .optimize import optimize as optimize_database
+from .search import update_search
+from .source import Source
+from .timeline import update_timeline
+
+
+def refresh(src: Source, optimize: bool = False) -> dict[str, float]:
+    """
+    Bring the timeline and search rows of a freshly updated source up to date,
+    returns seconds taken per step
+
+    :param src: source that was just updated
+    :param optimize: also index, analyze and vacuum its database
+    """
+    steps = {}
+    for step, derive in (("timeline", update_timeline), ("search", update_search)):
+        start = time.monotonic()
+        derive(src.data_dir, src.name, full=src.full)
+        steps[step] = time.monotonic() - start
+
+    if optimize and src.database.is_file():
+        start = time.monotonic()
+        optimize_database(src.database, src.indexes)
+        steps["optimize"] = time.monotonic() - start
+    return steps
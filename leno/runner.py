@@ -0,0 +1,135 @@
+import re
+import shlex
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Sequence
+
+# Lines of output kept in memory per command
+TAIL_LINES = 200
+# 42%, 42.5 % or 120/300
+PROGRESS = re.compile(r"(\d+(?:\.\d+)?)\s*%|\b(\d+)\s*/\s*(\d+)\b")
+
+
+@dataclass
+class CommandResult:
+    """How a command went"""
+
+    args: list[str]
+    returncode: int
+    # Seconds from start to exit
+    duration: float
+    # Last TAIL_LINES lines of output, stdout and stderr interleaved
+    tail: list[str]
+
+    def check_returncode(self) -> None:
+        """
+        Raise CalledProcessError, with the tail as output, if the command failed
+        """
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(
+                self.returncode, self.args, output="\n".join(self.tail)
+            )
+
+
+def parse_progress(line: str) -> float | None:
+    """
+    Fraction done reported by a progress line, None if it doesn't report any
+
+    :param line: a line of collector output, e.g. "[####    ]  42%" or "120/300"
+    """
+    match = PROGRESS.search(line)
+    if match is None:
+        return None
+
+    percent, done, total = match.groups()
+    if percent is not None:
+        return min(float(percent) / 100, 1.0)
+    if int(total) == 0:
+        return None
+    return min(int(done) / int(total), 1.0)
+
+
+def run_streaming(
+    cmd: Sequence,
+    timeout: float | None = None,
+    log: Path | None = None,
+    on_line: Callable[[str], None] | None = None,
+    capture_output: bool = True,
+    check: bool = True,
+) -> CommandResult:
+    """
+    Run a command, handling its output line by line as it is produced
+
+    Only the last TAIL_LINES lines are kept in memory, carriage returns (progress
+    bars) end a line too. Raises TimeoutExpired once the command has been killed
+    for running past timeout.
+
+    :param cmd: command and arguments
+    :param timeout: seconds the command may run
+    :param log: file the output is written to, replaced every run
+    :param on_line: called with every line of output
+    :param capture_output: handle stdout/stderr instead of inheriting them
+    :param check: raise CalledProcessError, with the tail as output, if the
+        command fails
+    """
+    args = [str(arg) for arg in cmd]
+    tail: deque[str] = deque(maxlen=TAIL_LINES)
+    start = time.monotonic()
+
+    with ExitStack() as stack:
+        log_file = None
+        if log is not None and capture_output:
+            log.parent.mkdir(parents=True, exist_ok=True)
+            log_file = stack.enter_context(log.open("w", buffering=1))
+            log_file.write(f"$ {shlex.join(args)}\n")
+
+        proc = stack.enter_context(
+            subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE if capture_output else None,
+                stderr=subprocess.STDOUT if capture_output else None,
+                text=True,
+                errors="replace",
+            )
+        )
+
+        def read() -> None:
+            assert proc.stdout is not None
+            for line in proc.stdout:
+                line = line.rstrip("\n")
+                tail.append(line)
+                if log_file is not None:
+                    log_file.write(f"{line}\n")
+                if on_line is not None:
+                    on_line(line)
+
+        reader = None
+        if capture_output:
+            reader = threading.Thread(target=read, daemon=True)
+            reader.start()
+
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            if reader is not None:
+                reader.join()
+
+        duration = time.monotonic() - start
+        if log_file is not None:
+            log_file.write(f"exit {returncode} after {duration:.1f}s\n")
+
+    result = CommandResult(
+        args=args, returncode=returncode, duration=duration, tail=list(tail)
+    )
+    if check:
+        result.check_returncode()
+    return result
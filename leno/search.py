@@ -0,0 +1,200 @@
+import sqlite3
+from pathlib import Path
+from typing import Iterator, Sequence
+
+from .item import Item
+from .timeline import Projection, create, materialize
+
+# search.db in the data dir, documents plus their FTS5 index
+SEARCH = "search"
+# Wraps matches in snippets
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+PROJECTIONS = [
+    Projection(
+        source="mastodon",
+        label=label,
+        tables=[table],
+        query=f"""
+        SELECT id AS uid, username AS title, content AS description, 1 AS html,
+            CAST(strftime('%s', created_at) AS INTEGER) AS ts,
+            url || '/' || id AS link
+        FROM mastodon.{table}
+        """,
+        order_by="created_at",
+    )
+    for label, table in (
+        ("status", "statuses"),
+        ("bookmark", "bookmarks"),
+        ("favorite", "favorites"),
+    )
+]
+PROJECTIONS += [
+    Projection(
+        source="github",
+        label="release",
+        tables=["releases", "repos"],
+        query="""
+        SELECT releases.id AS uid,
+            repos.full_name || ' ' || releases.tag_name AS title,
+            releases.body AS description, 0 AS html,
+            CAST(strftime('%s', releases.published_at) AS INTEGER) AS ts,
+            releases.html_url AS link
+        FROM github.releases JOIN github.repos ON repos.id = releases.repo
+        WHERE releases.published_at IS NOT NULL
+        """,
+        order_by="releases.published_at",
+    ),
+    Projection(
+        source="github",
+        label="commit",
+        tables=["commits", "repos"],
+        query="""
+        SELECT commits.sha AS uid, repos.full_name AS title,
+            commits.message AS description, 0 AS html,
+            CAST(strftime('%s', commits.committer_date) AS INTEGER) AS ts,
+            'https://github.com/' || repos.full_name || '/commit/' || commits.sha
+                AS link
+        FROM github.commits JOIN github.repos ON repos.id = commits.repo
+        """,
+        order_by="commits.committer_date",
+    ),
+    Projection(
+        source="pocket",
+        label="pocket",
+        tables=["items"],
+        query="""
+        SELECT item_id AS uid, coalesce(resolved_title, given_title) AS title,
+            excerpt AS description, 0 AS html, CAST(time_added AS INTEGER) AS ts,
+            coalesce(resolved_url, given_url) AS link
+        FROM pocket.items
+        """,
+        order_by="time_added",
+    ),
+    Projection(
+        source="firefox",
+        label="page",
+        tables=["moz_places"],
+        query="""
+        SELECT id AS uid, title, url AS description, 0 AS html,
+            last_visit_date / 1000000 AS ts, url AS link
+        FROM firefox.moz_places
+        WHERE title IS NOT NULL AND last_visit_date IS NOT NULL
+        """,
+        order_by="last_visit_date",
+    ),
+]
+
+
+def create_index(conn: sqlite3.Connection) -> None:
+    """
+    documents table with an FTS5 index kept in sync by triggers
+    """
+    create(conn, SEARCH, "documents")
+    conn.executescript(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH}.documents_fts USING fts5(
+            title, description, content='documents', content_rowid='rowid'
+        );
+        CREATE TRIGGER IF NOT EXISTS {SEARCH}.documents_ai AFTER INSERT ON documents
+        BEGIN
+            INSERT INTO documents_fts (rowid, title, description)
+            VALUES (new.rowid, new.title, new.description);
+        END;
+        CREATE TRIGGER IF NOT EXISTS {SEARCH}.documents_ad AFTER DELETE ON documents
+        BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, title, description)
+            VALUES ('delete', old.rowid, old.title, old.description);
+        END;
+        CREATE TRIGGER IF NOT EXISTS {SEARCH}.documents_au AFTER UPDATE ON documents
+        BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, title, description)
+            VALUES ('delete', old.rowid, old.title, old.description);
+            INSERT INTO documents_fts (rowid, title, description)
+            VALUES (new.rowid, new.title, new.description);
+        END;
+        """
+    )
+
+
+def update_search(data_dir: Path, source: str, full: bool = False) -> int:
+    """
+    Index the source's new and changed documents, returns documents written
+
+    :param data_dir: directory the sources write their databases to
+    :param source: source that was just updated
+    :param full: reindex the source's documents from scratch
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"ATTACH DATABASE ? AS {SEARCH}", (str(data_dir / f"{SEARCH}.db"),))
+    try:
+        create_index(conn)
+    finally:
+        conn.close()
+
+    return materialize(data_dir, SEARCH, "documents", PROJECTIONS, source, full)
+
+
+def search(
+    data_dir: Path,
+    query: str,
+    sources: Sequence[str] = (),
+    since: int | None = None,
+    until: int | None = None,
+    limit: int = 20,
+) -> Iterator[Item]:
+    """
+    Best matching documents (bm25), the description is a snippet of the match
+
+    Matches in snippets are wrapped in MATCH_START and MATCH_END.
+
+    :param data_dir: directory the sources write their databases to
+    :param query: FTS5 query
+    :param sources: only search these sources
+    :param since: only documents at or after this epoch
+    :param until: only documents before this epoch
+    :param limit: maximum number of documents to return
+    """
+    database = data_dir / f"{SEARCH}.db"
+    if not database.is_file():
+        return
+
+    where = ["documents_fts MATCH :query"]
+    params: dict = {"query": query, "limit": limit}
+    if sources:
+        names = {f"source_{i}": s for i, s in enumerate(sources)}
+        where.append(f"d.source IN ({', '.join(f':{n}' for n in names)})")
+        params.update(names)
+    if since is not None:
+        where.append("d.ts >= :since")
+        params["since"] = since
+    if until is not None:
+        where.append("d.ts < :until")
+        params["until"] = until
+
+    conn = sqlite3.connect(f"{database.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT d.label, d.title,
+                snippet(documents_fts, -1, '{MATCH_START}', '{MATCH_END}', '…', 16),
+                d.ts, d.link
+            FROM documents_fts JOIN documents AS d ON d.rowid = documents_fts.rowid
+            WHERE {' AND '.join(where)}
+            -- Title matches weigh more than description ones
+            ORDER BY bm25(documents_fts, 2.0, 1.0)
+            LIMIT :limit
+            """,
+            params,
+        )
+        for label, title, snippet, ts, link in rows:
+            yield Item(
+                title=title or "",
+                description=snippet,
+                label=label,
+                timestamp=ts,
+                link=link,
+            )
+    finally:
+        conn.close()
@@ -1,18 +1,45 @@
-import configparser
+import ast
+import datetime
+import fcntl
+import functools
+import importlib
+import importlib.util
 import json
-import os
+import sqlite3
+import time
 
 # import venv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
+from dataclasses import dataclass
+from importlib.metadata import entry_points
 from pathlib import Path
-from shutil import copy2
-from subprocess import run
-from typing import Callable, ClassVar
-
-from sqlite_utils import Database
+from shutil import rmtree
+from subprocess import TimeoutExpired, run
+from typing import TYPE_CHECKING, Callable, ClassVar, Iterable, Sequence
 
 # from devtools import debug
-from typing_extensions import override
+from .runner import CommandResult, run_streaming
+
+if TYPE_CHECKING:
+    import httpx
+
+# Per source/data point high-water marks, stored in each source's database
+STATE_TABLE = "_leno_state"
+# Packages installed in the shared venv
+MANIFEST = "leno-installed.json"
+# Entry point group sources are registered under, name = "module:Class"
+ENTRY_POINT_GROUP = "leno.sources"
+# Sources shipped with leno, also declared as entry points in pyproject.toml
+BUILTIN_SOURCES = {
+    "feeds": "leno.sources.feeds:FeedsSource",
+    "firefox": "leno.sources.firefox:FirefoxSource",
+    "github": "leno.sources.github:GithubSource",
+    "healthkit": "leno.sources.healthkit:HealthkitSource",
+    "mastodon": "leno.sources.mastodon:MastodonSource",
+    "photos": "leno.sources.photos:PhotosSource",
+    "pocket": "leno.sources.pocket:PocketSource",
+}
 
 
 class Source:
@@ -23,28 +50,35 @@ class Source:
     packages: ClassVar[list[str]] = []
     script: ClassVar[str] = ""
     enabled: ClassVar[bool] = True
+    # data point -> (table, column) whose maximum is the data point's watermark
+    watermark_columns: ClassVar[dict[str, tuple[str, str]]] = {}
+    # table -> column lists queries sort or filter on, indexed by leno optimize
+    indexes: ClassVar[dict[str, list[tuple[str, ...]]]] = {}
+    # Seconds between updates when run by leno daemon
+    interval: ClassVar[float] = 3600
 
     def __init__(self, data_dir: Path, venv: Path) -> None:
         self.data_dir = data_dir.resolve()
         self.venv = venv.resolve()
+        # time.monotonic() after which collector commands are killed and
+        # in-process collectors give up (see check_deadline)
+        self.deadline: float | None = None
+        # Ignore watermarks and resync everything
+        self.full = False
+        # Maximum number of data points collected at the same time
+        self.concurrency = 4
+        # Collector output is logged here, one file per command, when set
+        self.log_dir: Path | None = None
+        # Called with every line of collector output, e.g. to show progress
+        self.on_output: Callable[[str], None] | None = None
+        # Shared HTTP client for sources collecting in-process, kept warm across
+        # updates by leno daemon
+        self.client: httpx.Client | None = None
+        # Commands run by the current (or last) update, by log name
+        self.commands: dict[str, CommandResult] = {}
 
     def install(self) -> bool:
-        if not self.venv.is_dir():
-            # FIXME: venv.create is broken somehow in 3.11.5...
-            # venv.create(self.venv, with_pip=True)
-            run(
-                ["python", "-m", "venv", self.venv],
-                capture_output=True,
-                check=True,
-            )
-
-        pip = self.venv / "bin/pip"
-        for pkg in self.packages:
-            run(
-                [pip, "install", pkg],
-                capture_output=True,
-                check=True,
-            )
+        install_packages(self.venv, self.packages)
         return True
 
     def update(self) -> bool:
@@ -53,6 +87,146 @@ class Source:
         """
         return True
 
+    def past_deadline(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def check_deadline(self) -> None:
+        """
+        Give up once the update deadline passed, in-process collectors call this
+        between batches
+        """
+        if self.past_deadline():
+            raise SourceException(f"Source ({self.name}) timed out")
+
+    def run_command(
+        self, cmd: Sequence, capture_output: bool = True, log_name: str | None = None
+    ) -> CommandResult:
+        """
+        Run a collector command, killing it once the update deadline passes
+
+        Output is streamed to on_output and the log, not kept in memory.
+
+        :param cmd: command and arguments
+        :param capture_output: capture stdout/stderr instead of inheriting them
+        :param log_name: name of the log file in log_dir, the source's by default
+        """
+        timeout = None
+        if self.deadline is not None:
+            timeout = max(self.deadline - time.monotonic(), 0)
+
+        log_name = log_name or self.name
+        log = None
+        if self.log_dir is not None:
+            log = self.log_dir / f"{log_name}.log"
+
+        try:
+            result = run_streaming(
+                cmd,
+                timeout=timeout,
+                log=log,
+                on_line=self.on_output,
+                capture_output=capture_output,
+                check=False,
+            )
+        except TimeoutExpired as error:
+            raise SourceException(f"Source ({self.name}) timed out") from error
+
+        self.commands[log_name] = result
+        result.check_returncode()
+        return result
+
+    def update_data_points(
+        self,
+        data_points: Sequence[str],
+        command: Callable[[str, Path], Sequence],
+    ) -> None:
+        """
+        Collect data points concurrently, each into its own staging database, then
+        merge them into database in a single transaction
+
+        :param data_points: data points to collect
+        :param command: builds the collector command for a data point and the
+            database it should write to
+        """
+        staging_dir = self.data_dir / ".staging" / self.name
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        targets = {
+            data_point: staging_dir / f"{data_point}.db" for data_point in data_points
+        }
+
+        try:
+            for target in targets.values():
+                target.unlink(missing_ok=True)
+
+            with ThreadPoolExecutor(max_workers=max(self.concurrency, 1)) as pool:
+                runs = [
+                    pool.submit(
+                        self.run_command,
+                        command(data_point, target),
+                        log_name=f"{self.name}-{data_point}",
+                    )
+                    for data_point, target in targets.items()
+                ]
+                for future in runs:
+                    future.result()
+
+            merge_databases(self.database, targets.values())
+        finally:
+            rmtree(staging_dir, ignore_errors=True)
+
+        for data_point in data_points:
+            if data_point in self.watermark_columns:
+                self.record_watermark(data_point)
+
+    def watermark(self, data_point: str) -> str | None:
+        """
+        High-water mark recorded by the last update, None when a full sync is due
+
+        :param data_point: data point within the source, e.g. commits
+        """
+        if self.full or not self.database.is_file():
+            return None
+
+        # Deferred, sqlite_utils is slow to import and only needed when updating
+        from sqlite_utils import Database
+        from sqlite_utils.db import NotFoundError
+
+        db = Database(self.database)
+        if STATE_TABLE not in db.table_names():
+            return None
+        try:
+            return db.table(STATE_TABLE).get((self.name, data_point))["watermark"]
+        except NotFoundError:
+            return None
+
+    def record_watermark(self, data_point: str) -> str | None:
+        """
+        Store the newest value of the data point's watermark column
+
+        :param data_point: data point within the source, e.g. commits
+        """
+        from sqlite_utils import Database
+
+        table, column = self.watermark_columns[data_point]
+        db = Database(self.database)
+        if table not in db.table_names() or column not in db.table(table).columns_dict:
+            return None
+
+        value = db.execute(f"SELECT max([{column}]) FROM [{table}]").fetchone()[0]
+        if value is None:
+            return None
+
+        db.table(STATE_TABLE).upsert(
+            {
+                "source": self.name,
+                "data_point": data_point,
+                "watermark": str(value),
+                "updated_at": datetime.datetime.now(datetime.UTC).isoformat(),
+            },
+            pk=("source", "data_point"),
+        )
+        return str(value)
+
     @property
     def database(self) -> Path:
         return self.data_dir / f"{self.name}.db"
@@ -69,272 +243,275 @@ class Source:
         return self.data_dir / f"auth_{self.name}.json"
 
     def is_installed(self) -> bool:
-        if self.script_path.is_file():
-            return True
-        else:
-            return False
+        installed = installed_packages(self.venv)
+        return all(pkg in installed for pkg in self.packages)
 
 
-class FeedsSource(Source):
-    """Feeds Source"""
+class SourceException(Exception):
+    """Source Exception"""
 
-    name = "feeds"
-    description = "RSS feeds"
-    packages = ["feed-to-sqlite"]
-    script = "feed-to-sqlite"
 
-    @override
-    def update(self) -> bool:
-        feeds = ["https://cade.pro/rss.xml"]
-        run(
-            [str(self.script_path), str(self.database)] + feeds,
-            capture_output=True,
-            check=True,
-            shell=False,
-        )
-        return True
+@contextmanager
+def auth_file(file: Path, **kwargs):
+    if len(kwargs) == 0:
+        raise KeyError("Requires 1 or more key/value pairs")
 
+    file.write_text(json.dumps(kwargs))
+    yield
+    file.unlink()
 
-class FirefoxSource(Source):
-    """Firefox Source"""
 
-    name = "firefox"
-    description = 'Firefox "places" (history & bookmarks)'
-    packages = []
-    script = ""
+@contextmanager
+def venv_lock(venv: Path):
+    """
+    Exclusive lock on the shared venv, held across processes
+    """
+    venv.parent.mkdir(parents=True, exist_ok=True)
+    with open(venv.parent / f"{venv.name}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
 
-    @override
-    def install(self) -> bool:
-        # No install necessary
-        return True
 
-    @override
-    def update(self) -> bool:
-        firefox_path = Path.home() / "Library/Application Support/Firefox"
-        firefox_profile_config = firefox_path / "profiles.ini"
-
-        if firefox_profile_config.is_file():
-            config = configparser.ConfigParser()
-            config.read(firefox_profile_config)
-
-            for i in config.sections():
-                if i.startswith("Install"):
-                    profile_path = firefox_path / config[i]["Default"]
-                    # FIXME: Not exactly sure if there might be more than one Install
-                    # section
-                    break
-
-            copy2(profile_path / "places.sqlite", self.database)
-            # Disable sqlite WAL-mode
-            Database(self.database).disable_wal()
-        else:
-            raise SourceException(
-                f"Unable to determine profile, '{firefox_profile_config}' missing"
-            )
-        return True
+def installed_packages(venv: Path) -> set[str]:
+    """
+    Packages recorded in the venv's install manifest
+    """
+    try:
+        return set(json.loads((venv / MANIFEST).read_text()))
+    except FileNotFoundError:
+        return set()
 
-    @override
-    def is_installed(self) -> bool:
-        return True
 
+def install_packages(
+    venv: Path, packages: Iterable[str], cache_dir: Path | None = None
+) -> set[str]:
+    """
+    Install packages missing from the venv with a single pip invocation
+
+    The venv is created if needed and locked for the duration, installed
+    packages are recorded in its manifest. Returns the packages installed.
 
-class GithubSource(Source):
-    """Github Source"""
+    :param venv: shared sources venv
+    :param packages: requirements of the sources to install
+    :param cache_dir: pip (wheel) cache, defaults to cache/pip next to the venv
+    """
+    if cache_dir is None:
+        cache_dir = venv.parent / "cache" / "pip"
 
-    name = "github"
-    description = "Github"
-    packages = ["github-to-sqlite"]
-    script = "github-to-sqlite"
+    with venv_lock(venv):
+        if not venv.is_dir():
+            # FIXME: venv.create is broken somehow in 3.11.5...
+            # venv.create(self.venv, with_pip=True)
+            run(
+                ["python", "-m", "venv", venv],
+                capture_output=True,
+                check=True,
+            )
 
-    @override
-    def update(self) -> bool:
-        repos = [
-            "cadeef/cade-task",
-            "cadeef/.files",
-            "cadeef/firefox-to-sqlite",
-            "cadeef/leno",
-        ]
-        data_points = ["commits", "releases"]
-
-        with auth_file(
-            self.auth_file_path,
-            github_personal_token=os.environ["LENO_GITHUB_TOKEN"],
-        ):
-            # Fetch repos associated with user
+        installed = installed_packages(venv)
+        missing = sorted(set(packages) - installed)
+        if missing:
             run(
-                [
-                    self.script_path,
-                    "repos",
-                    "--auth",
-                    self.auth_file_path,
-                    self.database,
-                ],
+                [venv / "bin/pip", "install", "--cache-dir", cache_dir, *missing],
                 capture_output=True,
                 check=True,
-                shell=False,
             )
+            manifest = venv / MANIFEST
+            manifest.with_suffix(".tmp").write_text(
+                json.dumps(sorted(installed | set(missing)))
+            )
+            manifest.with_suffix(".tmp").replace(manifest)
 
-            # Fetch interesting data about repos
-            for data_point in data_points:
-                cmd = [
-                    str(self.script_path),
-                    data_point,
-                    "--auth",
-                    str(self.auth_file_path),
-                    str(self.database),
-                ] + repos
-                run(
-                    cmd,
-                    capture_output=True,
-                    check=True,
-                    shell=False,
-                )
-        return True
+    return set(missing)
 
 
-class HealthkitSource(Source):
-    """Healthkit Source"""
+def merge_databases(database: Path, staged: Iterable[Path]) -> None:
+    """
+    Merge staging databases into database in a single transaction
 
-    name = "healthkit"
-    description = "Apple health data"
-    packages = ["healthkit-to-sqlite"]
-    script = "healthkit-to-sqlite"
+    Missing tables, columns, indexes, views and triggers are created, rows are
+    upserted (INSERT OR REPLACE) and full-text indexes rebuilt afterwards.
 
-    @override
-    def update(self) -> bool:
-        run(
-            [self.script_path, "exports/healthkit.zip", self.database],
-            capture_output=True,
-            check=True,
-            shell=False,
+    :param database: database to merge into
+    :param staged: staging databases written by the same collector
+    """
+    staged = [path for path in staged if path.is_file()]
+    if not staged:
+        return
+
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        # ATTACH isn't allowed within a transaction
+        for i, path in enumerate(staged):
+            conn.execute(f"ATTACH DATABASE ? AS staged_{i}", (str(path),))
+
+        conn.execute("BEGIN IMMEDIATE")
+        for i in range(len(staged)):
+            _merge_schema(conn, f"staged_{i}")
+        _rebuild_fts(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _merge_schema(conn: sqlite3.Connection, schema: str) -> None:
+    objects = conn.execute(
+        f"SELECT type, name, tbl_name, sql FROM {schema}.sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    virtual = [
+        name
+        for kind, name, _, sql in objects
+        if kind == "table" and sql.upper().startswith("CREATE VIRTUAL TABLE")
+    ]
+    existing = {name for (name,) in conn.execute("SELECT name FROM main.sqlite_master")}
+
+    # Tables first, everything else refers to them
+    objects.sort(key=lambda o: (o[0] != "table", o[1] in virtual))
+    for kind, name, table, sql in objects:
+        # Shadow tables come with their virtual table
+        if any(name.startswith(f"{v}_") for v in virtual):
+            continue
+        if name not in existing:
+            conn.execute(sql)
+        if kind != "table" or name in virtual:
+            continue
+
+        columns = [c[1] for c in conn.execute(f"PRAGMA {schema}.table_info([{name}])")]
+        present = {c[1] for c in conn.execute(f"PRAGMA main.table_info([{name}])")}
+        for column in columns:
+            if column not in present:
+                conn.execute(f"ALTER TABLE main.[{name}] ADD COLUMN [{column}]")
+
+        cols = ", ".join(f"[{c}]" for c in columns)
+        conn.execute(
+            f"INSERT OR REPLACE INTO main.[{name}] ({cols}) "
+            f"SELECT {cols} FROM {schema}.[{name}]"
         )
-        return True
 
 
-class MastodonSource(Source):
-    """Mastodon Source"""
+def _rebuild_fts(conn: sqlite3.Connection) -> None:
+    tables = conn.execute(
+        "SELECT name FROM main.sqlite_master "
+        "WHERE type = 'table' AND upper(sql) LIKE 'CREATE VIRTUAL TABLE%USING FTS%'"
+    )
+    for (name,) in tables.fetchall():
+        conn.execute(f"INSERT INTO main.[{name}]([{name}]) VALUES ('rebuild')")
 
-    name = "mastodon"
-    description = "Mastodon"
-    packages = ["mastodon-to-sqlite"]
-    script = "mastodon-to-sqlite"
 
-    @override
-    def update(self) -> bool:
-        data_points = ["bookmarks", "favourites", "followers", "followings", "statuses"]
-
-        with auth_file(
-            self.auth_file_path,
-            mastodon_domain=os.environ["LENO_MASTODON_DOMAIN"],
-            mastodon_access_token=os.environ["LENO_MASTODON_ACCESS_TOKEN"],
-        ):
-            for data_point in data_points:
-                run(
-                    [
-                        self.script_path,
-                        data_point,
-                        "--auth",
-                        self.auth_file_path,
-                        self.database,
-                    ],
-                    capture_output=True,
-                    check=True,
-                    shell=False,
-                )
-        return True
+def get_source(src: str, data_dir: Path, venv: Path) -> Source:
+    """
+    Returns a Source object, importing its implementation
+    """
+    sources = get_sources()
+    if src in sources:
+        return sources[src].load()(data_dir, venv)
+    else:
+        raise SourceException(f"Invalid source: {src}")
 
 
-class PhotosSource(Source):
-    """Photos Source"""
+def update_sources(
+    sources: Sequence[Source],
+    jobs: int = 4,
+    timeout: float | None = None,
+    on_start: Callable[[Source], None] | None = None,
+    on_done: Callable[[Source, BaseException | None], None] | None = None,
+) -> dict[str, BaseException | None]:
+    """
+    Update sources concurrently on a bounded worker pool
 
-    name = "photos"
-    description = "Apple photos"
-    packages = ["dogsheep-photos"]
-    script = "dogsheep-photos"
-    enabled = False
+    A failing source doesn't stop the others, its exception is returned instead.
 
-    @override
-    def update(self) -> bool:
-        run(
-            [
-                self.script_path,
-                "apple-photos",
-                "--library",
-                Path.home() / "Pictures/Photos Library.photoslibrary",
-                self.database,
-            ],
-            # capture_output=True,
-            check=True,
-            shell=False,
-        )
-        return True
+    :param sources: sources to update, already installed
+    :param jobs: maximum number of sources updated at the same time
+    :param timeout: seconds each source is allowed to spend updating
+    :param on_start: called from the worker when a source starts updating
+    :param on_done: called when a source finishes, with its exception if it failed
+    """
 
+    def work(src: Source) -> None:
+        if on_start:
+            on_start(src)
+        src.commands = {}
+        # Timeout starts once the source leaves the queue
+        if timeout is not None:
+            src.deadline = time.monotonic() + timeout
+        src.update()
 
-class PocketSource(Source):
-    """Pocket Source"""
+    results: dict[str, BaseException | None] = {}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        futures = {pool.submit(work, src): src for src in sources}
+        for future in as_completed(futures):
+            src = futures[future]
+            results[src.name] = future.exception()
+            if on_done:
+                on_done(src, results[src.name])
 
-    name = "pocket"
-    description = "Pocket"
-    packages = ["pocket-to-sqlite"]
-    script = "pocket-to-sqlite"
+    return results
 
-    @override
-    def update(self) -> bool:
-        with auth_file(
-            self.auth_file_path,
-            pocket_consumer_key=os.environ["LENO_POCKET_CONSUMER_KEY"],
-            pocket_username=os.environ["LENO_POCKET_USERNAME"],
-            pocket_access_token=os.environ["LENO_POCKET_ACCESS_TOKEN"],
-        ):
-            run(
-                [
-                    self.script_path,
-                    "fetch",
-                    "--auth",
-                    self.auth_file_path,
-                    self.database,
-                ],
-                capture_output=True,
-                check=True,
-                shell=False,
-            )
-        return True
 
+def get_sources() -> dict[str, "SourceEntry"]:
+    """
+    Returns a dictionary of registered sources, none of them are imported
 
-class SourceException(Exception):
-    """Source Exception"""
+    Sources are registered as ENTRY_POINT_GROUP entry points, the built-in ones
+    are also known when leno runs from a checkout that isn't installed.
+    """
+    return dict(_registry())
 
 
-@contextmanager
-def auth_file(file: Path, **kwargs):
-    if len(kwargs) == 0:
-        raise KeyError("Requires 1 or more key/value pairs")
+@functools.cache
+def _registry() -> tuple[tuple[str, "SourceEntry"], ...]:
+    sources = {
+        name: SourceEntry(name, value) for name, value in BUILTIN_SOURCES.items()
+    }
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        sources[ep.name] = SourceEntry(ep.name, ep.value)
 
-    file.write_text(json.dumps(kwargs))
-    yield
-    file.unlink()
+    return tuple(sorted(sources.items()))
 
 
-def get_source(src: str, data_dir: Path, venv: Path) -> Source:
-    """
-    Returns a Source object
-    """
-    sources = get_sources()
-    if src in sources:
-        return sources[src](data_dir, venv)
-    else:
-        raise SourceException(f"Invalid source: {src}")
+@dataclass(frozen=True)
+class SourceEntry:
+    """Registered source, its implementation is imported by load()"""
 
+    name: str
+    # module:attribute of the Source subclass
+    value: str
 
-def get_sources() -> dict[str, Callable]:
-    """
-    Returns an dictionary of defined sources
-    """
-    symbols = globals()
-    sources = {}
-    for s in symbols:
-        if s.endswith("Source") and s != "Source":
-            name = symbols[s].name
-            sources[name] = symbols[s]
-
-    return sources
+    def load(self) -> type[Source]:
+        module, _, attr = self.value.partition(":")
+        return getattr(importlib.import_module(module), attr)
+
+    @property
+    def description(self) -> str:
+        """
+        Description of the source, read from its module without importing it
+        """
+        module, _, attr = self.value.partition(":")
+        spec = importlib.util.find_spec(module)
+        if spec is not None and spec.origin and spec.origin.endswith(".py"):
+            tree = ast.parse(Path(spec.origin).read_text())
+            for node in tree.body:
+                if not (isinstance(node, ast.ClassDef) and node.name == attr):
+                    continue
+                for stmt in node.body:
+                    if (
+                        isinstance(stmt, ast.Assign)
+                        and isinstance(stmt.value, ast.Constant)
+                        and any(
+                            isinstance(t, ast.Name) and t.id == "description"
+                            for t in stmt.targets
+                        )
+                    ):
+                        return str(stmt.value.value)
+
+        # Computed or inherited, ask the class
+        return self.load().description
@@ -0,0 +1,18 @@
+from typing_extensions import override
+
+from ..source import Source
+
+
+class FeedsSource(Source):
+    """Feeds Source"""
+
+    name = "feeds"
+    description = "RSS feeds"
+    packages = ["feed-to-sqlite"]
+    script = "feed-to-sqlite"
+
+    @override
+    def update(self) -> bool:
+        feeds = ["https://cade.pro/rss.xml"]
+        self.run_command([str(self.script_path), str(self.database)] + feeds)
+        return True
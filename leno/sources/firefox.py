@@ -0,0 +1,159 @@
+import configparser
+import sqlite3
+from pathlib import Path
+
+from typing_extensions import override
+
+from ..source import Source, SourceException
+
+# Pages copied per backup step, the deadline is checked in between
+BACKUP_PAGES = 1024
+# SQLite instructions between deadline checks while syncing
+DEADLINE_CHECK_OPS = 100_000
+
+
+class FirefoxSource(Source):
+    """Firefox Source"""
+
+    name = "firefox"
+    description = 'Firefox "places" (history & bookmarks)'
+    packages = []
+    script = ""
+    interval = 900
+    watermark_columns = {
+        "places": ("moz_places", "last_visit_date"),
+        "visits": ("moz_historyvisits", "visit_date"),
+        "bookmarks": ("moz_bookmarks", "lastModified"),
+    }
+    # Mostly indexed by Firefox itself already, existing indexes are kept
+    indexes = {
+        "moz_places": [("last_visit_date",)],
+        "moz_historyvisits": [("visit_date",)],
+        "moz_bookmarks": [("lastModified",)],
+    }
+    # Synced tables (in dependency order) and the data point whose watermark
+    # selects changed rows, new rows (by id) are always copied
+    synced_tables = {
+        "moz_origins": None,
+        "moz_places": "places",
+        "moz_historyvisits": "visits",
+        "moz_bookmarks": "bookmarks",
+    }
+
+    @override
+    def install(self) -> bool:
+        # No install necessary
+        return True
+
+    @override
+    def update(self) -> bool:
+        places = self.places_path()
+
+        if all(self.watermark(dp) is not None for dp in self.watermark_columns):
+            self.sync(places)
+        else:
+            self.snapshot(places)
+
+        for data_point in self.watermark_columns:
+            self.record_watermark(data_point)
+        return True
+
+    def places_path(self) -> Path:
+        firefox_path = Path.home() / "Library/Application Support/Firefox"
+        firefox_profile_config = firefox_path / "profiles.ini"
+
+        if not firefox_profile_config.is_file():
+            raise SourceException(
+                f"Unable to determine profile, '{firefox_profile_config}' missing"
+            )
+
+        config = configparser.ConfigParser()
+        config.read(firefox_profile_config)
+
+        for i in config.sections():
+            if i.startswith("Install"):
+                # FIXME: Not exactly sure if there might be more than one Install
+                # section
+                return firefox_path / config[i]["Default"] / "places.sqlite"
+
+        raise SourceException(f"No default profile in '{firefox_profile_config}'")
+
+    def snapshot(self, places: Path) -> None:
+        """
+        Full copy of places through the online backup API, safe while Firefox is
+        running
+
+        :param places: live places.sqlite
+        """
+        copy_path = self.database.with_suffix(".tmp")
+        live = sqlite3.connect(f"{places.as_uri()}?mode=ro", uri=True)
+        copy = sqlite3.connect(copy_path)
+        try:
+            live.backup(
+                copy,
+                pages=BACKUP_PAGES,
+                progress=lambda *_: self.check_deadline(),
+            )
+            # Disable sqlite WAL-mode
+            copy.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            copy.close()
+            live.close()
+        copy_path.replace(self.database)
+
+    def sync(self, places: Path) -> None:
+        """
+        Upsert rows added or changed since the last update from the live places
+        and delete those gone from it, e.g. cleared history or removed bookmarks
+
+        Changes that don't move a watermark (a page retitled without a visit)
+        are only picked up by update --full.
+
+        :param places: live places.sqlite, opened read-only
+        """
+        conn = sqlite3.connect(self.database.as_uri(), uri=True, isolation_level=None)
+        # Interrupts the running statement once the deadline passed
+        conn.set_progress_handler(self.past_deadline, DEADLINE_CHECK_OPS)
+        try:
+            conn.execute("ATTACH DATABASE ? AS live", (f"{places.as_uri()}?mode=ro",))
+            conn.execute("BEGIN IMMEDIATE")
+            for table, data_point in self.synced_tables.items():
+                live = {
+                    c[1] for c in conn.execute(f"PRAGMA live.table_info([{table}])")
+                }
+                columns = [
+                    c[1]
+                    for c in conn.execute(f"PRAGMA main.table_info([{table}])")
+                    if c[1] in live
+                ]
+                cols = ", ".join(f"[{c}]" for c in columns)
+
+                where = f"id > (SELECT coalesce(max(id), 0) FROM main.[{table}])"
+                args: tuple = ()
+                if data_point is not None:
+                    column = self.watermark_columns[data_point][1]
+                    where += f" OR [{column}] > ?"
+                    args = (int(self.watermark(data_point) or 0),)
+
+                conn.execute(
+                    f"INSERT OR REPLACE INTO main.[{table}] ({cols}) "
+                    f"SELECT {cols} FROM live.[{table}] WHERE {where}",
+                    args,
+                )
+                conn.execute(
+                    f"DELETE FROM main.[{table}] "
+                    f"WHERE id NOT IN (SELECT id FROM live.[{table}])"
+                )
+            conn.execute("COMMIT")
+        except BaseException as error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if isinstance(error, sqlite3.OperationalError):
+                self.check_deadline()
+            raise
+        finally:
+            conn.close()
+
+    @override
+    def is_installed(self) -> bool:
+        return True
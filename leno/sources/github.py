@@ -0,0 +1,495 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Sequence
+
+import httpx
+from sqlite_utils import Database
+from sqlite_utils.utils import hash_record
+from typing_extensions import override
+
+from ..source import Source, SourceException
+
+API = "https://api.github.com"
+# ETag of every page fetched, sent back as If-None-Match: unchanged pages come
+# back as 304 Not Modified, which doesn't count against the rate limit
+ETAGS_TABLE = "_leno_etags"
+# Forget ETags of pages that weren't requested for this long, e.g. commits
+# since an older watermark
+ETAG_TTL = 30 * 86400
+PER_PAGE = 100
+# Requests left over when the collector starts waiting for the rate limit reset
+RATE_LIMIT_RESERVE = 10
+# Attempts at a request turned away by the rate limit
+RETRIES = 3
+# Repositories whose commits and releases are collected, unless overridden by
+# LENO_GITHUB_REPOS (comma separated)
+REPOS = [
+    "cadeef/cade-task",
+    "cadeef/.files",
+    "cadeef/firefox-to-sqlite",
+    "cadeef/leno",
+]
+
+
+class GithubSource(Source):
+    """Github Source"""
+
+    name = "github"
+    description = "Github"
+    packages = []
+    script = ""
+    watermark_columns = {
+        "commits": ("commits", "committer_date"),
+        "releases": ("releases", "published_at"),
+    }
+    indexes = {
+        "commits": [("committer_date",), ("repo", "committer_date")],
+        "releases": [("published_at",), ("repo", "published_at")],
+    }
+
+    @override
+    def install(self) -> bool:
+        # Collected natively, no install necessary
+        return True
+
+    @override
+    def update(self) -> bool:
+        repos = REPOS
+        if os.environ.get("LENO_GITHUB_REPOS"):
+            repos = [r.strip() for r in os.environ["LENO_GITHUB_REPOS"].split(",")]
+
+        client = self.client or httpx.Client(timeout=30.0)
+        try:
+            self.collect(
+                GithubClient(
+                    client,
+                    os.environ["LENO_GITHUB_TOKEN"],
+                    deadline=self.deadline,
+                    name=self.name,
+                ),
+                [r for r in repos if r],
+            )
+        finally:
+            if client is not self.client:
+                client.close()
+        return True
+
+    @override
+    def is_installed(self) -> bool:
+        return True
+
+    def collect(self, github: "GithubClient", repos: list[str]) -> None:
+        """
+        Fetch the user's repositories, then the commits and releases of repos
+        concurrently, each repository is stored as soon as it's fetched
+
+        :param github: API client
+        :param repos: full names of the repositories, e.g. cadeef/leno
+        """
+        db = Database(self.database)
+        if not self.full:
+            github.etags = load_etags(db)
+
+        fetched = Fetched()
+        for page in github.pages(
+            f"{API}/user/repos", {"sort": "pushed", "per_page": PER_PAGE}, fetched.etags
+        ):
+            fetched.repos += page
+        with db.conn:
+            save(db, fetched)
+
+        with ThreadPoolExecutor(max_workers=max(self.concurrency, 1)) as pool:
+            futures = [
+                pool.submit(fetch_repo, github, full_name, self.since(db, full_name))
+                for full_name in repos
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                fetched = future.result()
+                with db.conn:
+                    save(db, fetched)
+                if self.on_output is not None:
+                    self.on_output(f"{done}/{len(futures)} repos")
+
+        # Once everything is stored, pages requested since have a fresh check
+        if ETAGS_TABLE in db.table_names():
+            with db.conn:
+                db.table(ETAGS_TABLE).delete_where(
+                    "checked_at < ?", [time.time() - ETAG_TTL]
+                )
+
+        for data_point in self.watermark_columns:
+            self.record_watermark(data_point)
+
+    def since(self, db: Database, full_name: str) -> dict[str, str | None]:
+        """
+        Watermark per data point of a repository, None when it has nothing stored
+        yet (or a full sync is due): commits arrive late and repos are added, so
+        the source wide watermark would skip them
+
+        :param db: source database
+        :param full_name: e.g. cadeef/leno
+        """
+        since: dict[str, str | None] = dict.fromkeys(self.watermark_columns)
+        tables = db.table_names()
+        if self.full or "repos" not in tables:
+            return since
+
+        row = db.execute(
+            "SELECT id FROM repos WHERE full_name = ?", [full_name]
+        ).fetchone()
+        if row is None:
+            return since
+        for data_point, (table, column) in self.watermark_columns.items():
+            if table in tables:
+                since[data_point] = db.execute(
+                    f"SELECT max([{column}]) FROM [{table}] WHERE repo = ?", [row[0]]
+                ).fetchone()[0]
+        return since
+
+
+@dataclass
+class Fetched:
+    """What was fetched for a repository (or the user's repositories)"""
+
+    full_name: str | None = None
+    repos: list[dict] = field(default_factory=list)
+    commits: list[dict] = field(default_factory=list)
+    releases: list[dict] = field(default_factory=list)
+    # URL -> ETag of the pages fetched (or found unchanged), stored along the rows
+    etags: dict[str, str] = field(default_factory=dict)
+
+
+class GithubClient:
+    """GitHub's REST API with conditional requests, waiting out the rate limit"""
+
+    def __init__(
+        self,
+        client: httpx.Client,
+        token: str,
+        deadline: float | None = None,
+        name: str = "github",
+    ) -> None:
+        self.client = client
+        self.headers = {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {token}",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+        # time.monotonic() after which no more requests are made
+        self.deadline = deadline
+        # Source name, for errors
+        self.name = name
+        # URL -> ETag of the last response
+        self.etags: dict[str, str] = {}
+        # Rate limit as of the last response, shared by all threads
+        self.lock = threading.Lock()
+        self.remaining: int | None = None
+        self.reset = 0.0
+
+    def get(
+        self, url: str, params: dict | None, etags: dict[str, str]
+    ) -> httpx.Response | None:
+        """
+        GET a page, None when it's unchanged since its ETag was stored
+
+        :param url: API URL
+        :param params: query parameters, if not part of url already
+        :param etags: records the ETag of the page
+        """
+        request = self.client.build_request("GET", url, params=params)
+        request.headers.update(self.headers)
+        key = str(request.url)
+        if key in self.etags:
+            request.headers["If-None-Match"] = self.etags[key]
+
+        for _ in range(RETRIES):
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                raise SourceException(f"Source ({self.name}) timed out")
+            self.throttle()
+            response = self.client.send(request)
+            self.observe(response)
+
+            if response.status_code == httpx.codes.NOT_MODIFIED:
+                etags[key] = self.etags[key]
+                return None
+            if response.status_code in (403, 429) and self.turned_away(response):
+                continue
+
+            response.raise_for_status()
+            if "ETag" in response.headers:
+                etags[key] = response.headers["ETag"]
+            return response
+
+        raise SourceException(f"Github rate limit exceeded fetching {key}")
+
+    def pages(
+        self,
+        url: str,
+        params: dict | None,
+        etags: dict[str, str],
+        until: Callable[[list], bool] | None = None,
+    ) -> Iterator[list]:
+        """
+        Follow the pages of a listing, newest first, stops at the first unchanged
+        page: nothing was added in front of it, so the pages after it are the same
+
+        :param until: stop after the page it returns True for
+        """
+        next_url: str | None = url
+        while next_url:
+            response = self.get(next_url, params, etags)
+            if response is None:
+                return
+            page = response.json()
+            yield page
+            if until is not None and until(page):
+                return
+            next_url = response.links.get("next", {}).get("url")
+            params = None
+
+    def observe(self, response: httpx.Response) -> None:
+        """
+        Track the rate limit reported by a response
+        """
+        if "X-RateLimit-Remaining" not in response.headers:
+            return
+        with self.lock:
+            self.remaining = int(response.headers["X-RateLimit-Remaining"])
+            self.reset = float(response.headers.get("X-RateLimit-Reset", 0))
+
+    def throttle(self) -> None:
+        """
+        Wait for the rate limit to reset when (nearly) out of requests
+        """
+        with self.lock:
+            if self.remaining is None or self.remaining > RATE_LIMIT_RESERVE:
+                return
+            reset = self.reset
+        self.wait(reset)
+        with self.lock:
+            if self.reset <= reset:
+                self.remaining = None
+
+    def turned_away(self, response: httpx.Response) -> bool:
+        """
+        Whether a refused request hit the rate limit and should be retried
+        """
+        if "Retry-After" in response.headers:
+            # Secondary rate limit
+            self.wait(time.time() + float(response.headers["Retry-After"]))
+            return True
+        # Out of requests, throttle() waits for the reset before the retry
+        return response.headers.get("X-RateLimit-Remaining") == "0"
+
+    def wait(self, until: float) -> None:
+        """
+        Sleep until a point in time (seconds since the epoch)
+        """
+        delay = until - time.time()
+        if delay <= 0:
+            return
+        if self.deadline is not None and time.monotonic() + delay > self.deadline:
+            raise SourceException(
+                f"Github rate limit resets after the deadline, in {delay:.0f}s"
+            )
+        time.sleep(delay)
+
+
+def fetch_repo(
+    github: GithubClient, full_name: str, since: dict[str, str | None]
+) -> Fetched:
+    """
+    Fetch a repository, its new commits and releases
+
+    :param github: API client
+    :param full_name: e.g. cadeef/leno
+    :param since: watermark per data point of the repository, None to fetch
+        everything
+    """
+    fetched = Fetched(full_name=full_name)
+    url = f"{API}/repos/{full_name}"
+    response = github.get(url, None, fetched.etags)
+    if response is not None:
+        fetched.repos.append(response.json())
+
+    params: dict[str, Any] = {"per_page": PER_PAGE}
+    if since["commits"] is not None:
+        params["since"] = since["commits"]
+    for page in github.pages(f"{url}/commits", params, fetched.etags):
+        fetched.commits += page
+
+    def older(page: list) -> bool:
+        return any(
+            release["published_at"] and release["published_at"] < since["releases"]
+            for release in page
+        )
+
+    for page in github.pages(
+        f"{url}/releases",
+        {"per_page": PER_PAGE},
+        fetched.etags,
+        until=older if since["releases"] is not None else None,
+    ):
+        fetched.releases += page
+    return fetched
+
+
+def load_etags(db: Database) -> dict[str, str]:
+    if ETAGS_TABLE not in db.table_names():
+        return {}
+    return {row["url"]: row["etag"] for row in db[ETAGS_TABLE].rows}
+
+
+def save(db: Database, fetched: Fetched) -> None:
+    """
+    Upsert what was fetched into github-to-sqlite's tables, along with the ETags
+    of the pages it came from
+    """
+    users: dict[int, dict] = {}
+
+    def user(data: dict | None) -> int | None:
+        if data is None:
+            return None
+        # Drop the API URLs, as github-to-sqlite does
+        row = {
+            k: v
+            for k, v in data.items()
+            if k in ("avatar_url", "html_url") or not k.endswith("url")
+        }
+        # Nested users lack a name, datasette labels foreign keys with it
+        if row.get("name") is None:
+            row["name"] = row["login"]
+        users.setdefault(row["id"], {}).update(row)
+        return row["id"]
+
+    licenses = {}
+    repos = []
+    for data in fetched.repos:
+        repo = _without_urls(data)
+        repo["owner"] = user(repo["owner"])
+        repo["organization"] = user(repo.get("organization"))
+        if repo.get("license"):
+            licenses[repo["license"]["key"]] = repo["license"]
+            repo["license"] = repo["license"]["key"]
+        repos.append(repo)
+
+    repo_id = None
+    if fetched.full_name is not None:
+        if repos:
+            repo_id = repos[0]["id"]
+        elif "repos" in db.table_names():
+            row = db.execute(
+                "SELECT id FROM repos WHERE full_name = ?", [fetched.full_name]
+            ).fetchone()
+            repo_id = row[0] if row else None
+
+    raw_authors = {}
+    commits = []
+    for data in fetched.commits:
+        commit = {
+            "sha": data["sha"],
+            "message": data["commit"]["message"],
+            "author_date": data["commit"]["author"]["date"],
+            "committer_date": data["commit"]["committer"]["date"],
+            "repo": repo_id,
+            "author": user(data.get("author")),
+            "committer": user(data.get("committer")),
+        }
+        for role in ("author", "committer"):
+            raw = {
+                "name": data["commit"][role].get("name"),
+                "email": data["commit"][role].get("email"),
+            }
+            commit[f"raw_{role}"] = raw_id = hash_record(raw)
+            raw_authors[raw_id] = {"id": raw_id, **raw}
+        commits.append(commit)
+
+    releases = []
+    assets = []
+    for data in fetched.releases:
+        release = _without_urls(data)
+        release["repo"] = repo_id
+        release["author"] = user(release.get("author"))
+        for asset in release.pop("assets", None) or []:
+            asset = _without_urls(asset)
+            asset["uploader"] = user(asset.get("uploader"))
+            asset["release"] = release["id"]
+            assets.append(asset)
+        releases.append(release)
+
+    # Referenced tables first, foreign keys are only declared on creation
+    _upsert(db, "users", users.values(), "id")
+    _upsert(db, "licenses", licenses.values(), "key")
+    _upsert(
+        db,
+        "repos",
+        repos,
+        "id",
+        [("owner", "users", "id"), ("license", "licenses", "key")],
+    )
+    _upsert(db, "raw_authors", raw_authors.values(), "id")
+    _upsert(
+        db,
+        "commits",
+        commits,
+        "sha",
+        [
+            ("author", "users", "id"),
+            ("committer", "users", "id"),
+            ("raw_author", "raw_authors", "id"),
+            ("raw_committer", "raw_authors", "id"),
+            ("repo", "repos", "id"),
+        ],
+    )
+    _upsert(
+        db,
+        "releases",
+        releases,
+        "id",
+        [("author", "users", "id"), ("repo", "repos", "id")],
+    )
+    _upsert(
+        db,
+        "assets",
+        assets,
+        "id",
+        [("uploader", "users", "id"), ("release", "releases", "id")],
+    )
+
+    now = time.time()
+    _upsert(
+        db,
+        ETAGS_TABLE,
+        (
+            {"url": url, "etag": etag, "checked_at": now}
+            for url, etag in fetched.etags.items()
+        ),
+        "url",
+    )
+
+
+def _without_urls(data: dict) -> dict:
+    # Ignore the API URLs except html_url, as github-to-sqlite does
+    return {k: v for k, v in data.items() if k == "html_url" or not k.endswith("url")}
+
+
+def _upsert(
+    db: Database,
+    table: str,
+    rows: Any,
+    pk: str,
+    foreign_keys: Sequence[tuple[str, str, str]] = (),
+) -> None:
+    rows = list(rows)
+    if not rows:
+        return
+    db.table(table).upsert_all(
+        rows,
+        pk=pk,
+        alter=True,
+        # Skip references to tables that don't exist (yet)
+        foreign_keys=[fk for fk in foreign_keys if db[fk[1]].exists()],
+    )
@@ -0,0 +1,300 @@
+import hashlib
+import os
+import sqlite3
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Callable, Iterator
+from xml.etree.ElementTree import Element, iterparse
+
+from sqlite_utils.db import jsonify_if_needed
+from sqlite_utils.utils import hash_record
+from typing_extensions import override
+
+from ..source import Source, SourceException
+
+# Column holding a hash of the record, unique so re-imports skip known records
+HASH_COLUMN = "_leno_hash"
+# Columns derived from the others, left out of the hash: their values may be
+# encoded differently by healthkit-to-sqlite
+DERIVED_COLUMNS = {"id", "workout_events"}
+# Rows buffered per table before they are written
+BATCH_SIZE = 5000
+
+
+class HealthkitSource(Source):
+    """Healthkit Source"""
+
+    name = "healthkit"
+    description = "Apple health data"
+    packages = []
+    script = ""
+    # Exports are made by hand, weekly at best
+    interval = 86400
+
+    @override
+    def install(self) -> bool:
+        # Imported natively, no install necessary
+        return True
+
+    @override
+    def update(self) -> bool:
+        export = Path(os.environ.get("LENO_HEALTHKIT_EXPORT", "exports/healthkit.zip"))
+        if not export.is_file():
+            raise SourceException(f"Health export '{export}' missing")
+
+        def progress(records: int) -> None:
+            if self.on_output is not None:
+                self.on_output(f"{records:,} records read")
+
+        import_export(export, self.database, progress=progress, deadline=self.deadline)
+        return True
+
+    @override
+    def is_installed(self) -> bool:
+        return True
+
+
+def table_name(record_type: str) -> str:
+    """
+    healthkit-to-sqlite's table for a record type, e.g. rStepCount
+    """
+    return "r" + record_type.replace("HKQuantityTypeIdentifier", "").replace(
+        "HKCategoryTypeIdentifier", ""
+    )
+
+
+class Importer:
+    """Buffers rows per table and writes them in batches, skipping known rows"""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.buffers: dict[str, list[dict[str, str]]] = {}
+        self.columns: dict[str, list[str]] = {}
+        # Tables whose hash column is known to be uniquely indexed
+        self.indexed: set[str] = set()
+        # Rows inserted per table
+        self.inserted: dict[str, int] = {}
+
+    def add(self, table: str, row: dict[str, str]) -> None:
+        row[HASH_COLUMN] = row_hash(table, row)
+
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= BATCH_SIZE:
+            self.flush(table)
+
+    def flush(self, table: str) -> None:
+        rows = self.buffers.pop(table, [])
+        if not rows:
+            return
+
+        columns = self.ensure_columns(table, {key for row in rows for key in row})
+        cols = ", ".join(f"[{c}]" for c in columns)
+        cursor = self.conn.executemany(
+            f"INSERT OR IGNORE INTO [{table}] ({cols}) "
+            f"VALUES ({', '.join('?' for _ in columns)})",
+            ([row.get(c) for c in columns] for row in rows),
+        )
+        self.inserted[table] = self.inserted.get(table, 0) + cursor.rowcount
+
+    def flush_all(self) -> None:
+        for table in list(self.buffers):
+            self.flush(table)
+
+    def ensure_columns(self, table: str, keys: set[str]) -> list[str]:
+        """
+        Create the table or add the columns it's missing, returns its columns
+        """
+        if table not in self.columns:
+            self.columns[table] = [
+                row[1] for row in self.conn.execute(f"PRAGMA table_info([{table}])")
+            ]
+        columns = self.columns[table]
+
+        if not columns:
+            self.conn.execute(f"CREATE TABLE [{table}] ([{HASH_COLUMN}] TEXT)")
+            columns.append(HASH_COLUMN)
+        elif HASH_COLUMN not in columns:
+            # Written by healthkit-to-sqlite
+            self.conn.execute(f"ALTER TABLE [{table}] ADD COLUMN [{HASH_COLUMN}] TEXT")
+            columns.append(HASH_COLUMN)
+        if table not in self.indexed:
+            self.ensure_unique(table)
+            self.indexed.add(table)
+
+        # Column names are case insensitive
+        known = {column.lower() for column in columns}
+        for key in sorted(k for k in keys if k.lower() not in known):
+            self.conn.execute(f"ALTER TABLE [{table}] ADD COLUMN [{key}] TEXT")
+            columns.append(key)
+            known.add(key.lower())
+        return columns
+
+    def ensure_unique(self, table: str) -> None:
+        """
+        Hash the rows imported without one and drop duplicates, then index the
+        hashes so known rows are skipped
+        """
+        index = f"{table}_{HASH_COLUMN}"
+        if any(
+            row[1] == index
+            for row in self.conn.execute(f"PRAGMA index_list([{table}])")
+        ):
+            return
+
+        while True:
+            cursor = self.conn.execute(
+                f"SELECT rowid, * FROM [{table}] WHERE [{HASH_COLUMN}] IS NULL "
+                f"LIMIT {BATCH_SIZE}"
+            )
+            names = [d[0] for d in cursor.description][1:]
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            self.conn.executemany(
+                f"UPDATE [{table}] SET [{HASH_COLUMN}] = ? WHERE rowid = ?",
+                (
+                    (
+                        row_hash(
+                            table,
+                            {
+                                k: str(v)
+                                for k, v in zip(names, row[1:])
+                                if v is not None and k != HASH_COLUMN
+                            },
+                        ),
+                        row[0],
+                    )
+                    for row in rows
+                ),
+            )
+
+        self.conn.execute(
+            f"DELETE FROM [{table}] WHERE rowid NOT IN "
+            f"(SELECT min(rowid) FROM [{table}] GROUP BY [{HASH_COLUMN}])"
+        )
+        self.conn.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS [{index}] "
+            f"ON [{table}] ([{HASH_COLUMN}])"
+        )
+
+
+def row_hash(table: str, row: dict[str, str]) -> str:
+    """
+    Hash of a record's attributes, the same whichever order they come in
+    """
+    content = "\x1f".join(
+        f"{k}\x1e{v}" for k, v in sorted(row.items()) if k not in DERIVED_COLUMNS
+    )
+    return hashlib.sha1(f"{table}\x1f{content}".encode()).hexdigest()
+
+
+def import_export(
+    export: Path,
+    database: Path,
+    progress: Callable[[int], None] | None = None,
+    deadline: float | None = None,
+) -> dict[str, int]:
+    """
+    Import an Apple Health export into healthkit-to-sqlite's tables, returns rows
+    inserted per table
+
+    The XML is streamed out of the zip, elements are cleared once read. Rows go
+    in within a single transaction, those already imported are skipped.
+
+    :param export: export.zip as exported by the Health app, or its export.xml
+    :param database: database to import into
+    :param progress: called with the number of records read, once per batch
+    :param deadline: time.monotonic() after which the import is rolled back
+    """
+    conn = sqlite3.connect(database, isolation_level=None)
+    importer = Importer(conn)
+    records = 0
+    try:
+        with _open_export(export) as xml:
+            conn.execute("BEGIN IMMEDIATE")
+
+            root = None
+            for event, el in iterparse(xml, events=("start", "end")):
+                if root is None:
+                    root = el
+                if event != "end":
+                    continue
+
+                if el.tag == "Record":
+                    row = _with_metadata(el)
+                    importer.add(table_name(row.pop("type", "")), row)
+                    records += 1
+                    if records % BATCH_SIZE == 0:
+                        if deadline is not None and time.monotonic() > deadline:
+                            raise SourceException(f"Import of '{export}' timed out")
+                        if progress is not None:
+                            progress(records)
+                elif el.tag == "Workout":
+                    workout = _workout(el)
+                    importer.add("workouts", workout)
+                    for location in el.iterfind("WorkoutRoute/Location"):
+                        importer.add(
+                            "workout_points",
+                            dict(location.attrib, workout_id=workout["id"]),
+                        )
+                elif el.tag == "ActivitySummary":
+                    importer.add("activity_summary", dict(el.attrib))
+                else:
+                    continue
+
+                # Drop what has been read, including the root's references to it
+                el.clear()
+                if root is not None:
+                    root.clear()
+
+            importer.flush_all()
+            conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    if progress is not None:
+        progress(records)
+    return importer.inserted
+
+
+def _with_metadata(el: Element) -> dict[str, str]:
+    row = dict(el.attrib)
+    for entry in el.iterfind("MetadataEntry"):
+        row[f"metadata_{entry.get('key')}"] = entry.get("value", "")
+    return row
+
+
+def _workout(el: Element) -> dict[str, str]:
+    """
+    Workout row as healthkit-to-sqlite writes it: its id hashes the workout
+    and its events, the events are kept as JSON
+    """
+    row: dict = _with_metadata(el)
+    row["workout_events"] = [dict(e.attrib) for e in el.iterfind("WorkoutEvent")]
+    row["id"] = hash_record(row)
+    row["workout_events"] = jsonify_if_needed(row["workout_events"])
+    return row
+
+
+@contextmanager
+def _open_export(export: Path) -> Iterator[IO[bytes]]:
+    if not zipfile.is_zipfile(export):
+        with export.open("rb") as xml:
+            yield xml
+        return
+
+    with zipfile.ZipFile(export) as archive:
+        for name in archive.namelist():
+            if Path(name).name == "export.xml":
+                with archive.open(name) as xml:
+                    yield xml
+                return
+
+    raise SourceException(f"No export.xml in '{export}'")
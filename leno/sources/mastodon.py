@@ -0,0 +1,48 @@
+import os
+
+from typing_extensions import override
+
+from ..source import Source, auth_file
+
+
+class MastodonSource(Source):
+    """Mastodon Source"""
+
+    name = "mastodon"
+    description = "Mastodon"
+    packages = ["mastodon-to-sqlite"]
+    script = "mastodon-to-sqlite"
+    interval = 900
+    watermark_columns = {
+        "bookmarks": ("bookmarks", "created_at"),
+        "favourites": ("favorites", "created_at"),
+        "statuses": ("statuses", "created_at"),
+    }
+    indexes = {
+        "bookmarks": [("created_at",)],
+        "favorites": [("created_at",)],
+        "statuses": [("created_at",)],
+    }
+
+    @override
+    def update(self) -> bool:
+        data_points = ["bookmarks", "favourites", "followers", "followings", "statuses"]
+
+        with auth_file(
+            self.auth_file_path,
+            mastodon_domain=os.environ["LENO_MASTODON_DOMAIN"],
+            mastodon_access_token=os.environ["LENO_MASTODON_ACCESS_TOKEN"],
+        ):
+            self.update_data_points(
+                data_points,
+                lambda data_point, database: [
+                    self.script_path,
+                    data_point,
+                    "--auth",
+                    self.auth_file_path,
+                    database,
+                ],
+            )
+            # FIXME: mastodon-to-sqlite can't fetch only newer records, the
+            # watermarks are recorded but not passed back (yet)
+        return True
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from typing_extensions import override
+
+from ..source import Source
+
+
+class PhotosSource(Source):
+    """Photos Source"""
+
+    name = "photos"
+    description = "Apple photos"
+    packages = ["dogsheep-photos"]
+    script = "dogsheep-photos"
+    interval = 86400
+    enabled = False
+
+    @override
+    def update(self) -> bool:
+        self.run_command(
+            [
+                self.script_path,
+                "apple-photos",
+                "--library",
+                Path.home() / "Pictures/Photos Library.photoslibrary",
+                self.database,
+            ],
+            capture_output=False,
+        )
+        return True
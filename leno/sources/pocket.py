@@ -0,0 +1,38 @@
+import os
+
+from typing_extensions import override
+
+from ..source import Source, auth_file
+
+
+class PocketSource(Source):
+    """Pocket Source"""
+
+    name = "pocket"
+    description = "Pocket"
+    packages = ["pocket-to-sqlite"]
+    script = "pocket-to-sqlite"
+    watermark_columns = {"items": ("items", "time_updated")}
+    indexes = {"items": [("time_added",), ("time_updated",)]}
+
+    @override
+    def update(self) -> bool:
+        with auth_file(
+            self.auth_file_path,
+            pocket_consumer_key=os.environ["LENO_POCKET_CONSUMER_KEY"],
+            pocket_username=os.environ["LENO_POCKET_USERNAME"],
+            pocket_access_token=os.environ["LENO_POCKET_ACCESS_TOKEN"],
+        ):
+            cmd = [
+                self.script_path,
+                "fetch",
+                "--auth",
+                self.auth_file_path,
+                self.database,
+            ]
+            # fetch only requests items added since its last run unless --all
+            if self.watermark("items") is None:
+                cmd.append("--all")
+            self.run_command(cmd)
+            self.record_watermark("items")
+        return True
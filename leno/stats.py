@@ -0,0 +1,241 @@
+import json
+import math
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Sequence
+
+# leno.db in the app dir, leno's own bookkeeping (not served by datasette)
+DATABASE = "leno.db"
+RUNS = "_leno_runs"
+
+
+@dataclass
+class Run:
+    """One update of one source"""
+
+    source: str
+    # Seconds since the epoch
+    started_at: float
+    ended_at: float
+    ok: bool
+    # Step (collector command, timeline, search) -> seconds
+    steps: dict[str, float] = field(default_factory=dict)
+    # Table -> rows added
+    rows_added: dict[str, int] = field(default_factory=dict)
+    # Database size in bytes once updated
+    db_size: int = 0
+    error: str | None = None
+
+    @property
+    def duration(self) -> float:
+        return self.ended_at - self.started_at
+
+
+@dataclass
+class SourceStats:
+    """Summary of a source's recent runs"""
+
+    source: str
+    runs: int
+    failures: int
+    # Seconds
+    p50: float
+    p95: float
+    # Rows added per second spent updating
+    rows_per_sec: float
+    # Database size of the last run, in bytes
+    db_size: int
+    # Growth per day between the first and last run, None with a single run
+    bytes_per_day: float | None
+    rows_per_day: float | None
+    # Seconds since the epoch
+    last_run: float
+
+
+def connect(app_dir: Path) -> sqlite3.Connection:
+    """
+    Connection to leno.db with the runs table created
+
+    :param app_dir: leno's app directory
+    """
+    app_dir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(app_dir / DATABASE)
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS [{RUNS}] (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            ended_at REAL NOT NULL,
+            duration REAL NOT NULL,
+            ok INTEGER NOT NULL,
+            error TEXT,
+            steps TEXT NOT NULL,
+            rows_added TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            db_size INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS [{RUNS}_source]
+            ON [{RUNS}] (source, started_at DESC);
+        """
+    )
+    return conn
+
+
+def table_marks(database: Path) -> dict[str, int]:
+    """
+    Largest rowid of every table in the database, empty if it doesn't exist
+
+    A lookup at the end of each rowid index, unlike count(*) it doesn't scan
+    multi-GB tables before and after every update.
+
+    :param database: a source's database
+    """
+    if not database.is_file():
+        return {}
+
+    conn = sqlite3.connect(f"{database.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        # Leaves out views, virtual tables, their shadow tables and tables
+        # without a rowid
+        tables = [
+            row[1]
+            for row in conn.execute("PRAGMA main.table_list")
+            if row[2] == "table" and not row[4] and not row[1].startswith("sqlite_")
+        ]
+        return {
+            table: conn.execute(
+                f"SELECT coalesce(max(rowid), 0) FROM [{table}]"
+            ).fetchone()[0]
+            for table in tables
+        }
+    finally:
+        conn.close()
+
+
+def rows_added(before: dict[str, int], after: dict[str, int]) -> dict[str, int]:
+    """
+    Rows added per table, from the table_marks before and after an update
+
+    Rows replaced under a new rowid count as added, deleted rows aren't taken
+    off.
+    """
+    return {
+        table: mark - before.get(table, 0)
+        for table, mark in after.items()
+        if mark > before.get(table, 0)
+    }
+
+
+def record_run(app_dir: Path, run: Run) -> None:
+    """
+    Store a run in leno.db
+
+    :param app_dir: leno's app directory
+    :param run: the finished run
+    """
+    conn = connect(app_dir)
+    try:
+        with conn:
+            conn.execute(
+                f"""
+                INSERT INTO [{RUNS}] (source, started_at, ended_at, duration, ok,
+                    error, steps, rows_added, rows, db_size)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    run.source,
+                    run.started_at,
+                    run.ended_at,
+                    run.duration,
+                    run.ok,
+                    run.error,
+                    json.dumps(run.steps),
+                    json.dumps(run.rows_added),
+                    sum(run.rows_added.values()),
+                    run.db_size,
+                ),
+            )
+    finally:
+        conn.close()
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """
+    Nearest-rank percentile
+
+    :param values: at least one value
+    :param p: percentile between 0 and 1
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p * len(ordered)) - 1, 0)]
+
+
+def summarize(
+    app_dir: Path, sources: Sequence[str] = (), last: int = 100
+) -> list[SourceStats]:
+    """
+    Per source statistics of the most recent runs, by source name
+
+    :param app_dir: leno's app directory
+    :param sources: only these sources
+    :param last: runs per source to consider
+    """
+    where = ""
+    params: dict = {"last": last}
+    if sources:
+        names = {f"source_{i}": s for i, s in enumerate(sources)}
+        where = f"WHERE source IN ({', '.join(f':{n}' for n in names)})"
+        params.update(names)
+
+    conn = connect(app_dir)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT source, started_at, duration, ok, rows, db_size
+            FROM (
+                SELECT *, row_number() OVER (
+                    PARTITION BY source ORDER BY started_at DESC
+                ) AS recent
+                FROM [{RUNS}] {where}
+            )
+            WHERE recent <= :last
+            ORDER BY source, started_at
+            """,
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+
+    runs: dict[str, list[sqlite3.Row]] = {}
+    for row in rows:
+        runs.setdefault(row["source"], []).append(row)
+
+    summaries = []
+    for source, source_runs in runs.items():
+        succeeded = [r for r in source_runs if r["ok"]] or source_runs
+        durations = [r["duration"] for r in succeeded]
+        first, latest = source_runs[0], source_runs[-1]
+        days = (latest["started_at"] - first["started_at"]) / 86400
+        # Rows of the first run were added before the window started
+        added = sum(r["rows"] for r in source_runs[1:])
+
+        summaries.append(
+            SourceStats(
+                source=source,
+                runs=len(source_runs),
+                failures=sum(1 for r in source_runs if not r["ok"]),
+                p50=percentile(durations, 0.5),
+                p95=percentile(durations, 0.95),
+                rows_per_sec=sum(r["rows"] for r in succeeded) / (sum(durations) or 1),
+                db_size=latest["db_size"],
+                bytes_per_day=(latest["db_size"] - first["db_size"]) / days
+                if days
+                else None,
+                rows_per_day=added / days if days else None,
+                last_run=latest["started_at"],
+            )
+        )
+    return summaries
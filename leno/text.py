@@ -0,0 +1,82 @@
+from functools import lru_cache
+from html.parser import HTMLParser
+
+# Elements ending a block of text
+BLOCKS = {"p", "div", "blockquote", "li", "pre", "h1", "h2", "h3", "h4", "h5", "h6"}
+# Elements whose content isn't text
+SKIPPED = {"script", "style", "template"}
+
+
+class TextExtractor(HTMLParser):
+    """
+    Streaming HTML to readable text converter, links keep their target
+
+    No tree is built, text is collected as the tokenizer emits it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        # (href, index of the link's first part) of the open link
+        self.link: tuple[str, int] | None = None
+        self.skipping = 0
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in SKIPPED:
+            self.skipping += 1
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag == "a":
+            self.link = (dict(attrs).get("href") or "", len(self.parts))
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in SKIPPED:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in BLOCKS:
+            self.parts.append("\n\n")
+        elif tag == "a" and self.link is not None:
+            href, start = self.link
+            self.link = None
+            text = "".join(self.parts[start:]).strip()
+            if readable_link(text, href):
+                self.parts.append(f" ({href})")
+
+    def handle_data(self, data: str) -> None:
+        if not self.skipping:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        lines = "".join(self.parts).splitlines()
+        text = "\n".join(line.strip() for line in lines)
+        # Collapse runs of blank lines left by nested blocks
+        while "\n\n\n" in text:
+            text = text.replace("\n\n\n", "\n\n")
+        return text.strip()
+
+
+def readable_link(text: str, href: str) -> bool:
+    """
+    Whether a link's target adds anything to its text
+
+    Mentions, hashtags and links that already show their URL don't need it.
+    """
+    if not href or not text or text[0] in "@#":
+        return False
+    shown = text.rstrip("…/").split("://", 1)[-1]
+    return not href.split("://", 1)[-1].startswith(shown)
+
+
+@lru_cache(maxsize=8192)
+def html_to_text(content: str) -> str:
+    """
+    Readable text from an HTML fragment, e.g. a Mastodon status
+
+    Memoized on content, so statuses that are both bookmarked and favourited
+    are converted once.
+
+    :param content: HTML fragment
+    """
+    parser = TextExtractor()
+    parser.feed(content)
+    parser.close()
+    return parser.text()
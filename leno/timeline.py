@@ -0,0 +1,225 @@
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+from .text import html_to_text
+
+# timeline.db in the data dir, served by datasette like any other database
+TIMELINE = "timeline"
+
+
+@dataclass
+class Projection:
+    """How the rows of a source table become timeline rows"""
+
+    source: str
+    label: str
+    # Tables the query needs in the source database
+    tables: list[str]
+    # Selects uid, title, description, html (description is HTML), ts (epoch) and
+    # link from the database attached as the source's name
+    query: str
+    # Column behind ts, to sort on before projecting
+    order_by: str
+
+
+PROJECTIONS = [
+    Projection(
+        source="mastodon",
+        label="bookmark",
+        tables=["bookmarks"],
+        query="""
+        SELECT id AS uid, ':elephant: ' || username AS title, content AS description,
+            1 AS html, CAST(strftime('%s', created_at) AS INTEGER) AS ts,
+            url || '/' || id AS link
+        FROM mastodon.bookmarks
+        """,
+        order_by="created_at",
+    ),
+    Projection(
+        source="github",
+        label="release",
+        tables=["releases", "repos"],
+        query="""
+        SELECT releases.id AS uid,
+            repos.full_name || ' ' || releases.tag_name AS title,
+            releases.body AS description, 0 AS html,
+            CAST(strftime('%s', releases.published_at) AS INTEGER) AS ts,
+            releases.html_url AS link
+        FROM github.releases JOIN github.repos ON repos.id = releases.repo
+        WHERE releases.published_at IS NOT NULL
+        """,
+        order_by="releases.published_at",
+    ),
+    Projection(
+        source="mastodon",
+        label="favorite",
+        tables=["favorites"],
+        query="""
+        SELECT id AS uid, ':elephant: ' || username AS title, content AS description,
+            1 AS html, CAST(strftime('%s', created_at) AS INTEGER) AS ts,
+            url || '/' || id AS link
+        FROM mastodon.favorites
+        """,
+        order_by="created_at",
+    ),
+]
+
+
+def connect(data_dir: Path, databases: set[str]) -> sqlite3.Connection:
+    """
+    Connection with the existing databases of data_dir attached read-only
+
+    :param data_dir: directory the sources write their databases to
+    :param databases: database names, e.g. mastodon for mastodon.db
+    """
+    conn = sqlite3.connect("file::memory:", uri=True)
+    for name in sorted(databases):
+        database = data_dir / f"{name}.db"
+        if database.is_file():
+            conn.execute(
+                f"ATTACH DATABASE ? AS [{name}]",
+                (f"{database.resolve().as_uri()}?mode=ro",),
+            )
+    return conn
+
+
+def available(conn: sqlite3.Connection, projection: Projection) -> bool:
+    """
+    Whether every table the projection needs is attached
+    """
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list")]
+    if projection.source not in schemas:
+        return False
+    tables = {
+        name
+        for (name,) in conn.execute(
+            f"SELECT name FROM [{projection.source}].sqlite_master "
+            "WHERE type IN ('table', 'view')"
+        )
+    }
+    return all(table in tables for table in projection.tables)
+
+
+def create(conn: sqlite3.Connection, schema: str, table: str) -> None:
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS [{schema}].[{table}] (
+            source TEXT NOT NULL,
+            label TEXT NOT NULL,
+            uid TEXT NOT NULL,
+            title TEXT,
+            description TEXT,
+            ts INTEGER NOT NULL,
+            link TEXT,
+            PRIMARY KEY (source, label, uid)
+        );
+        CREATE INDEX IF NOT EXISTS [{schema}].[{table}_ts] ON [{table}] (ts DESC);
+        """
+    )
+
+
+def materialize(
+    data_dir: Path,
+    database: str,
+    table: str,
+    projections: list[Projection],
+    source: str,
+    full: bool = False,
+) -> int:
+    """
+    Bring the source's projected rows in database.table up to date, returns rows
+    written
+
+    Only rows at least as new as the newest row of each projection are read,
+    along with those missing, e.g. an old status bookmarked since. Rows that
+    didn't change aren't rewritten.
+
+    :param data_dir: directory the sources write their databases to
+    :param database: name of the database to maintain in data_dir
+    :param table: table to maintain, created if missing
+    :param projections: projections to materialize, those of other sources are
+        skipped
+    :param source: source that was just updated
+    :param full: rebuild the source's rows from scratch
+    """
+    projections = [p for p in projections if p.source == source]
+    if not projections:
+        return 0
+
+    conn = connect(data_dir, {source})
+    conn.execute(
+        f"ATTACH DATABASE ? AS [{database}]", (str(data_dir / f"{database}.db"),)
+    )
+    target = f"[{database}].[{table}]"
+    written = 0
+    try:
+        create(conn, database, table)
+        with conn:
+            if full:
+                conn.execute(f"DELETE FROM {target} WHERE source = ?", (source,))
+
+            for projection in projections:
+                if not available(conn, projection):
+                    continue
+
+                (newest,) = conn.execute(
+                    f"SELECT coalesce(max(ts), 0) FROM {target} "
+                    "WHERE source = ? AND label = ?",
+                    (source, projection.label),
+                ).fetchone()
+                rows = conn.execute(
+                    f"""
+                    SELECT p.* FROM ({projection.query}) AS p
+                    WHERE p.ts >= ? OR NOT EXISTS (
+                        SELECT 1 FROM {target} AS t
+                        WHERE t.source = ? AND t.label = ?
+                            AND t.uid = CAST(p.uid AS TEXT)
+                    )
+                    """,
+                    (newest, source, projection.label),
+                )
+                upserts = conn.executemany(
+                    f"""
+                    INSERT INTO {target}
+                        (source, label, uid, title, description, ts, link)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (source, label, uid) DO UPDATE SET
+                        title = excluded.title,
+                        description = excluded.description,
+                        ts = excluded.ts,
+                        link = excluded.link
+                    WHERE (title, description, ts, link) IS NOT
+                        (excluded.title, excluded.description, excluded.ts,
+                         excluded.link)
+                    """,
+                    (
+                        (
+                            source,
+                            projection.label,
+                            str(uid),
+                            title,
+                            html_to_text(description or "") if html else description,
+                            ts,
+                            link,
+                        )
+                        for uid, title, description, html, ts, link in rows
+                    ),
+                )
+                # Trigger changes (e.g. full-text indexes) aren't counted
+                written += upserts.rowcount
+    finally:
+        conn.close()
+
+    return written
+
+
+def update_timeline(data_dir: Path, source: str, full: bool = False) -> int:
+    """
+    Bring the source's rows in timeline.db up to date, returns rows written
+
+    :param data_dir: directory the sources write their databases to
+    :param source: source that was just updated
+    :param full: rebuild the source's rows from scratch
+    """
+    return materialize(data_dir, TIMELINE, "timeline", PROJECTIONS, source, full)
@@ -1 +1,248 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zipfile
+from pathlib import Path
+
+import httpx
+
 SOURCES = ["feeds", "firefox", "github", "healthkit", "mastodon", "photos", "pocket"]
+
+MASTODON_ROWS = [
+    {
+        "id": "110000000000000001",
+        "username": "cadeef",
+        "content": "<p>Hello <a href='https://cade.pro'>world</a></p>",
+        "created_at": "2023-08-01T12:00:00.000Z",
+        "url": "https://ioc.exchange/@cadeef",
+    },
+    {
+        "id": "110000000000000002",
+        "username": "leno",
+        "content": "<p>Second post</p>",
+        "created_at": "2023-08-03T12:00:00.000Z",
+        "url": "https://ioc.exchange/@leno",
+    },
+]
+
+GITHUB_RELEASE_ROWS = [
+    {
+        "repo": {"value": 1, "label": "cadeef/leno"},
+        "tag_name": "v0.1.0",
+        "body": "First release",
+        "published_at": "2023-08-02T12:00:00Z",
+        "html_url": "https://github.com/cadeef/leno/releases/tag/v0.1.0",
+    },
+]
+
+
+def firefox_profile(home: Path) -> Path:
+    """
+    Minimal Firefox profile below home, returns its places.sqlite
+    """
+    firefox = home / "Library/Application Support/Firefox"
+    profile = firefox / "Profiles/leno.default"
+    profile.mkdir(parents=True)
+    (firefox / "profiles.ini").write_text(
+        "[Install4F96D1932A9F858E]\nDefault=Profiles/leno.default\n"
+    )
+
+    places = profile / "places.sqlite"
+    conn = sqlite3.connect(places)
+    conn.executescript(
+        """
+        PRAGMA journal_mode=WAL;
+        CREATE TABLE moz_origins (id INTEGER PRIMARY KEY, host TEXT);
+        CREATE TABLE moz_places (
+            id INTEGER PRIMARY KEY, url TEXT, title TEXT, origin_id INTEGER,
+            last_visit_date INTEGER
+        );
+        CREATE TABLE moz_historyvisits (
+            id INTEGER PRIMARY KEY, place_id INTEGER, visit_date INTEGER
+        );
+        CREATE TABLE moz_bookmarks (
+            id INTEGER PRIMARY KEY, fk INTEGER, title TEXT, lastModified INTEGER
+        );
+        INSERT INTO moz_origins VALUES (1, 'cade.pro');
+        INSERT INTO moz_places VALUES (1, 'https://cade.pro', 'Cade', 1, 100);
+        INSERT INTO moz_historyvisits VALUES (1, 1, 100);
+        INSERT INTO moz_bookmarks VALUES (1, 1, 'Cade', 100);
+        """
+    )
+    conn.close()
+    return places
+
+
+def local_databases(data_dir: Path) -> None:
+    """
+    mastodon.db and github.db as their collectors would write them
+    """
+    data_dir.mkdir(parents=True, exist_ok=True)
+    mastodon = sqlite3.connect(data_dir / "mastodon.db")
+    with mastodon:
+        for table, rows in (
+            ("bookmarks", MASTODON_ROWS[:1]),
+            ("favorites", MASTODON_ROWS[1:]),
+        ):
+            mastodon.execute(
+                f"CREATE TABLE {table} "
+                "(id TEXT PRIMARY KEY, username, content, created_at, url)"
+            )
+            mastodon.executemany(
+                f"INSERT INTO {table} VALUES "
+                "(:id, :username, :content, :created_at, :url)",
+                rows,
+            )
+    mastodon.close()
+
+    github = sqlite3.connect(data_dir / "github.db")
+    with github:
+        github.execute("CREATE TABLE repos (id INTEGER PRIMARY KEY, full_name)")
+        github.execute(
+            "CREATE TABLE releases (id INTEGER PRIMARY KEY, repo, tag_name, body, "
+            "published_at, html_url)"
+        )
+        for i, r in enumerate(GITHUB_RELEASE_ROWS):
+            github.execute(
+                "INSERT OR IGNORE INTO repos VALUES (?, ?)",
+                (r["repo"]["value"], r["repo"]["label"]),
+            )
+            github.execute(
+                "INSERT INTO releases VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    i,
+                    r["repo"]["value"],
+                    r["tag_name"],
+                    r["body"],
+                    r["published_at"],
+                    r["html_url"],
+                ),
+            )
+    github.close()
+
+
+def healthkit_export(path: Path, records: list[str]) -> Path:
+    """
+    Zipped Apple Health export with the given Record elements, returns path
+    """
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<HealthData locale="en_US">\n'
+        ' <ExportDate value="2023-08-07 09:00:00 -0700"/>\n'
+        + "\n".join(records)
+        + '\n <Workout workoutActivityType="HKWorkoutActivityTypeWalking" '
+        'duration="30" startDate="2023-08-05 08:00:00 -0700">\n'
+        '  <MetadataEntry key="HKIndoorWorkout" value="0"/>\n'
+        '  <WorkoutEvent type="HKWorkoutEventTypePause" '
+        'date="2023-08-05 08:10:00 -0700"/>\n'
+        "  <WorkoutRoute>\n"
+        '   <Location date="2023-08-05 08:00:00 -0700" latitude="45.5" '
+        'longitude="-122.6"/>\n'
+        '   <Location date="2023-08-05 08:01:00 -0700" latitude="45.6" '
+        'longitude="-122.6"/>\n'
+        "  </WorkoutRoute>\n </Workout>\n"
+        ' <ActivitySummary dateComponents="2023-08-05" activeEnergyBurned="420"/>\n'
+        "</HealthData>\n"
+    )
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("apple_health_export/export.xml", xml)
+    return path
+
+
+def healthkit_record(i: int, kind: str = "StepCount") -> str:
+    return (
+        f' <Record type="HKQuantityTypeIdentifier{kind}" sourceName="Watch" '
+        f'unit="count" value="{i}" startDate="2023-08-0{i % 9 + 1} 08:00:00 -0700">'
+        '\n  <MetadataEntry key="HKWasUserEntered" value="0"/>\n </Record>'
+    )
+
+
+class GithubAPI:
+    """Just enough of GitHub's REST API, ETags and rate limit included"""
+
+    def __init__(self, commits: int = 3, per_page: int = 2) -> None:
+        self.user = {"login": "cadeef", "id": 1, "url": "https://api.github.com/u"}
+        self.repo = {
+            "id": 10,
+            "name": "leno",
+            "full_name": "cadeef/leno",
+            "html_url": "https://github.com/cadeef/leno",
+            "url": "https://api.github.com/repos/cadeef/leno",
+            "owner": self.user,
+            "license": {"key": "mit", "name": "MIT License"},
+            "topics": ["sqlite"],
+        }
+        self.commits = [self.commit(i) for i in range(commits, 0, -1)]
+        self.releases = [
+            {
+                "id": 100,
+                "tag_name": "v0.1.0",
+                "body": "First",
+                "published_at": "2023-08-01T00:00:00Z",
+                "html_url": "https://github.com/cadeef/leno/releases/v0.1.0",
+                "author": self.user,
+                "assets": [{"id": 1000, "name": "leno.whl", "uploader": self.user}],
+            }
+        ]
+        self.per_page = per_page
+        self.remaining = 5000
+        # Responses turned away by the rate limit before serving again
+        self.limited = 0
+        self.requests: list = []
+
+    def commit(self, i: int) -> dict:
+        signature = {
+            "name": "Cade",
+            "email": "cade@example.com",
+            "date": f"2023-08-{i:02}T00:00:00Z",
+        }
+        return {
+            "sha": f"sha{i}",
+            "commit": {
+                "message": f"Commit {i}",
+                "author": signature,
+                "committer": signature,
+            },
+            "author": self.user,
+            "committer": None,
+        }
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        assert request.headers["Authorization"] == "Bearer token"
+        headers = {"X-RateLimit-Reset": str(int(time.time()) + 60)}
+        if self.limited:
+            self.limited -= 1
+            headers["X-RateLimit-Remaining"] = "0"
+            return httpx.Response(403, headers=headers)
+
+        path = request.url.path
+        if path == "/user/repos":
+            body: list | dict = [self.repo]
+        elif path == "/repos/cadeef/leno":
+            body = self.repo
+        elif path == "/repos/cadeef/leno/commits":
+            since = request.url.params.get("since", "")
+            body = [c for c in self.commits if c["commit"]["committer"]["date"] > since]
+        elif path == "/repos/cadeef/leno/releases":
+            body = self.releases
+        else:
+            return httpx.Response(404)
+
+        if isinstance(body, list):
+            page = int(request.url.params.get("page", 1))
+            if len(body) > page * self.per_page:
+                next_url = request.url.copy_merge_params({"page": page + 1})
+                headers["Link"] = f'<{next_url}>; rel="next"'
+            body = body[(page - 1) * self.per_page : page * self.per_page]
+
+        content = json.dumps(body).encode()
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            # Free
+            headers["X-RateLimit-Remaining"] = str(self.remaining)
+            return httpx.Response(304, headers=headers)
+
+        self.remaining -= 1
+        headers.update(ETag=etag, **{"X-RateLimit-Remaining": str(self.remaining)})
+        return httpx.Response(200, headers=headers, content=content)
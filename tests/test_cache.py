@@ -0,0 +1,65 @@
+import httpx
+
+from leno.cache import ResponseCache
+from leno.lib import Leno
+
+from . import fixtures
+
+
+def test_cache__set_get(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.db")
+    assert cache.get("missing") is None
+
+    cache.set("key", b"[]", etag='"abc"')
+    entry = cache.get("key")
+    assert entry is not None
+    assert entry.body == b"[]"
+    assert cache.is_fresh(entry)
+    assert entry.conditional_headers() == {"if-none-match": '"abc"'}
+
+
+def test_cache__lru_eviction(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.db", max_size=20)
+    cache.set("old", b"x" * 10)
+    cache.set("new", b"x" * 10)
+    # Touch old so it becomes the most recently used
+    cache.get("old")
+    cache.set("newest", b"x" * 10)
+
+    assert cache.get("new") is None
+    assert cache.get("old") is not None
+    assert cache.get("newest") is not None
+
+
+def test_cache__leno_fresh_and_revalidate(tmp_path):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(
+            200, json=fixtures.MASTODON_ROWS, headers={"etag": '"v1"'}
+        )
+
+    cache = ResponseCache(tmp_path / "cache.db")
+    leno = Leno(
+        "http://127.0.0.1:8001",
+        "token",
+        transport=httpx.MockTransport(handler),
+        cache=cache,
+    )
+    url = "/mastodon/bookmarks.json?_size=2&_sort_desc=created_at"
+
+    assert leno.fetch_json(url) == fixtures.MASTODON_ROWS
+    # Fresh, argument order doesn't matter
+    assert leno.fetch_json_many([url.replace("_size=2&", "") + "&_size=2"]) == [
+        fixtures.MASTODON_ROWS
+    ]
+    assert len(requests) == 1
+
+    # Stale, revalidated with the stored etag
+    cache.ttl = 0
+    assert leno.fetch_json(url) == fixtures.MASTODON_ROWS
+    assert len(requests) == 2
+    assert requests[-1].headers["if-none-match"] == '"v1"'
@@ -1,13 +1,37 @@
+import functools
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import httpx
+
 # import pytest
 # from devtools import debug
 from typer.testing import CliRunner
 
 from leno.cli import app
+from leno.lib import Leno
+from leno.stats import summarize
 
 from . import fixtures
 
 cli = CliRunner()
 
+# Microseconds importing leno.cli may take, cumulative as reported by -X importtime.
+# Generous so slow CI runners pass; LENO_IMPORT_BUDGET=0 skips the timing check.
+IMPORT_BUDGET = int(os.environ.get("LENO_IMPORT_BUDGET", 1_000_000))
+# Only imported by the commands that need them
+LAZY_MODULES = {
+    "asyncio",
+    "httpx",
+    "sqlite_utils",
+    "bs4",
+    "devtools",
+    "rich.progress",
+}
+
 
 def test_no_command():
     """
@@ -26,10 +50,92 @@ def test_update__source(tmp_path, mocker):
     database = config_dir / "data" / "firefox.db"
     # Modify app config dir
     mocker.patch("typer.get_app_dir", return_value=config_dir)
+    mocker.patch("pathlib.Path.home", return_value=tmp_path)
+    fixtures.firefox_profile(tmp_path)
     result = cli.invoke(app, ["update", "--source", "firefox"])
     assert database.exists()
     assert result.exit_code == 0
 
+    result = cli.invoke(app, ["stats"])
+    assert result.exit_code == 0
+    assert "firefox" in result.stdout
+
+
+def test_update__refresh_failure(tmp_path, mocker):
+    mocker.patch("typer.get_app_dir", return_value=tmp_path)
+    mocker.patch("pathlib.Path.home", return_value=tmp_path)
+    mocker.patch("leno.cli.refresh", side_effect=sqlite3.OperationalError("locked"))
+    fixtures.firefox_profile(tmp_path)
+
+    result = cli.invoke(app, ["update", "--source", "firefox"])
+
+    assert result.exit_code == 1
+    assert "Source (firefox) failed: OperationalError: locked" in result.stdout
+    (stats,) = summarize(tmp_path)
+    assert stats.failures == 1
+
+
+def test_stats__no_runs(tmp_path, mocker):
+    mocker.patch("typer.get_app_dir", return_value=tmp_path)
+    result = cli.invoke(app, ["stats"])
+    assert result.exit_code == 1
+    assert "No updates recorded" in result.stdout
+
+
+def test_optimize(tmp_path, mocker):
+    mocker.patch("typer.get_app_dir", return_value=tmp_path)
+    fixtures.local_databases(tmp_path / "data")
+
+    result = cli.invoke(app, ["optimize", "--source", "mastodon"])
+
+    assert result.exit_code == 0
+    assert "mastodon: 2 indexes created" in result.stdout
+    assert "github" not in result.stdout
+
+
+def test_publish(tmp_path):
+    fixtures.local_databases(tmp_path)
+
+    result = cli.invoke(app, ["publish", "--data-dir", str(tmp_path)])
+    assert result.exit_code == 0
+    assert "Published github" in result.stdout
+
+    result = cli.invoke(app, ["publish", "--data-dir", str(tmp_path)])
+    assert "Nothing changed" in result.stdout
+
+
+def test_daemon__status(tmp_path, mocker):
+    mocker.patch("typer.get_app_dir", return_value=tmp_path)
+    result = cli.invoke(app, ["daemon", "--status"])
+    assert result.exit_code == 1
+    assert "never ran" in result.stdout
+
+    (tmp_path / "daemon.json").write_text(
+        json.dumps(
+            {
+                "pid": 42,
+                "started_at": 1690000000,
+                "updated_at": 1690000060,
+                "stopped": False,
+                "sources": {
+                    "github": {
+                        "running": False,
+                        "next_run": 0,
+                        "last_duration": 2.5,
+                        "failures": 2,
+                        "last_error": "HTTPError: 502",
+                    }
+                },
+            }
+        )
+    )
+    result = cli.invoke(app, ["daemon", "--status"])
+    assert result.exit_code == 0
+    assert "running (pid 42)" in result.stdout
+    assert "github: next in 0m, last took 2.5s, 2 failures: HTTPError: 502" in (
+        result.stdout
+    )
+
 
 def test_update__list_sources():
     result = cli.invoke(app, ["update", "--list-sources"])
@@ -38,11 +144,91 @@ def test_update__list_sources():
         assert src in result.stdout
 
 
-def test_firehose():
-    pass
+def test_firehose(tmp_path, mocker):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/github"):
+            return httpx.Response(200, json={"rows": fixtures.GITHUB_RELEASE_ROWS})
+        return httpx.Response(200, json={"rows": fixtures.MASTODON_ROWS[::-1]})
 
+    mocker.patch("typer.get_app_dir", return_value=tmp_path)
+    mocker.patch(
+        "leno.lib.Leno",
+        functools.partial(Leno, transport=httpx.MockTransport(handler)),
+    )
+    result = cli.invoke(app, ["firehose", "--limit", "2", "--token", "token"])
 
-def test_firehose__no_token():
-    result = cli.invoke(app, ["firehose"])
-    assert "Missing option '--token'" in result.stdout
+    assert result.exit_code == 0
+    lines = result.stdout.splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("[bookmark] 🐘 leno: Second post")
+    assert lines[1].startswith("[favorite] 🐘 leno: Second post")
+
+
+def test_firehose__json(tmp_path, mocker):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/github"):
+            return httpx.Response(200, json={"rows": fixtures.GITHUB_RELEASE_ROWS})
+        return httpx.Response(200, json={"rows": fixtures.MASTODON_ROWS[::-1]})
+
+    mocker.patch("typer.get_app_dir", return_value=tmp_path)
+    mocker.patch(
+        "leno.lib.Leno",
+        functools.partial(Leno, transport=httpx.MockTransport(handler)),
+    )
+    result = cli.invoke(
+        app, ["firehose", "--output", "json", "--limit", "3", "--token", "token"]
+    )
+
+    assert result.exit_code == 0
+    items = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [i["label"] for i in items] == ["bookmark", "favorite", "release"]
+    assert items[0]["title"] == ":elephant: leno"
+    assert items[0]["description"].startswith("Second post")
+    assert items[0]["timestamp"] >= items[2]["timestamp"]
+    assert items[0]["time"].endswith("+00:00")
+
+
+def test_firehose__negative_limit():
+    result = cli.invoke(app, ["firehose", "--limit", "-1", "--token", "token"])
     assert result.exit_code == 2
+
+
+def test_firehose__no_token(mocker):
+    # Only --local works without a token
+    mocker.patch.dict("os.environ", {"LENO_TOKEN": ""})
+    result = cli.invoke(app, ["firehose"])
+    assert "Leno API token required" in result.stdout
+    assert result.exit_code == 1
+
+
+def test_startup__import_time():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "leno", "--version"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    # import time: self [us] | cumulative | imported package
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, total, name = line.split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total)
+
+    assert not LAZY_MODULES & cumulative.keys()
+    if IMPORT_BUDGET:
+        assert cumulative["leno.cli"] < IMPORT_BUDGET
+
+
+def test_main__commands():
+    result = subprocess.run(
+        [sys.executable, "-m", "leno.cli", "--help"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    for command in ("update", "daemon", "search", "stats", "optimize", "publish"):
+        assert command in result.stdout
@@ -0,0 +1,145 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from leno.daemon import BACKOFF, MAX_BACKOFF, Daemon, Schedule, read_status
+from leno.source import Source, SourceException
+from leno.stats import summarize
+
+
+class CountingSource(Source):
+    """Adds a row per update, fails while failing is set"""
+
+    name = "counting"
+    interval = 0.05
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.updates = 0
+        self.failing = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def update(self) -> bool:
+        self.release.wait(timeout=2)
+        self.updates += 1
+        if self.failing:
+            raise SourceException("nope")
+        conn = sqlite3.connect(self.database)
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS counts (n INTEGER)")
+            conn.execute("INSERT INTO counts VALUES (?)", (self.updates,))
+        conn.close()
+        return True
+
+
+@pytest.fixture
+def no_jitter(mocker):
+    mocker.patch("leno.daemon.random.uniform", return_value=0.0)
+
+
+def test_schedule__delay(no_jitter):
+    schedule = Schedule("counting", interval=900)
+    assert schedule.delay() == 900
+
+    schedule.failures = 1
+    assert schedule.delay() == BACKOFF
+    schedule.failures = 3
+    assert schedule.delay() == BACKOFF * 4
+    schedule.failures = 30
+    assert schedule.delay() == MAX_BACKOFF
+
+
+def test_daemon__run_once(tmp_path, no_jitter):
+    src = CountingSource(tmp_path / "data", tmp_path / "venv")
+    src.data_dir.mkdir()
+    daemon = Daemon([src], tmp_path)
+
+    run = asyncio.run(daemon.run_once(src))
+
+    assert run is not None and run.ok
+    assert run.rows_added == {"counts": 1}
+    schedule = daemon.schedules["counting"]
+    assert schedule.failures == 0
+    assert schedule.next_run == pytest.approx(run.ended_at + src.interval)
+    assert summarize(tmp_path)[0].runs == 1
+
+    status = read_status(tmp_path)
+    assert status is not None
+    assert status["sources"]["counting"]["last_error"] is None
+    assert not status["sources"]["counting"]["running"]
+
+    # Failures back off instead of waiting for the interval
+    src.failing = True
+    run = asyncio.run(daemon.run_once(src))
+    assert run is not None and not run.ok
+    assert schedule.failures == 1
+    assert schedule.last_error == "SourceException: nope"
+    assert schedule.next_run == pytest.approx(run.ended_at + BACKOFF)
+
+
+def test_daemon__single_flight(tmp_path, no_jitter):
+    src = CountingSource(tmp_path / "data", tmp_path / "venv")
+    src.data_dir.mkdir()
+    src.release.clear()
+    daemon = Daemon([src], tmp_path, jobs=2)
+
+    async def overlapping():
+        first = asyncio.create_task(daemon.run_once(src))
+        await asyncio.sleep(0.05)
+        second = await daemon.run_once(src)
+        src.release.set()
+        return await first, second
+
+    first, second = asyncio.run(overlapping())
+
+    assert first is not None
+    assert second is None
+    assert src.updates == 1
+
+
+def test_daemon__run(tmp_path, no_jitter):
+    src = CountingSource(tmp_path / "data", tmp_path / "venv")
+    src.data_dir.mkdir()
+    daemon = Daemon([src], tmp_path)
+
+    async def briefly():
+        try:
+            await asyncio.wait_for(daemon.run(), timeout=0.5)
+        except TimeoutError:
+            pass
+
+    asyncio.run(briefly())
+
+    assert src.updates >= 2
+    status = read_status(tmp_path)
+    assert status is not None and status["stopped"]
+
+
+def test_daemon__serial_refresh(tmp_path, mocker, no_jitter):
+    running = []
+    overlapped = []
+
+    def slow_refresh(src, optimize=False):
+        overlapped.append(bool(running))
+        running.append(src.name)
+        time.sleep(0.05)
+        running.remove(src.name)
+        return {}
+
+    mocker.patch("leno.daemon.refresh", side_effect=slow_refresh)
+    first = CountingSource(tmp_path / "data", tmp_path / "venv")
+    second = CountingSource(tmp_path / "data", tmp_path / "venv")
+    second.name = "other"
+    first.data_dir.mkdir()
+    daemon = Daemon([first, second], tmp_path, jobs=2)
+
+    async def both():
+        await asyncio.gather(daemon.run_once(first), daemon.run_once(second))
+
+    asyncio.run(both())
+
+    assert overlapped == [False, False]
@@ -1,7 +1,20 @@
+import asyncio
+
+import httpx
 import pytest
 from devtools import debug  # noqa: F401
 
-from leno.lib import Leno, LenoException, Query
+from leno.lib import (
+    PAGE_SIZE,
+    Item,
+    Leno,
+    LenoException,
+    LocalLeno,
+    Query,
+    parse_timestamp,
+)
+
+from . import fixtures
 
 leno = Leno("http://127.0.0.1:8001", "a-very-nice-token-for-testing")
 
@@ -80,3 +93,184 @@ def test_query_functions():
         query.url()
         == "http://127.0.0.1:8001/mastodon/bookmarks.json?_shape=array&_sort_desc=bill&_size=10"
     )
+
+
+def test_leno__firehose_concurrent():
+    """
+    Every source endpoint must be in flight at the same time
+    """
+    barrier = asyncio.Barrier(3)
+    rows = {
+        "/mastodon/bookmarks.json": fixtures.MASTODON_ROWS[:1],
+        "/mastodon/favorites.json": fixtures.MASTODON_ROWS[1:],
+        "/github/releases.json": fixtures.GITHUB_RELEASE_ROWS,
+    }
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        # Deadlocks (and times out) unless all requests are issued together
+        await asyncio.wait_for(barrier.wait(), timeout=2)
+        assert request.headers["authorization"] == f"Bearer {leno.token}"
+        return httpx.Response(200, json={"rows": rows[request.url.path]})
+
+    hose = Leno(leno.url, leno.token, transport=httpx.MockTransport(handler))
+    items = list(hose.firehose())
+
+    assert [i.label for i in items] == ["favorite", "release", "bookmark"]
+
+
+def test_leno__firehose_limit_pushdown():
+    """
+    Sort and limit are pushed down to datasette and the merge stops at limit
+    """
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url)
+        if request.url.path.startswith("/github"):
+            return httpx.Response(200, json={"rows": fixtures.GITHUB_RELEASE_ROWS})
+        return httpx.Response(200, json={"rows": fixtures.MASTODON_ROWS[::-1]})
+
+    hose = Leno(leno.url, leno.token, transport=httpx.MockTransport(handler))
+    items = list(hose.firehose(limit=2))
+
+    assert len(items) == 2
+    assert [i.timestamp for i in items] == sorted(
+        (i.timestamp for i in items), reverse=True
+    )
+    for url in requested:
+        assert url.params["_size"] == "2"
+        assert url.params["_sort_desc"] in ("created_at", "published_at")
+
+
+def test_leno__firehose_large_limit():
+    """
+    Limits beyond datasette's max_returned_rows paginate instead of failing
+    """
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url)
+        return httpx.Response(200, json={"rows": []})
+
+    hose = Leno(leno.url, leno.token, transport=httpx.MockTransport(handler))
+    list(hose.firehose(limit=2500))
+    list(hose.firehose(limit=2500, timeline=True))
+
+    assert {url.params["_size"] for url in requested} == {str(PAGE_SIZE)}
+
+
+def test_leno__firehose_draft_releases():
+    """
+    Drafts have no published_at, datasette sorts them last
+    """
+    draft = {**fixtures.GITHUB_RELEASE_ROWS[0], "published_at": None}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/github"):
+            assert request.url.params["published_at__notblank"] == "1"
+            return httpx.Response(
+                200, json={"rows": fixtures.GITHUB_RELEASE_ROWS + [draft]}
+            )
+        return httpx.Response(200, json={"rows": []})
+
+    hose = Leno(leno.url, leno.token, transport=httpx.MockTransport(handler))
+    items = list(hose.firehose(limit=10))
+
+    assert [i.label for i in items] == ["release"] * len(fixtures.GITHUB_RELEASE_ROWS)
+
+
+def paged_handler(total: int, size: int, requested: list):
+    """
+    Fake datasette table of total rows served size at a time
+    """
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url)
+        assert request.url.params["_shape"] == "objects"
+        start = int(request.url.params.get("_next", 0))
+        end = min(start + size, total)
+        page = {"rows": [{"id": i} for i in range(start, end)], "next": None}
+        if end < total:
+            page["next"] = str(end)
+        return httpx.Response(200, json=page)
+
+    return handler
+
+
+def test_leno__paginate():
+    requested: list = []
+    transport = httpx.MockTransport(paged_handler(7, 2, requested))
+    pager = Leno(leno.url, leno.token, transport=transport)
+
+    rows = list(pager.paginate("/mastodon/statuses.json"))
+
+    assert [r["id"] for r in rows] == list(range(7))
+    assert len(requested) == 4
+
+
+@pytest.mark.parametrize(
+    "budget,expected_rows,expected_requests",
+    (
+        ({"max_rows": 3}, 3, 2),
+        ({"max_rows": 4}, 4, 2),
+        ({"max_bytes": 1}, 2, 1),
+    ),
+)
+def test_leno__paginate_budget(budget, expected_rows, expected_requests):
+    requested: list = []
+    transport = httpx.MockTransport(paged_handler(100, 2, requested))
+    pager = Leno(leno.url, leno.token, transport=transport)
+
+    rows = list(pager.paginate("/mastodon/statuses.json", **budget))
+
+    assert len(rows) == expected_rows
+    assert len(requested) == expected_requests
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    (
+        ("2023-08-01T12:00:00Z", 1690891200),
+        ("2023-08-01T12:00:00.000Z", 1690891200),
+        ("2023-08-01T14:00:00+02:00", 1690891200),
+        ("2023-08-01T12:00:00", 1690891200),
+        (1690891200, 1690891200),
+    ),
+)
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+def test_item__compact():
+    rows = [
+        dict(r, created_at="2023-08-01T13:00:00+05:00") for r in fixtures.MASTODON_ROWS
+    ]
+    item, _ = Item.from_mastodon(rows, "bookmark")
+
+    assert not hasattr(item, "__dict__")
+    assert item.timestamp == 1690876800
+    assert item.when.isoformat() == "2023-08-01T08:00:00+00:00"
+    assert str(item).startswith("[bookmark] :elephant: cadeef: Hello world")
+
+
+def test_local_leno__firehose(tmp_path):
+    fixtures.local_databases(tmp_path)
+    rows = {
+        "/mastodon/bookmarks.json": fixtures.MASTODON_ROWS[:1],
+        "/mastodon/favorites.json": fixtures.MASTODON_ROWS[1:],
+        "/github/releases.json": fixtures.GITHUB_RELEASE_ROWS,
+    }
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, json={"rows": rows[request.url.path]})
+    )
+
+    items = list(LocalLeno(tmp_path).firehose())
+
+    assert [i.label for i in items] == ["favorite", "release", "bookmark"]
+    # Same items as through datasette
+    assert items == list(Leno(leno.url, leno.token, transport=transport).firehose())
+    assert len(list(LocalLeno(tmp_path).firehose(limit=2))) == 2
+
+
+def test_local_leno__firehose_missing(tmp_path):
+    assert list(LocalLeno(tmp_path).firehose()) == []
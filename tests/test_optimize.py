@@ -0,0 +1,84 @@
+import sqlite3
+
+from leno.optimize import create_indexes, fragmentation, optimize
+
+
+def statuses_db(path, rows=2000):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executescript(
+            """
+            CREATE TABLE statuses (
+                id INTEGER PRIMARY KEY, created_at TEXT, content TEXT
+            );
+            CREATE INDEX statuses_content ON statuses (content);
+            """
+        )
+        conn.executemany(
+            "INSERT INTO statuses (created_at, content) VALUES (?, ?)",
+            (
+                (f"2023-08-01T00:{i % 60:02}:{i % 59:02}", "x" * 500)
+                for i in range(rows)
+            ),
+        )
+    conn.close()
+    return path
+
+
+def query_plan(database, sql):
+    conn = sqlite3.connect(database)
+    try:
+        return " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+    finally:
+        conn.close()
+
+
+def test_optimize(tmp_path):
+    database = statuses_db(tmp_path / "mastodon.db")
+    newest = "SELECT * FROM statuses ORDER BY created_at DESC LIMIT 20"
+    assert "TEMP B-TREE" in query_plan(database, newest)
+
+    result = optimize(database, {"statuses": [("created_at",)]})
+
+    assert result.indexes == ["leno_statuses_created_at"]
+    assert not result.vacuumed
+    assert "TEMP B-TREE" not in query_plan(database, newest)
+    assert "leno_statuses_created_at" in query_plan(database, newest)
+
+    conn = sqlite3.connect(database)
+    # Planner statistics were gathered
+    assert conn.execute("SELECT count(*) FROM sqlite_stat1").fetchone()[0] > 0
+    conn.close()
+
+    # Nothing left to do
+    assert optimize(database, {"statuses": [("created_at",)]}).indexes == []
+
+
+def test_create_indexes__skipped(tmp_path):
+    conn = sqlite3.connect(statuses_db(tmp_path / "mastodon.db", rows=1))
+    created = create_indexes(
+        conn,
+        {
+            # Already indexed, missing column, missing table
+            "statuses": [("content",), ("edited_at",)],
+            "bookmarks": [("created_at",)],
+        },
+    )
+    assert created == []
+
+
+def test_optimize__vacuum(tmp_path):
+    database = statuses_db(tmp_path / "mastodon.db")
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute("DELETE FROM statuses WHERE id > 500")
+    assert fragmentation(conn) > 0.1
+    conn.close()
+
+    result = optimize(database)
+
+    assert result.vacuumed
+    assert result.size_after < result.size_before
+    conn = sqlite3.connect(database)
+    assert fragmentation(conn) == 0
+    conn.close()
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from leno.publish import INSPECT_FILE, PUBLIC, publish
+
+from . import fixtures
+
+
+def test_publish(tmp_path):
+    fixtures.local_databases(tmp_path)
+    public = tmp_path / PUBLIC
+
+    assert publish(tmp_path) == ["github", "mastodon"]
+
+    inspected = json.loads((public / INSPECT_FILE).read_text())
+    assert sorted(inspected) == ["github", "mastodon"]
+    github = inspected["github"]
+    content = (public / "github.db").read_bytes()
+    assert github["hash"] == hashlib.sha256(content).hexdigest()
+    assert github["size"] == len(content)
+    assert github["tables"]["releases"] == {"count": len(fixtures.GITHUB_RELEASE_ROWS)}
+    assert not list(public.glob("*.tmp"))
+
+    # Only changed databases are published again
+    assert publish(tmp_path) == []
+    conn = sqlite3.connect(tmp_path / "mastodon.db")
+    with conn:
+        conn.execute("DELETE FROM bookmarks")
+    conn.close()
+    later = (public / "mastodon.db").stat().st_mtime_ns + 1_000_000
+    os.utime(tmp_path / "mastodon.db", ns=(later, later))
+
+    assert publish(tmp_path) == ["mastodon"]
+    inspected = json.loads((public / INSPECT_FILE).read_text())
+    assert inspected["mastodon"]["tables"]["bookmarks"] == {"count": 0}
+    assert inspected["github"] == github
+
+
+def test_publish__names(tmp_path):
+    fixtures.local_databases(tmp_path)
+    assert publish(tmp_path, ["github"]) == ["github"]
+    assert not (tmp_path / PUBLIC / "mastodon.db").exists()
@@ -0,0 +1,74 @@
+import subprocess
+import sys
+
+import pytest
+
+from leno.runner import TAIL_LINES, parse_progress, run_streaming
+
+
+def python(script: str) -> list[str]:
+    # Unbuffered, so stdout and stderr interleave in order
+    return [sys.executable, "-u", "-c", script]
+
+
+def test_run_streaming(tmp_path):
+    log = tmp_path / "logs" / "chatty.log"
+    lines = []
+    result = run_streaming(
+        python(
+            "import sys; [print(f'line {i}') for i in range(1000)]; "
+            "print('oops', file=sys.stderr)"
+        ),
+        log=log,
+        on_line=lines.append,
+    )
+
+    assert result.returncode == 0
+    assert result.duration > 0
+    assert len(lines) == 1001
+    # Only the end of the output is kept in memory
+    assert len(result.tail) == TAIL_LINES
+    assert result.tail[-1] == "oops"
+
+    written = log.read_text().splitlines()
+    assert written[0].startswith("$ ")
+    assert written[1:-1] == lines
+    assert written[-1].startswith("exit 0 after")
+
+
+def test_run_streaming__carriage_returns():
+    lines = []
+    run_streaming(
+        python("print('10%\\r50%\\r100%')"),
+        on_line=lines.append,
+    )
+    assert lines == ["10%", "50%", "100%"]
+
+
+def test_run_streaming__failure():
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_streaming(python("print('broken'); raise SystemExit(3)"))
+    assert error.value.returncode == 3
+    assert error.value.output == "broken"
+
+    result = run_streaming(python("raise SystemExit(3)"), check=False)
+    assert result.returncode == 3
+
+
+def test_run_streaming__timeout():
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_streaming(python("import time; time.sleep(5)"), timeout=0.5)
+
+
+@pytest.mark.parametrize(
+    "line,expected",
+    [
+        ("[####      ]  42%", 0.42),
+        ("Fetching commits 120/300", 0.4),
+        ("12.5 %", 0.125),
+        ("0/0", None),
+        ("Fetching repos", None),
+    ],
+)
+def test_parse_progress(line, expected):
+    assert parse_progress(line) == expected
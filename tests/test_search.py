@@ -0,0 +1,76 @@
+import sqlite3
+
+from typer.testing import CliRunner
+
+from leno.cli import app
+from leno.search import MATCH_END, MATCH_START, search, update_search
+
+from . import fixtures
+
+
+def test_search(tmp_path):
+    fixtures.local_databases(tmp_path)
+    assert list(search(tmp_path, "anything")) == []
+
+    assert update_search(tmp_path, "mastodon") == 2
+    assert update_search(tmp_path, "github") == 1
+    assert update_search(tmp_path, "mastodon") == 0
+
+    (item,) = search(tmp_path, "second")
+    assert item.label == "favorite"
+    assert item.description == f"{MATCH_START}Second{MATCH_END} post"
+
+    # Title matches rank first
+    assert [i.label for i in search(tmp_path, "leno")] == ["favorite", "release"]
+    assert [i.label for i in search(tmp_path, "leno", sources=["github"])] == [
+        "release"
+    ]
+    assert [i.label for i in search(tmp_path, "leno", since=1691020800)] == ["favorite"]
+    assert [i.label for i in search(tmp_path, "leno", until=1691020800)] == ["release"]
+
+
+def test_search__incremental(tmp_path):
+    fixtures.local_databases(tmp_path)
+    update_search(tmp_path, "mastodon")
+
+    mastodon = sqlite3.connect(tmp_path / "mastodon.db")
+    with mastodon:
+        mastodon.execute("UPDATE favorites SET content = '<p>Edited post</p>'")
+    mastodon.close()
+
+    assert update_search(tmp_path, "mastodon") == 1
+    assert list(search(tmp_path, "second")) == []
+    assert len(list(search(tmp_path, "edited"))) == 1
+
+
+def test_search__cli(tmp_path):
+    fixtures.local_databases(tmp_path)
+    update_search(tmp_path, "github")
+    cli = CliRunner()
+
+    result = cli.invoke(app, ["search", "release", "--data-dir", str(tmp_path)])
+    assert result.exit_code == 0
+    assert "[release] cadeef/leno v0.1.0: First release (2023-08-02)" in result.stdout
+
+    result = cli.invoke(app, ["search", '"unbalanced', "--data-dir", str(tmp_path)])
+    assert result.exit_code == 1
+
+
+def test_search__late_rows(tmp_path):
+    """
+    Statuses bookmarked after newer ones were indexed still get indexed
+    """
+    fixtures.local_databases(tmp_path)
+    update_search(tmp_path, "mastodon")
+
+    mastodon = sqlite3.connect(tmp_path / "mastodon.db")
+    with mastodon:
+        mastodon.execute(
+            "INSERT INTO bookmarks VALUES "
+            "('4', 'old', '<p>Ancient post</p>', '2020-01-01T12:00:00.000Z', 'x')"
+        )
+    mastodon.close()
+
+    assert update_search(tmp_path, "mastodon") == 1
+    (item,) = search(tmp_path, "ancient")
+    assert item.label == "bookmark"
@@ -1,6 +1,22 @@
+import json
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from importlib.metadata import EntryPoint
+
+import httpx
 import pytest
+from sqlite_utils import Database
 
 import leno.source as source
+from leno.sources.feeds import FeedsSource
+from leno.sources.firefox import FirefoxSource
+from leno.sources.github import ETAGS_TABLE, GithubSource
+from leno.sources.healthkit import HealthkitSource, import_export
+from leno.sources.mastodon import MastodonSource
+from leno.sources.pocket import PocketSource
 
 from . import fixtures
 
@@ -28,3 +44,555 @@ def test_get_source__invalid(tmp_path):
 def test_get_sources():
     sources = source.get_sources()
     assert len(sources) == len(fixtures.SOURCES)
+
+
+def test_get_sources__lazy():
+    """
+    Listing sources with their descriptions imports none of them
+    """
+    script = (
+        "import sys, leno.source as s; "
+        "print({n: e.description for n, e in s.get_sources().items()}); "
+        "print([m for m in sys.modules if m.startswith('leno.sources.')])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, check=True, text=True
+    )
+    descriptions, imported = result.stdout.splitlines()
+    assert "'firefox': 'Firefox \"places\" (history & bookmarks)'" in descriptions
+    assert imported == "[]"
+
+
+def test_get_sources__entry_point(mocker):
+    plugin = EntryPoint(
+        "sleepy", "tests.test_source:SleepySource", source.ENTRY_POINT_GROUP
+    )
+    mocker.patch("leno.source.entry_points", return_value=[plugin])
+    source._registry.cache_clear()
+    try:
+        sources = source.get_sources()
+    finally:
+        source._registry.cache_clear()
+
+    assert len(sources) == len(fixtures.SOURCES) + 1
+    assert sources["sleepy"].load() is SleepySource
+    # Not a literal in the class, falls back to importing it
+    assert sources["sleepy"].description == ""
+
+
+class SleepySource(source.Source):
+    """Source that blocks until every sibling is updating"""
+
+    name = "sleepy"
+
+    def __init__(self, name, barrier, *args):
+        super().__init__(*args)
+        self.name = name
+        self.barrier = barrier
+
+    def update(self) -> bool:
+        self.barrier.wait(timeout=2)
+        if self.name == "broken":
+            raise source.SourceException("nope")
+        return True
+
+
+def test_update_sources(tmp_path):
+    """
+    Sources update concurrently and a failure doesn't stop the others
+    """
+    barrier = threading.Barrier(3)
+    names = ["one", "broken", "three"]
+    sources = [SleepySource(n, barrier, tmp_path, tmp_path / "venv") for n in names]
+    done = []
+
+    results = source.update_sources(
+        sources, jobs=3, on_done=lambda src, error: done.append(src.name)
+    )
+
+    assert sorted(done) == sorted(names)
+    assert results["one"] is None and results["three"] is None
+    assert isinstance(results["broken"], source.SourceException)
+
+
+def test_run_command__timeout(tmp_path):
+    src = FeedsSource(tmp_path, tmp_path / "venv")
+    src.deadline = time.monotonic() + 0.1
+    with pytest.raises(source.SourceException, match="timed out"):
+        src.run_command([sys.executable, "-c", "import time; time.sleep(5)"])
+
+
+def test_run_command__output(tmp_path):
+    src = FeedsSource(tmp_path, tmp_path / "venv")
+    src.log_dir = tmp_path / "logs"
+    lines = []
+    src.on_output = lines.append
+
+    src.run_command([sys.executable, "-c", "print('fetched 3 feeds')"])
+
+    assert lines == ["fetched 3 feeds"]
+    assert "fetched 3 feeds" in (src.log_dir / "feeds.log").read_text()
+    assert src.commands["feeds"].returncode == 0
+
+
+def test_watermark(tmp_path):
+    src = GithubSource(tmp_path, tmp_path / "venv")
+    assert src.watermark("commits") is None
+
+    db = Database(src.database)
+    db["commits"].insert_all(
+        [
+            {"sha": "a", "committer_date": "2023-08-01"},
+            {"sha": "b", "committer_date": "2023-08-02"},
+        ]
+    )
+    # Missing tables are skipped
+    assert src.record_watermark("releases") is None
+    assert src.record_watermark("commits") == "2023-08-02"
+    assert src.watermark("commits") == "2023-08-02"
+    assert src.watermark("releases") is None
+
+    src.full = True
+    assert src.watermark("commits") is None
+
+
+def test_merge_databases(tmp_path):
+    database = tmp_path / "github.db"
+    Database(database)["releases"].insert({"id": 1, "tag_name": "v0.1.0"}, pk="id")
+
+    releases = Database(tmp_path / "releases.db")
+    releases["releases"].insert_all(
+        [{"id": 1, "tag_name": "v0.1.1", "body": "fixed"}, {"id": 2, "tag_name": "v1"}],
+        pk="id",
+    )
+    releases["releases"].enable_fts(["tag_name", "body"], create_triggers=True)
+    Database(tmp_path / "repos.db")["repos"].insert({"id": 7, "name": "leno"}, pk="id")
+
+    source.merge_databases(
+        database, [tmp_path / "releases.db", tmp_path / "repos.db", tmp_path / "nope"]
+    )
+
+    db = Database(database)
+    assert {r["id"]: r["tag_name"] for r in db["releases"].rows} == {
+        1: "v0.1.1",
+        2: "v1",
+    }
+    assert db["releases"].get(1)["body"] == "fixed"
+    assert db["repos"].count == 1
+    assert [r["id"] for r in db["releases"].search("fixed")] == [1]
+
+
+def test_update_data_points(tmp_path):
+    """
+    Every data point lands in database, staging is cleaned up
+    """
+    src = MastodonSource(tmp_path, tmp_path / "venv")
+    script = (
+        "import sqlite_utils, sys; "
+        "sqlite_utils.Database(sys.argv[2])[sys.argv[1]].insert({'id': 1})"
+    )
+
+    src.update_data_points(
+        ["bookmarks", "followers"],
+        lambda data_point, database: [
+            sys.executable,
+            "-c",
+            script,
+            data_point,
+            database,
+        ],
+    )
+
+    assert set(Database(src.database).table_names()) >= {"bookmarks", "followers"}
+    assert not (tmp_path / ".staging" / "mastodon").exists()
+
+
+def test_firefox__incremental(tmp_path, mocker):
+    mocker.patch("pathlib.Path.home", return_value=tmp_path)
+    places = fixtures.firefox_profile(tmp_path)
+    src = FirefoxSource(tmp_path / "data", tmp_path / "venv")
+    src.data_dir.mkdir()
+
+    # First run copies everything
+    src.update()
+    assert src.watermark("visits") == "100"
+
+    live = sqlite3.connect(places)
+    with live:
+        live.executescript(
+            """
+            INSERT INTO moz_origins VALUES (2, 'leno.cade.pro');
+            INSERT INTO moz_places VALUES (2, 'https://leno.cade.pro', 'Leno', 2, 200);
+            UPDATE moz_places SET title = 'Cade!', last_visit_date = 300 WHERE id = 1;
+            INSERT INTO moz_historyvisits VALUES (2, 2, 200), (3, 1, 300);
+            UPDATE moz_bookmarks SET title = 'Cade!', lastModified = 300;
+            """
+        )
+    live.close()
+
+    snapshot = mocker.patch.object(src, "snapshot")
+    src.update()
+    snapshot.assert_not_called()
+
+    db = Database(src.database)
+    assert db.journal_mode != "wal"
+    assert db["moz_origins"].count == 2
+    assert {r["id"]: r["title"] for r in db["moz_places"].rows} == {
+        1: "Cade!",
+        2: "Leno",
+    }
+    assert db["moz_historyvisits"].count == 3
+    assert db["moz_bookmarks"].get(1)["title"] == "Cade!"
+    assert src.watermark("visits") == "300"
+
+    # Cleared history and removed bookmarks go too
+    live = sqlite3.connect(places)
+    with live:
+        live.executescript(
+            """
+            DELETE FROM moz_historyvisits WHERE id = 1;
+            DELETE FROM moz_bookmarks;
+            """
+        )
+    live.close()
+
+    src.update()
+    assert [r["id"] for r in db["moz_historyvisits"].rows] == [2, 3]
+    assert db["moz_bookmarks"].count == 0
+    assert db["moz_places"].count == 2
+
+
+def test_firefox__deadline(tmp_path, mocker):
+    mocker.patch("pathlib.Path.home", return_value=tmp_path)
+    fixtures.firefox_profile(tmp_path)
+    src = FirefoxSource(tmp_path / "data", tmp_path / "venv")
+    src.data_dir.mkdir()
+
+    src.deadline = time.monotonic() - 1
+    with pytest.raises(source.SourceException, match="timed out"):
+        src.update()
+    assert not src.database.exists()
+
+    src.deadline = None
+    src.update()
+
+    # The sync is interrupted mid-statement and rolled back
+    mocker.patch("leno.sources.firefox.DEADLINE_CHECK_OPS", 1)
+    src.deadline = time.monotonic() - 1
+    with pytest.raises(source.SourceException, match="timed out"):
+        src.update()
+    assert Database(src.database)["moz_places"].count == 1
+
+
+def test_install_packages(tmp_path, mocker):
+    venv = tmp_path / "venv"
+
+    def fake_run(cmd, **kwargs):
+        if cmd[1:3] == ["-m", "venv"]:
+            venv.mkdir()
+
+    pip = mocker.patch("leno.source.run", side_effect=fake_run)
+    feeds = FeedsSource(tmp_path, venv)
+    pocket = PocketSource(tmp_path, venv)
+    assert not feeds.is_installed()
+
+    installed = source.install_packages(venv, feeds.packages + pocket.packages)
+
+    assert installed == {"feed-to-sqlite", "pocket-to-sqlite"}
+    # venv creation plus a single pip run
+    assert pip.call_count == 2
+    assert pip.call_args.args[0][-2:] == ["feed-to-sqlite", "pocket-to-sqlite"]
+    assert feeds.is_installed() and pocket.is_installed()
+    assert not MastodonSource(tmp_path, venv).is_installed()
+
+    # Nothing left to do
+    assert source.install_packages(venv, feeds.packages) == set()
+    assert pip.call_count == 2
+
+
+def test_healthkit__import(tmp_path):
+    export = fixtures.healthkit_export(
+        tmp_path / "export.zip",
+        [fixtures.healthkit_record(i) for i in range(3)]
+        + [fixtures.healthkit_record(0, kind="HeartRate")],
+    )
+    database = tmp_path / "healthkit.db"
+    progress = []
+
+    inserted = import_export(export, database, progress=progress.append)
+
+    assert inserted == {
+        "rStepCount": 3,
+        "rHeartRate": 1,
+        "workouts": 1,
+        "workout_points": 2,
+        "activity_summary": 1,
+    }
+    assert progress == [4]
+    db = Database(database)
+    assert db["rStepCount"].count == 3
+    row = next(db["rStepCount"].rows)
+    assert row["value"] == "0"
+    assert row["metadata_HKWasUserEntered"] == "0"
+    workout = next(db["workouts"].rows)
+    assert workout["metadata_HKIndoorWorkout"] == "0"
+    assert json.loads(workout["workout_events"])[0]["type"].endswith("Pause")
+    assert {p["workout_id"] for p in db["workout_points"].rows} == {workout["id"]}
+
+    # The next export repeats everything, only the new record goes in
+    export = fixtures.healthkit_export(
+        tmp_path / "export.zip", [fixtures.healthkit_record(i) for i in range(4)]
+    )
+    assert import_export(export, database) == {
+        "rStepCount": 1,
+        "workouts": 0,
+        "workout_points": 0,
+        "activity_summary": 0,
+    }
+    assert db["rStepCount"].count == 4
+
+
+def test_healthkit__import_existing(tmp_path):
+    """
+    Tables written by healthkit-to-sqlite get hashed, deduplicated and indexed
+    """
+    database = tmp_path / "healthkit.db"
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute(
+            "CREATE TABLE rStepCount (sourceName TEXT, unit TEXT, value TEXT, "
+            "startDate TEXT, metadata_HKWasUserEntered TEXT)"
+        )
+        # Imported twice already
+        conn.executemany(
+            "INSERT INTO rStepCount VALUES ('Watch', 'count', '1', "
+            "'2023-08-02 08:00:00 -0700', '0')",
+            [(), ()],
+        )
+    conn.close()
+    export = fixtures.healthkit_export(
+        tmp_path / "export.zip", [fixtures.healthkit_record(i) for i in range(3)]
+    )
+
+    for _ in range(3):
+        import_export(export, database)
+
+    db = Database(database)
+    assert db["rStepCount"].count == 3
+    assert sorted(r["value"] for r in db["rStepCount"].rows) == ["0", "1", "2"]
+
+
+def test_healthkit__deadline(tmp_path, mocker):
+    mocker.patch("leno.sources.healthkit.BATCH_SIZE", 1)
+    export = fixtures.healthkit_export(
+        tmp_path / "export.zip", [fixtures.healthkit_record(i) for i in range(3)]
+    )
+    database = tmp_path / "healthkit.db"
+
+    with pytest.raises(source.SourceException, match="timed out"):
+        import_export(export, database, deadline=time.monotonic() - 1)
+
+    # Rolled back
+    assert Database(database).table_names() == []
+
+
+def test_healthkit__import_over_healthkit_to_sqlite(tmp_path):
+    """
+    Workouts written by healthkit-to-sqlite are recognized, ids included
+    """
+    export = fixtures.healthkit_export(tmp_path / "export.zip", [])
+    database = tmp_path / "healthkit.db"
+    # What healthkit-to-sqlite's convert_xml_to_sqlite writes for the workout
+    db = Database(database)
+    workout = {
+        "workoutActivityType": "HKWorkoutActivityTypeWalking",
+        "duration": "30",
+        "startDate": "2023-08-05 08:00:00 -0700",
+        "metadata_HKIndoorWorkout": "0",
+        "workout_events": [
+            {"type": "HKWorkoutEventTypePause", "date": "2023-08-05 08:10:00 -0700"}
+        ],
+    }
+    workout_id = db["workouts"].insert(workout, alter=True, hash_id="id").last_pk
+    db["workout_points"].insert_all(
+        [
+            {
+                "date": f"2023-08-05 08:0{i}:00 -0700",
+                "latitude": latitude,
+                "longitude": "-122.6",
+                "workout_id": workout_id,
+            }
+            for i, latitude in enumerate(["45.5", "45.6"])
+        ],
+        foreign_keys=[("workout_id", "workouts")],
+    )
+
+    inserted = import_export(export, database)
+
+    assert inserted["workouts"] == 0
+    assert inserted["workout_points"] == 0
+    assert db["workouts"].count == 1
+    assert db["workout_points"].count == 2
+
+    # A fresh import gets the same id
+    fresh = tmp_path / "fresh.db"
+    import_export(export, fresh)
+    assert next(Database(fresh)["workouts"].rows)["id"] == workout_id
+
+
+def test_healthkit__update(tmp_path, mocker):
+    export = fixtures.healthkit_export(
+        tmp_path / "export.zip", [fixtures.healthkit_record(1)]
+    )
+    mocker.patch.dict("os.environ", {"LENO_HEALTHKIT_EXPORT": str(export)})
+    src = HealthkitSource(tmp_path, tmp_path / "venv")
+    lines = []
+    src.on_output = lines.append
+
+    assert src.is_installed()
+    src.update()
+
+    assert Database(src.database)["rStepCount"].count == 1
+    assert lines == ["1 records read"]
+
+
+def test_healthkit__missing_export(tmp_path, mocker):
+    mocker.patch.dict("os.environ", {"LENO_HEALTHKIT_EXPORT": str(tmp_path / "no")})
+    with pytest.raises(source.SourceException, match="missing"):
+        HealthkitSource(tmp_path, tmp_path / "venv").update()
+
+
+@pytest.fixture
+def github(tmp_path, mocker):
+    mocker.patch.dict(
+        "os.environ", {"LENO_GITHUB_TOKEN": "token", "LENO_GITHUB_REPOS": "cadeef/leno"}
+    )
+    api = fixtures.GithubAPI()
+    src = GithubSource(tmp_path, tmp_path / "venv")
+    src.client = httpx.Client(transport=httpx.MockTransport(api))
+    return src, api
+
+
+def test_github__update(github):
+    src, api = github
+    lines = []
+    src.on_output = lines.append
+
+    assert src.is_installed()
+    src.update()
+
+    db = Database(src.database)
+    assert [r["full_name"] for r in db["repos"].rows] == ["cadeef/leno"]
+    repo = db["repos"].get(10)
+    assert repo["owner"] == 1 and repo["license"] == "mit"
+    assert "url" not in repo
+    assert [c["sha"] for c in db["commits"].rows_where(order_by="sha")] == [
+        "sha1",
+        "sha2",
+        "sha3",
+    ]
+    commit = db["commits"].get("sha1")
+    assert commit["repo"] == 10 and commit["author"] == 1
+    assert commit["committer"] is None
+    assert db["raw_authors"].count == 1
+    assert commit["raw_author"] == commit["raw_committer"]
+    assert db["releases"].get(100)["repo"] == 10
+    assert db["assets"].get(1000)["release"] == 100
+    assert db["users"].get(1)["name"] == "cadeef"
+    assert {fk.other_table for fk in db["commits"].foreign_keys} == {
+        "users",
+        "raw_authors",
+        "repos",
+    }
+    assert src.watermark("commits") == "2023-08-03T00:00:00Z"
+    assert lines == ["1/1 repos"]
+    # Commits span two pages
+    assert len(api.requests) == 5
+    assert api.remaining == 4995
+
+
+def test_github__not_modified(github):
+    src, api = github
+    src.update()
+    # Commits since the watermark, a new URL
+    src.update()
+    etags = Database(src.database)[ETAGS_TABLE].count
+    remaining = api.remaining
+
+    api.requests.clear()
+    src.update()
+
+    # Everything was asked for conditionally and came back unchanged, for free
+    assert all("If-None-Match" in r.headers for r in api.requests)
+    assert api.remaining == remaining
+    assert Database(src.database)[ETAGS_TABLE].count == etags
+
+    # Only the new commit is fetched
+    api.commits.insert(0, api.commit(4))
+    src.update()
+    assert Database(src.database)["commits"].count == 4
+    commits = [r for r in api.requests if r.url.path.endswith("/commits")]
+    assert commits[-1].url.params["since"] == "2023-08-03T00:00:00Z"
+
+
+def test_github__rate_limit(github, mocker):
+    src, api = github
+    sleep = mocker.patch("leno.sources.github.time.sleep")
+    api.limited = 1
+
+    src.update()
+
+    # Waited for the reset instead of failing
+    assert sleep.call_count == 1
+    assert 0 < sleep.call_args.args[0] <= 60
+    assert Database(src.database)["commits"].count == 3
+
+    # Out of time before the reset
+    api.limited = 1
+    src.deadline = time.monotonic() + 1
+    with pytest.raises(source.SourceException, match="rate limit"):
+        src.update()
+
+
+def test_github__watermark_per_repo(github):
+    src, api = github
+    db = Database(src.database)
+    db["repos"].insert({"id": 99, "full_name": "cadeef/newer"}, pk="id")
+    db["commits"].insert(
+        {"sha": "newer", "repo": 99, "committer_date": "2024-01-01T00:00:00Z"},
+        pk="sha",
+    )
+
+    src.update()
+
+    # Commits older than another repo's are still fetched
+    assert db["commits"].count == 4
+    commits = [r for r in api.requests if r.url.path.endswith("/commits")]
+    assert "since" not in commits[0].url.params
+
+
+def test_github__deadline(github):
+    src, api = github
+    src.deadline = time.monotonic() - 1
+
+    with pytest.raises(source.SourceException, match="timed out"):
+        src.update()
+    assert api.requests == []
+
+
+def test_github__expired_etags(github):
+    src, api = github
+    src.update()
+    src.update()
+    db = Database(src.database)
+    db.execute(f"UPDATE [{ETAGS_TABLE}] SET checked_at = checked_at - 31 * 86400")
+    db.conn.commit()
+
+    api.requests.clear()
+    src.update()
+
+    # Those sent again are kept, the others are forgotten
+    assert {row["url"] for row in db[ETAGS_TABLE].rows} == {
+        str(r.url) for r in api.requests
+    }
+    assert all("If-None-Match" in r.headers for r in api.requests)
@@ -0,0 +1,87 @@
+import sqlite3
+
+from leno.stats import (
+    Run,
+    percentile,
+    record_run,
+    rows_added,
+    summarize,
+    table_marks,
+)
+
+DAY = 86400
+
+
+def test_table_marks(tmp_path):
+    database = tmp_path / "mastodon.db"
+    assert table_marks(database) == {}
+
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.executescript(
+            """
+            CREATE TABLE statuses (id INTEGER PRIMARY KEY, content TEXT);
+            INSERT INTO statuses (content) VALUES ('one'), ('two'), ('three');
+            DELETE FROM statuses WHERE content = 'one';
+            CREATE TABLE tags (name TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE followers (id INTEGER PRIMARY KEY);
+            CREATE VIEW recent AS SELECT * FROM statuses;
+            CREATE VIRTUAL TABLE statuses_fts USING fts5(content);
+            """
+        )
+    conn.close()
+
+    assert table_marks(database) == {"statuses": 3, "followers": 0}
+
+
+def test_rows_added():
+    before = {"statuses": 2, "followers": 5}
+    # followers was rebuilt with fewer rows
+    after = {"statuses": 4, "followers": 3, "bookmarks": 1}
+    assert rows_added(before, after) == {"statuses": 2, "bookmarks": 1}
+
+
+def test_percentile():
+    values = [5.0, 1.0, 4.0, 2.0, 3.0]
+    assert percentile(values, 0.5) == 3.0
+    assert percentile(values, 0.95) == 5.0
+    assert percentile([7.0], 0.5) == 7.0
+
+
+def test_summarize(tmp_path):
+    for day, (duration, rows, size) in enumerate([(10, 100, 1000), (20, 50, 2000)]):
+        start = 1_700_000_000 + day * DAY
+        record_run(
+            tmp_path,
+            Run(
+                source="mastodon",
+                started_at=start,
+                ended_at=start + duration,
+                ok=True,
+                steps={"mastodon-statuses": duration - 1, "timeline": 1},
+                rows_added={"statuses": rows},
+                db_size=size,
+            ),
+        )
+    record_run(
+        tmp_path,
+        Run(source="github", started_at=1, ended_at=2, ok=False, error="nope"),
+    )
+
+    (github,) = summarize(tmp_path, ["github"])
+    assert github.failures == 1
+    assert github.bytes_per_day is None
+
+    (mastodon,) = summarize(tmp_path, ["mastodon"])
+    assert mastodon.runs == 2
+    assert mastodon.p50 == 10
+    assert mastodon.p95 == 20
+    assert mastodon.rows_per_sec == 5
+    assert mastodon.db_size == 2000
+    assert mastodon.bytes_per_day == 1000
+    assert mastodon.rows_per_day == 50
+
+    # Only the most recent run
+    (mastodon,) = summarize(tmp_path, ["mastodon"], last=1)
+    assert mastodon.runs == 1
+    assert mastodon.p95 == 20
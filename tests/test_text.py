@@ -0,0 +1,42 @@
+import pytest
+
+from leno.text import html_to_text
+
+
+@pytest.mark.parametrize(
+    "content,expected",
+    (
+        ("<p>Plain &amp; simple</p>", "Plain & simple"),
+        ("<p>One</p><p>Two<br>Three</p>", "One\n\nTwo\nThree"),
+        # Links keep their target
+        (
+            '<p>Hello <a href="https://cade.pro">world</a></p>',
+            "Hello world (https://cade.pro)",
+        ),
+        # Links already showing their URL, even when shortened
+        (
+            '<a href="https://example.com/long/path"><span class="invisible">'
+            'https://</span><span class="ellipsis">example.com/lo</span>'
+            '<span class="invisible">ng/path</span></a>',
+            "https://example.com/long/path",
+        ),
+        ('<a href="https://example.com/a">example.com/a…</a>', "example.com/a…"),
+        # Mentions and hashtags
+        (
+            '<a href="https://ioc.exchange/@leno" class="mention">@<span>leno</span>'
+            '</a> <a href="https://ioc.exchange/tags/til">#<span>til</span></a>',
+            "@leno #til",
+        ),
+        ("<p>Visible</p><script>hidden()</script>", "Visible"),
+        ("", ""),
+    ),
+)
+def test_html_to_text(content, expected):
+    assert html_to_text(content) == expected
+
+
+def test_html_to_text__memoized():
+    html_to_text.cache_clear()
+    html_to_text("<p>Same status</p>")
+    html_to_text("<p>Same status</p>")
+    assert html_to_text.cache_info().hits == 1
@@ -0,0 +1,100 @@
+import sqlite3
+
+import httpx
+
+from leno.lib import Leno, LocalLeno
+from leno.timeline import update_timeline
+
+from . import fixtures
+
+
+def test_update_timeline(tmp_path):
+    fixtures.local_databases(tmp_path)
+    firehose = list(LocalLeno(tmp_path).firehose())
+
+    assert update_timeline(tmp_path, "mastodon") == 2
+    assert update_timeline(tmp_path, "github") == 1
+    assert update_timeline(tmp_path, "pocket") == 0
+    # Nothing changed, nothing written
+    assert update_timeline(tmp_path, "mastodon") == 0
+
+    # Served from the timeline now, with the same items
+    assert list(LocalLeno(tmp_path).firehose()) == firehose
+
+    mastodon = sqlite3.connect(tmp_path / "mastodon.db")
+    with mastodon:
+        mastodon.execute("UPDATE favorites SET content = '<p>Edited</p>'")
+        mastodon.execute(
+            "INSERT INTO bookmarks VALUES "
+            "('3', 'new', '<p>New</p>', '2023-08-04T12:00:00.000Z', 'https://x')"
+        )
+    mastodon.close()
+
+    assert update_timeline(tmp_path, "mastodon") == 2
+    items = list(LocalLeno(tmp_path).firehose(limit=2))
+    assert [i.description for i in items] == ["New", "Edited"]
+
+    assert update_timeline(tmp_path, "mastodon", full=True) == 3
+
+    # Bookmarked since, but older than everything in the timeline
+    mastodon = sqlite3.connect(tmp_path / "mastodon.db")
+    with mastodon:
+        mastodon.execute(
+            "INSERT INTO bookmarks VALUES "
+            "('4', 'old', '<p>Old</p>', '2020-01-01T12:00:00.000Z', 'https://x')"
+        )
+    mastodon.close()
+
+    assert update_timeline(tmp_path, "mastodon") == 1
+    assert list(LocalLeno(tmp_path).firehose())[-1].description == "Old"
+
+
+def test_update_timeline__draft_releases(tmp_path):
+    fixtures.local_databases(tmp_path)
+    github = sqlite3.connect(tmp_path / "github.db")
+    with github:
+        github.execute(
+            "INSERT INTO releases (id, repo, tag_name) "
+            "SELECT 99, repo, 'draft' FROM releases LIMIT 1"
+        )
+    github.close()
+
+    assert len(list(LocalLeno(tmp_path).firehose())) == 3
+    assert update_timeline(tmp_path, "github") == 1
+
+
+def test_update_timeline__partial(tmp_path):
+    """
+    Sources missing from the timeline are still served from their databases
+    """
+    fixtures.local_databases(tmp_path)
+    firehose = list(LocalLeno(tmp_path).firehose())
+
+    update_timeline(tmp_path, "github")
+
+    assert list(LocalLeno(tmp_path).firehose()) == firehose
+    assert {i.label for i in LocalLeno(tmp_path).firehose()} == {
+        "bookmark",
+        "favorite",
+        "release",
+    }
+
+
+def test_leno__firehose_timeline():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/timeline/timeline.json"
+        assert request.url.params["_sort_desc"] == "ts"
+        row = {
+            "label": "bookmark",
+            "title": "t",
+            "description": "d",
+            "ts": 1690891200,
+            "link": None,
+        }
+        return httpx.Response(200, json={"rows": [row]})
+
+    leno = Leno(
+        "http://127.0.0.1:8001", "token", transport=httpx.MockTransport(handler)
+    )
+    (item,) = leno.firehose(limit=1, timeline=True)
+    assert item.timestamp == 1690891200